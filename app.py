@@ -1,35 +1,64 @@
 #!/usr/bin/env python3
 import os
-from flask_bootstrap import Bootstrap5
-from flask_ckeditor import CKEditor
-from flask_login import LoginManager
-from flask import Flask, render_template, render_template_string, request, redirect
-from db_seed import setup_db
+import click
+from flask import Flask, render_template, redirect
+from extensions import bootstrap, ckeditor, login_manager
+from models import engine, read_engine, shards, Session, ReadSession
 from routes import init
+from utils.assets import init_assets
+from utils.compression import init_compression
+from utils.fragment_cache import init_fragment_cache
+from utils.image_jobs import init_image_workers
+from utils.metrics import init_metrics
+from utils.profiler import init_profiler
+from utils.sql_stats import init_sql_stats
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("SECRET_KEY", "fallback-secret-key-for-dev-only")
-app.config["BOOTSTRAP_SERVE_LOCAL"] = True
-app.config["CKEDITOR_SERVE_LOCAL"] = True
-# Disable debug mode in production
-app.config["DEBUG"] = False
-bootstrap = Bootstrap5(app)
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "login"
-ckeditor = CKEditor()
 
-ckeditor.init_app(app)
-init()
-setup_db()
+def create_app() -> Flask:
+    """
+    Build the application. Does no schema or seed work, that is `flask --app app init-db`.
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SECRET_KEY", "fallback-secret-key-for-dev-only")
+    app.config["BOOTSTRAP_SERVE_LOCAL"] = True
+    app.config["CKEDITOR_SERVE_LOCAL"] = True
+    # Disable debug mode in production
+    app.config["DEBUG"] = False
 
+    bootstrap.init_app(app)
+    login_manager.init_app(app)
+    login_manager.login_view = "login.login"
+    ckeditor.init_app(app)
+    init_metrics(app, engine, read_engine, *shards.shard_engines)
+    init_sql_stats(app, engine, read_engine, *shards.shard_engines)
+    init_profiler(app)
+    init_fragment_cache(app)
+    init_image_workers(app)
+    init_compression(app)
+    init(app)
+    init_assets(app)
 
-@login_manager.unauthorized_handler
-def unauthorized():
-    return redirect("/login")
+    @app.teardown_appcontext
+    def remove_sessions(_error):
+        Session.remove()
+        ReadSession.remove()
+        shards.remove()
 
+    @login_manager.unauthorized_handler
+    def unauthorized():
+        return redirect("/login")
 
-@app.errorhandler(404)
-def page_not_found(error):
-    # Don't expose detailed error information in production
-    return render_template("404.html"), 404
+    @app.errorhandler(404)
+    def page_not_found(error):
+        # Don't expose detailed error information in production
+        return render_template("404.html"), 404
+
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create or upgrade the schema and seed an empty database."""
+        # Local import: only this command needs the seeding code
+        from db_seed import init_db  # pylint: disable=import-outside-toplevel
+        init_db()
+        click.echo("Database ready")
+
+    return app
@@ -0,0 +1,138 @@
+"""
+Per-route benchmarks at several dataset sizes.
+
+Every scale runs in its own process against a copy of a cached synthetic
+database, and reports throughput, p50/p99 latency and SQL statements per
+route plus the process's peak RSS. Results are compared with a stored
+baseline: a slower p50 (beyond the tolerance) or more queries per request
+fails the run. benchmarks/baseline.json holds the 1000-note scale; its
+latencies are only meaningful on the machine that saved it, so CI compares
+query counts alone (--compare queries).
+
+Usage: python -m benchmarks [--scales 1000 100000 1000000] [--output results.json]
+                            [--baseline benchmarks/baseline.json] [--save-baseline]
+                            [--compare all|queries]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Dict, List
+
+from benchmarks.dataset import get_database
+
+DEFAULT_SCALES = [1000, 100000, 1000000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_DATA_DIR = '.benchmarks'
+
+
+def run_scale(notes: int, data_dir: str, iterations: int, warmup: int) -> Dict:
+    start = perf_counter()
+    database = get_database(data_dir, notes)
+    build_seconds = perf_counter() - start
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as directory:
+        # Routes write (notes, signups); keep the cached database pristine
+        working_copy = os.path.join(directory, 'database.db')
+        shutil.copyfile(database, working_copy)
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.routes', '--database', working_copy,
+             '--iterations', str(iterations), '--warmup', str(warmup)],
+            check=True, stdout=subprocess.PIPE, text=True).stdout
+
+    result = json.loads(output.strip().splitlines()[-1])
+    result['dataset_seconds'] = round(build_seconds, 2)
+    return result
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, latency: bool = True) -> List[str]:
+    """
+    Regressions of results against a baseline, as readable lines.
+
+    Args:
+        results: Results of this run
+        baseline: Stored results
+        tolerance: Allowed p50 slowdown, as a fraction
+        latency: Also compare p50 latencies, not only query counts
+    """
+    regressions = []
+    for scale, current in results['scales'].items():
+        previous_routes = baseline.get('scales', {}).get(scale, {}).get('routes', {})
+        for route, stats in current['routes'].items():
+            previous = previous_routes.get(route)
+            if previous is None:
+                continue
+            if stats['queries'] > previous['queries']:
+                regressions.append(f"{scale} notes, {route}: {stats['queries']} queries (was {previous['queries']})")
+            if latency and stats['p50_ms'] > previous['p50_ms'] * (1 + tolerance):
+                regressions.append(f"{scale} notes, {route}: p50 {stats['p50_ms']} ms (was {previous['p50_ms']} ms)")
+    return regressions
+
+
+def print_results(results: Dict) -> None:
+    for scale, current in results['scales'].items():
+        print(f"\n{scale} notes (peak RSS {current['peak_rss_kb'] // 1024} MiB)")
+        print(f"{'route':36} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'queries':>8}")
+        for route, stats in current['routes'].items():
+            print(f"{route:36} {stats['throughput_rps']:9.1f} {stats['p50_ms']:9.2f} "
+                  f"{stats['p99_ms']:9.2f} {stats['queries']:8.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark every route at several dataset sizes')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help='Numbers of notes')
+    parser.add_argument('--iterations', type=int, default=100, help='Timed requests per route')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per route')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Cache of generated databases')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p50 slowdown (default: 0.25)')
+    parser.add_argument('--compare', choices=['all', 'queries'], default='all',
+                        help='Compare latencies and query counts, or query counts only (default: all)')
+    args = parser.parse_args()
+
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'iterations': args.iterations,
+        'scales': {str(notes): run_scale(notes, args.data_dir, args.iterations, args.warmup)
+                   for notes in args.scales},
+    }
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+        print(f'\nBaseline saved to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'\nNo baseline at {args.baseline}, run with --save-baseline to create one')
+        return
+
+    with open(args.baseline, encoding='utf-8') as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance, args.compare == 'all')
+
+    if regressions:
+        print('\nRegressions against the baseline:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+
+    print('\nNo regressions against the baseline')
+
+
+if __name__ == '__main__':
+    main()
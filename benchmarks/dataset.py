@@ -0,0 +1,54 @@
+"""
+Synthetic databases for the benchmarks, cached per scale.
+"""
+import os
+
+from sqlalchemy import create_engine, insert
+
+from db_seed import SeedProfile, bulk_seed, seed_email, seed_password
+from models import RegistrationCode, migrate
+
+PASSWORD = seed_password(0)
+BCRYPT_ROUNDS = 4
+NOTES_PER_USER = 100
+
+
+def user_email(user_id: int) -> str:
+    return seed_email(user_id)
+
+
+def build(path: str, notes: int, seed: int = 0) -> None:
+    """
+    Create a database with `notes` notes spread over notes / 100 users.
+
+    User 1 is an admin; every user's password is PASSWORD.
+
+    Args:
+        path: SQLite file to create
+        notes: Number of notes, rounded to a multiple of 100
+        seed: Random seed, the same seed builds the same data
+    """
+    engine = create_engine('sqlite:///' + path)
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(RegistrationCode.__table__), [{'code': 'benchmark-setup'}])
+
+    profile = SeedProfile(users=max(notes // NOTES_PER_USER, 1), notes_per_user=NOTES_PER_USER,
+                          rounds=BCRYPT_ROUNDS)
+    bulk_seed(engine, profile, seed)
+    engine.dispose()
+
+
+def get_database(directory: str, notes: int) -> str:
+    """
+    Path of the cached database for a scale, building it on first use.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'notes_{notes}.db')
+    if not os.path.exists(path):
+        building = path + '.building'
+        if os.path.exists(building):
+            os.remove(building)
+        build(building, notes)
+        os.replace(building, path)
+    return path
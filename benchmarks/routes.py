@@ -0,0 +1,136 @@
+"""
+Time every route against one database; run by benchmarks.__main__ in a
+fresh process per scale, since the app binds its engines at import.
+
+Usage: python -m benchmarks.routes --database PATH [--iterations 100]
+"""
+import argparse
+import json
+import os
+import resource
+from statistics import quantiles
+from time import perf_counter
+from typing import Callable, Dict, List
+
+ADMIN_ID = 1
+USER_ID = 2
+
+
+def _configure_environment(database: str) -> None:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + database
+    # Cost of the dataset's hashes (dataset.BCRYPT_ROUNDS), so logins do not rehash
+    os.environ['BCRYPT_ROUNDS'] = '4'
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+    os.environ['IMAGE_WORKERS'] = '0'
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    os.environ.pop('USER_CACHE_SHARED_FILE', None)
+
+
+def measure(send: Callable[[int], object], expected_status: int, iterations: int, warmup: int,
+            queries: List[int]) -> Dict:
+    """
+    Call a route repeatedly and summarize latency and query counts.
+
+    Args:
+        send: Sends request number n and returns the response
+        expected_status: Any other status aborts the benchmark
+        iterations: Timed requests
+        warmup: Untimed requests first
+        queries: Statement counter incremented by the engines
+    """
+    latencies = []
+    query_counts = []
+    for number in range(warmup + iterations):
+        queries_before = queries[0]
+        start = perf_counter()
+        response = send(number)
+        response.get_data()
+        elapsed = perf_counter() - start
+        if response.status_code != expected_status:
+            raise RuntimeError(f'Unexpected status {response.status_code} ({response.location})')
+        if number >= warmup:
+            latencies.append(elapsed)
+            query_counts.append(queries[0] - queries_before)
+
+    cuts = quantiles(latencies, n=100, method='inclusive')
+    return {
+        'iterations': iterations,
+        'throughput_rps': round(iterations / sum(latencies), 1),
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'queries': round(sum(query_counts) / iterations, 2),
+    }
+
+
+def run(database: str, iterations: int, warmup: int) -> Dict:
+    _configure_environment(database)
+
+    # The engines are built on import, from the environment set above
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import event
+    from app import create_app
+    from benchmarks.dataset import PASSWORD, user_email
+    from db_seed import init_db
+    from models import RegistrationCode, Session, engine, read_engine
+
+    init_db()
+    app = create_app()
+    queries = [0]
+
+    def count_query(*_args):
+        queries[0] += 1
+
+    for bound in (engine, read_engine):
+        event.listen(bound, 'before_cursor_execute', count_query)
+
+    signup_codes = [f'benchmark-signup-{number}' for number in range(warmup + iterations)]
+    with Session() as session:
+        session.add_all(RegistrationCode(code) for code in signup_codes)
+        session.commit()
+
+    def logged_in(email: str):
+        client = app.test_client()
+        client.post('/login', data={'email': email, 'password': PASSWORD})
+        return client
+
+    user = logged_in(user_email(USER_ID))
+    admin = logged_in(user_email(ADMIN_ID))
+    anonymous = app.test_client()
+    pid = os.getpid()
+
+    routes = {
+        'GET /home': (lambda n: user.get('/home'), 200),
+        'GET /notes': (lambda n: user.get('/notes'), 200),
+        'POST /notes': (lambda n: user.post('/notes', data={'title': f'Benchmark {n}', 'text': 'benchmark note'}),
+                        302),
+        'GET /search': (lambda n: user.get('/search?search=lorem ipsum'), 200),
+        'GET /accounts/<id>/notes': (lambda n: user.get(f'/accounts/{USER_ID}/notes'), 200),
+        'POST /login': (lambda n: anonymous.post('/login', data={
+            'email': user_email(USER_ID), 'password': PASSWORD}), 302),
+        'POST /signup': (lambda n: app.test_client().post('/signup', data={
+            'email': f'signup-{pid}-{n}@example.com', 'password': PASSWORD,
+            'registration_code': signup_codes[n]}), 302),
+        'GET /registration-codes': (lambda n: admin.get('/registration-codes'), 200),
+        'POST /registration-codes': (lambda n: admin.post('/registration-codes'), 302),
+        'GET /registration-codes/export.csv': (lambda n: admin.get('/registration-codes/export.csv'), 200),
+    }
+
+    results = {name: measure(send, status, iterations, warmup, queries) for name, (send, status) in routes.items()}
+    return {
+        'routes': results,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark every route against one database')
+    parser.add_argument('--database', required=True)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=10)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.database, args.iterations, args.warmup)))
+
+
+if __name__ == '__main__':
+    main()
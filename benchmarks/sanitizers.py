@@ -0,0 +1,108 @@
+"""
+Micro-benchmarks for utils/input_sanitizer against the straightforward
+implementations they replaced, over realistic 5000-character note bodies.
+tests/test_input_sanitizer.py checks that both give the same results.
+
+Usage: python -m benchmarks.sanitizers [--number 2000]
+"""
+import argparse
+import html
+import random
+import re
+import timeit
+from typing import Callable, List, Optional
+
+from utils.input_sanitizer import sanitize_email, sanitize_input, sanitize_many, sanitize_text_field
+
+NOTE_LENGTH = 5000
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do']
+SPECIALS = ['&', '<', '>', '"', "'", '\x00', ':', '<script>', '</script>', 'javascript:', 'VBScript:',
+            'JaVaScRiPt:', 'vbjavascript:script:', 'https://example.com', 'ſcript:', 'K']
+# What notes usually contain: punctuation, quotes and links
+PROSE_SPECIALS = ['&', '"', "'", ':', '(', ')', 'https://example.com/page?a=1&b=2', 'e.g.', '10:30']
+
+
+def legacy_sanitize_input(text: Optional[str]) -> Optional[str]:
+    if text is None:
+        return None
+    text = text.replace('\x00', '')
+    text = html.escape(text)
+    text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.IGNORECASE | re.DOTALL)
+    text = re.sub(r'javascript:', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'vbscript:', '', text, flags=re.IGNORECASE)
+    return text
+
+
+def legacy_sanitize_email(email: str) -> str:
+    if email is None:
+        return ""
+    email = email.replace('\x00', '').strip()
+    email_pattern = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+    if not email_pattern.match(email):
+        raise ValueError("Invalid email format")
+    return email
+
+
+def legacy_sanitize_text_field(text: str, max_length: int = 1000) -> str:
+    if text is None:
+        return ""
+    text = text.replace('\x00', '')[:max_length]
+    return html.escape(text)
+
+
+def note_body(rng: random.Random, length: int = NOTE_LENGTH, special_ratio: float = 0.05,
+              specials: List[str] = None) -> str:
+    """
+    Prose-like text with a sprinkling of characters the sanitizers act on.
+    """
+    specials = specials or SPECIALS
+    parts: List[str] = []
+    size = 0
+    while size < length:
+        part = rng.choice(specials) if rng.random() < special_ratio else rng.choice(WORDS)
+        parts.append(part)
+        size += len(part) + 1
+    return ' '.join(parts)[:length]
+
+
+def _time(function: Callable[[], object], number: int) -> float:
+    """
+    Best of 5 runs, in microseconds per call.
+    """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def benchmark(number: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    bodies = {
+        'plain 5000 chars': note_body(rng, special_ratio=0),
+        'prose 5000 chars': note_body(rng, specials=PROSE_SPECIALS),
+        'hostile 5000 chars': note_body(rng),
+    }
+    batch = [note_body(rng, specials=PROSE_SPECIALS) for _ in range(100)]
+
+    print(f"{'function':46} {'legacy us':>10} {'current us':>11} {'speedup':>8}")
+
+    def row(name: str, legacy: Callable, current: Callable, calls: int = number) -> None:
+        before, after = _time(legacy, calls), _time(current, calls)
+        print(f'{name:46} {before:10.2f} {after:11.2f} {before / after:7.2f}x')
+
+    for label, body in bodies.items():
+        row(f'sanitize_input, {label}', lambda: legacy_sanitize_input(body), lambda: sanitize_input(body))
+        row(f'sanitize_text_field, {label}', lambda: legacy_sanitize_text_field(body, NOTE_LENGTH),
+            lambda: sanitize_text_field(body, NOTE_LENGTH))
+    row('sanitize_email', lambda: legacy_sanitize_email('user@example.com'),
+        lambda: sanitize_email('user@example.com'), number * 10)
+    row('sanitize_many, 100 x 5000 chars prose', lambda: [legacy_sanitize_text_field(text, NOTE_LENGTH) for text in batch],
+        lambda: sanitize_many(batch, NOTE_LENGTH), max(number // 100, 1))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time the sanitizers against their legacy versions')
+    parser.add_argument('--number', type=int, default=2000, help='Calls per timing run (default: 2000)')
+    args = parser.parse_args()
+    benchmark(args.number)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,58 @@
+"""
+Schema and seed setup (init_db, run by `flask --app app init-db`) and bulk
+data generation for load testing.
+
+The bulk seeder appends synthetic users and notes; stop the app while it
+runs, it loads with an in-memory journal and no fsyncs and rebuilds the
+notes indexes at the end.
+Notes are written to the main file; to load a sharded layout (NOTE_SHARDS),
+seed and then split it with `python -m utils.shards split`.
+
+Usage: python -m db_seed --users 1000 --notes-per-user 10000 [--database URL]
+"""
+import argparse
 import os
+import random
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from math import log, sqrt
+from time import perf_counter
+from typing import Iterator, List, Tuple
 from uuid import uuid4
-from bcrypt import hashpw, gensalt
-from models import RegistrationCode, User, Note, Session
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.engine import Connection, Engine
+
+from models import DATABASE_URL, RegistrationCode, User, Note, Session, engine, migrate, rebuild_feed, shards
+from utils.passwords import ROUNDS, PasswordHasher
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+         'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+         'ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla '
+         'pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim '
+         'id est laborum').split()
+# Distinct titles/texts generated up front; notes pick from these pools
+TEXT_POOL_SIZE = 4096
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def init_db():
+    """
+    Create or upgrade the schema, then seed an empty database. Run once per deploy.
+    """
+    migrate(engine)
+    shards.migrate()
+    setup_db()
 
 
 def setup_db():
     with Session() as session:
-        if session.query(RegistrationCode).count() == 0:
+        # One cheap query, the inserts below only run on an empty database
+        has_codes, has_users = session.execute(
+            select(select(RegistrationCode.id).exists(), select(User.id).exists())).one()
+
+        if not has_codes:
             static_code = os.environ.get('STATIC_REGISTRATION_CODE', 'a36e990b-0024-4d55-b74a-f8d7528e1764')
             session.add(RegistrationCode(static_code))
 
@@ -14,22 +60,23 @@ def setup_db():
                 session.add(RegistrationCode(str(uuid4())))
             session.commit()
 
-        if session.query(User).count() == 0:
+        if not has_users:
             # Use environment variables for default credentials
             user_email = os.environ.get('DEFAULT_USER_EMAIL', 'user@evfa.com')
             user_password = os.environ.get('DEFAULT_USER_PASSWORD', 'StrongPassword123!')
             admin_email = os.environ.get('DEFAULT_ADMIN_EMAIL', 'admin@evfa.com')
             admin_password = os.environ.get('DEFAULT_ADMIN_PASSWORD', 'StrongAdminPassword123!')
-            
-            user = User(user_email, hashpw(user_password.encode('utf-8'), gensalt()).decode())
-            admin = User(admin_email,
-                         hashpw(admin_password.encode('utf-8'), gensalt()).decode(), True)
+
+            # Startup runs before uWSGI forks, keep the hashing processes out of the master
+            hasher = PasswordHasher(workers=0)
+            user = User(user_email, hasher.hash(user_password))
+            admin = User(admin_email, hasher.hash(admin_password), True)
 
             session.add(user)
             session.add(admin)
             session.commit()
 
-            if session.query(Note).count() == 0:
+            if not session.execute(select(select(Note.id).exists())).scalar():
                 user_note = Note(id=None,
                                  created_at=None,
                                  title='Shared User Note',
@@ -44,6 +91,185 @@ def setup_db():
                     private=True,
                     user_id=admin.id)
 
-                session.add(user_note)
-                session.add(admin_note)
-                session.commit()
+                # Each note goes to its owner's shard, the main database unless sharded
+                for note in (user_note, admin_note):
+                    with shards.session_for_user(note.user_id) as note_session:
+                        note.id = shards.allocate_note_ids(note_session, note.user_id, 1)[0]
+                        note_session.add(note)
+                        note_session.commit()
+
+
+@dataclass
+class SeedProfile:
+    """
+    Shape of the generated data.
+
+    Args:
+        users: Users to create
+        notes_per_user: Average notes per user, authors are picked at random
+        private_ratio: Share of private notes
+        text_words: Minimum and maximum words per note text
+        text_distribution: 'uniform' or 'lognormal' (mostly short, a long tail)
+        passwords: Distinct passwords; user n gets seed-password-(n % passwords)
+        admins: The first this many users are admins
+        days: Notes are spread over this many days up to now
+        rounds: bcrypt cost of the password hashes
+    """
+    users: int = 100
+    notes_per_user: int = 100
+    private_ratio: float = 0.3
+    text_words: Tuple[int, int] = (5, 200)
+    text_distribution: str = 'lognormal'
+    passwords: int = 1
+    admins: int = 1
+    days: int = 365
+    rounds: int = ROUNDS
+
+
+def seed_email(user_id: int) -> str:
+    return f'seed{user_id}@example.com'
+
+
+def seed_password(number: int) -> str:
+    return f'seed-password-{number}'
+
+
+def _word_counts(profile: SeedProfile, rng: random.Random) -> Iterator[int]:
+    low, high = profile.text_words
+    if profile.text_distribution == 'uniform':
+        while True:
+            yield rng.randint(low, high)
+
+    # Median at the geometric mean of the bounds
+    median = log(sqrt(low * high))
+    while True:
+        yield min(max(int(rng.lognormvariate(median, 0.75)), low), high)
+
+
+def _text_pool(profile: SeedProfile, rng: random.Random) -> List[str]:
+    counts = _word_counts(profile, rng)
+    return [' '.join(rng.choices(WORDS, k=next(counts))) for _ in range(TEXT_POOL_SIZE)]
+
+
+@contextmanager
+def bulk_loading(connection: Connection) -> Iterator[None]:
+    """
+    Load without fsyncs and without maintaining the notes indexes and
+    triggers, then rebuild them and the full-text index.
+
+    The journal is kept in memory rather than switched off: still no journal
+    writes, but a failed load rolls back its open transaction instead of
+    leaving half-written pages behind.
+    """
+    journal_mode = connection.exec_driver_sql('PRAGMA journal_mode').scalar()
+    connection.exec_driver_sql('PRAGMA journal_mode = MEMORY')
+    connection.exec_driver_sql('PRAGMA synchronous = OFF')
+    connection.exec_driver_sql('PRAGMA cache_size = -262144')
+    connection.exec_driver_sql('PRAGMA temp_store = MEMORY')
+
+    schema = connection.exec_driver_sql(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE tbl_name = 'notes' AND type IN ('index', 'trigger') AND sql IS NOT NULL").all()
+    for kind, name, _ in schema:
+        connection.exec_driver_sql(f'DROP {kind.upper()} {name}')
+    connection.commit()
+
+    try:
+        yield
+    finally:
+        connection.rollback()
+        for _, _, sql in schema:
+            connection.exec_driver_sql(sql)
+        connection.exec_driver_sql("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+        # The version and feed triggers were dropped too, catch up by hand
+        connection.exec_driver_sql("UPDATE data_versions SET version = version + 1")
+        rebuild_feed(connection)
+        connection.exec_driver_sql('ANALYZE')
+        connection.commit()
+        connection.exec_driver_sql(f'PRAGMA journal_mode = {journal_mode}')
+
+
+def bulk_seed(engine: Engine, profile: SeedProfile, seed: int = 0,
+              batch_size: int = 50000, commit_every: int = 1000000) -> Tuple[int, int]:
+    """
+    Append generated users and notes to a migrated database.
+
+    Args:
+        engine: Engine of the database
+        profile: What to generate
+        seed: Random seed, the same seed and profile generate the same data
+        batch_size: Rows per executemany
+        commit_every: Rows per transaction
+
+    Returns:
+        Number of users and notes created
+    """
+    rng = random.Random(seed)
+    hasher = PasswordHasher(profile.rounds, workers=0)
+    # One bcrypt call per distinct password, not per user
+    hashes = [hasher.hash(seed_password(number)) for number in range(profile.passwords)]
+    titles = _text_pool(SeedProfile(text_words=(1, 8), text_distribution='uniform'), rng)
+    texts = _text_pool(profile, rng)
+    note_count = profile.users * profile.notes_per_user
+
+    with engine.connect() as connection, bulk_loading(connection):
+        first_id = (connection.execute(select(User.id).order_by(User.id.desc()).limit(1)).scalar() or 0) + 1
+        user_ids = range(first_id, first_id + profile.users)
+        for start in range(0, profile.users, batch_size):
+            connection.execute(insert(User.__table__), [
+                {'id': user_id, 'email': seed_email(user_id), 'password': hashes[user_id % profile.passwords],
+                 'is_admin': user_id - first_id < profile.admins}
+                for user_id in user_ids[start:start + batch_size]
+            ])
+        connection.commit()
+
+        now = datetime.now(timezone.utc)
+        step = timedelta(days=profile.days) / max(note_count, 1)
+        first_created_at = now - timedelta(days=profile.days)
+        statement = 'INSERT INTO notes (title, text, user_id, private, created_at) VALUES (?, ?, ?, ?, ?)'
+        for start in range(0, note_count, batch_size):
+            connection.exec_driver_sql(statement, [
+                (rng.choice(titles), rng.choice(texts), rng.choice(user_ids), rng.random() < profile.private_ratio,
+                 (first_created_at + step * number).strftime(DATETIME_FORMAT))
+                for number in range(start, min(start + batch_size, note_count))
+            ])
+            if (start + batch_size) % commit_every < batch_size:
+                connection.commit()
+        connection.commit()
+
+    return profile.users, note_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Append generated users and notes for load testing')
+    parser.add_argument('--database', default=DATABASE_URL, help='Database URL (default: DATABASE_URL)')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--notes-per-user', type=int, default=100)
+    parser.add_argument('--scale', type=float, default=1,
+                        help='Multiply the number of users, e.g. --scale 1000 for 10M notes with the defaults')
+    parser.add_argument('--private-ratio', type=float, default=0.3)
+    parser.add_argument('--text-words', type=int, nargs=2, default=(5, 200), metavar=('MIN', 'MAX'))
+    parser.add_argument('--text-distribution', choices=('uniform', 'lognormal'), default='lognormal')
+    parser.add_argument('--passwords', type=int, default=1, help='Distinct passwords, seed-password-<n>')
+    parser.add_argument('--admins', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=ROUNDS, help='bcrypt cost (default: BCRYPT_ROUNDS)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--batch-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    profile = SeedProfile(
+        users=int(args.users * args.scale), notes_per_user=args.notes_per_user,
+        private_ratio=args.private_ratio, text_words=tuple(args.text_words),
+        text_distribution=args.text_distribution, passwords=args.passwords,
+        admins=args.admins, rounds=args.rounds,
+    )
+    engine = create_engine(args.database)
+    migrate(engine)
+
+    start = perf_counter()
+    users, notes = bulk_seed(engine, profile, args.seed, args.batch_size)
+    print(f'Seeded {users} users and {notes} notes in {perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
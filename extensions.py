@@ -0,0 +1,8 @@
+from flask_bootstrap import Bootstrap5
+from flask_ckeditor import CKEditor
+from flask_login import LoginManager
+
+# Bound to the app in app.create_app
+bootstrap = Bootstrap5()
+login_manager = LoginManager()
+ckeditor = CKEditor()
@@ -0,0 +1,8 @@
+from wtforms import Form, IntegerField, validators
+
+from utils.registration_codes import MAX_BULK_CODES
+
+
+class RegistrationCodeForm(Form):
+    count = IntegerField('Number of codes', [validators.Optional(), validators.NumberRange(min=1, max=MAX_BULK_CODES)],
+                         default=1)
@@ -0,0 +1,4 @@
+from utils.maintenance import run
+
+# uWSGI mule entry point (mule = maintenance_mule.py), see uwsgi.ini
+run()
@@ -1,19 +1,27 @@
-from os import path
-from sqlalchemy import create_engine
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import configure_mappers, scoped_session, sessionmaker
 from .base_model import BaseModel
 from .user import User
 from .registration_code import RegistrationCode
 from .note import Note
+from .image_job import ImageJob
+from .feed_entry import FeedEntry
+from .engine import DATABASE_URL, create_db_engine, dispose_after_fork
+from .migrations import migrate, rebuild_feed
+from .shards import SHARD_COUNT, ShardRouter
 
-basedir = path.abspath(path.dirname(__file__))
+# Creates backrefs such as Note.user now, query builders use them as attributes
+configure_mappers()
 
-engine: Engine = create_engine(
-    'sqlite:///' + path.join(basedir, '..', 'database', 'database.db'),
-    echo=True,
-)
+engine: Engine = create_db_engine(DATABASE_URL)
+read_engine: Engine = create_db_engine(DATABASE_URL, read_only=True)
 
-BaseModel.metadata.create_all(bind=engine)
+# One session per thread, removed when the Flask request ends
+Session = scoped_session(sessionmaker(bind=engine))
+# Connections that reject writes, for GET routes
+ReadSession = scoped_session(sessionmaker(bind=read_engine))
 
-Session = sessionmaker(bind=engine)
+dispose_after_fork(engine, read_engine)
+
+# Where notes live, the main database unless NOTE_SHARDS is set
+shards = ShardRouter(SHARD_COUNT, DATABASE_URL, engine, read_engine, Session, ReadSession)
@@ -0,0 +1,99 @@
+import os
+from os import path
+from typing import Dict
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Engine
+
+basedir = path.abspath(path.dirname(__file__))
+
+DATABASE_URL = os.environ.get(
+    'DATABASE_URL', 'sqlite:///' + path.join(basedir, '..', 'database', 'database.db'))
+
+JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_choice(name: str, default: str, choices: set) -> str:
+    value = os.environ.get(name, default).upper()
+    if value not in choices:
+        raise ValueError(f'{name} must be one of {sorted(choices)}')
+    return value
+
+
+def sqlite_pragmas(read_only: bool = False) -> Dict[str, object]:
+    """
+    Connection pragmas, overridable through DB_* environment variables.
+
+    Args:
+        read_only: Reject writes on these connections
+
+    Returns:
+        Pragma name to value, applied in order on every new connection
+    """
+    pragmas = {
+        'journal_mode': _env_choice('DB_JOURNAL_MODE', 'WAL', JOURNAL_MODES),
+        'synchronous': _env_choice('DB_SYNCHRONOUS', 'NORMAL', SYNCHRONOUS_MODES),
+        'busy_timeout': int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000)),
+        'cache_size': int(os.environ.get('DB_CACHE_SIZE', -20000)),  # negative = KiB
+        'mmap_size': int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024)),
+    }
+    if read_only:
+        pragmas['query_only'] = 'ON'
+    return pragmas
+
+
+def create_db_engine(url: str = DATABASE_URL, read_only: bool = False) -> Engine:
+    """
+    Build an engine from the DB_* environment profile.
+
+    Args:
+        url: Database URL
+        read_only: Build the read-only pool used by GET routes
+
+    Returns:
+        Configured engine
+    """
+    options = {'echo': _env_flag('DB_ECHO', False)}
+    # In-memory SQLite keeps its single-connection pool
+    if make_url(url).database not in (None, '', ':memory:'):
+        options.update(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+            pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            pool_pre_ping=True,
+        )
+
+    engine = create_engine(url, **options)
+
+    if engine.dialect.name == 'sqlite':
+        pragmas = sqlite_pragmas(read_only)
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, _connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+            cursor.close()
+
+    return engine
+
+
+def dispose_after_fork(*engines: Engine) -> None:
+    """
+    Give forked processes (uWSGI workers) their own connection pools.
+
+    The parent's connections are dropped without being closed, the parent
+    keeps using them.
+
+    Args:
+        engines: Engines created before the fork
+    """
+    def reset_pools():
+        for engine in engines:
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=reset_pools)
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer
+from .base_model import Base
+
+
+class FeedEntry(Base):
+    """
+    One row per note, saying who sees it on /home. Maintained by triggers on
+    notes (see migrations.create_feed), never written by the app.
+
+    audience is PUBLIC for public notes and the owner's id for private
+    ones, so a user's feed is the entries of two audiences: PUBLIC and
+    their own id.
+    """
+    __tablename__ = "feed"
+    __table_args__ = (
+        Index('ix_feed_audience_created_at', 'audience', 'created_at'),
+    )
+
+    PUBLIC = 0
+    # Private notes without an owner are visible to nobody
+    NOBODY = -1
+
+    note_id = Column(Integer, ForeignKey("notes.id"), primary_key=True, autoincrement=False)
+    audience = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True))
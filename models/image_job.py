@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, Index
+from .base_model import BaseModel
+
+
+class ImageJob(BaseModel):
+    """
+    Queued profile image download, processed by utils.image_jobs workers.
+    """
+    __tablename__ = "image_jobs"
+    __table_args__ = (
+        Index('ix_image_jobs_status', 'status', 'id'),
+        Index('ix_image_jobs_user_id', 'user_id', 'id'),
+    )
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, user_id: int, url: str):
+        super().__init__()
+        self.user_id = user_id
+        self.url = url
+        self.status = self.QUEUED
+
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    url = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    error = Column(String)
+    attempts = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True),
+                        default=lambda: datetime.now(timezone.utc))
+    # Validators returned by the image host, for conditional refreshes
+    etag = Column(String)
+    last_modified = Column(String)
+    # ETag of the stored image this job produced
+    image_etag = Column(String)
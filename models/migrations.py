@@ -0,0 +1,286 @@
+from base64 import b64decode
+from hashlib import sha256
+from typing import Callable, List
+from sqlalchemy.engine import Connection, Engine
+from .base_model import BaseModel
+
+
+def create_notes_fts(connection: Connection) -> None:
+    """
+    Full-text index over notes.title/notes.text, kept in sync by triggers.
+    """
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+        "title, text, content='notes', content_rowid='id', prefix='2 3')")
+    connection.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts(rowid, title, text) VALUES (new.id, new.title, new.text);
+        END""")
+    connection.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+        END""")
+    connection.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF title, text ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, text) VALUES ('delete', old.id, old.title, old.text);
+            INSERT INTO notes_fts(rowid, title, text) VALUES (new.id, new.title, new.text);
+        END""")
+    # Backfill rows that existed before the index
+    connection.exec_driver_sql("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+
+def create_note_indexes(connection: Connection) -> None:
+    """
+    Indexes behind the home feed, personal notes and search filters.
+    """
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_notes_user_id_created_at ON notes (user_id, created_at)")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_notes_public_created_at ON notes (created_at) WHERE private = 0")
+    connection.exec_driver_sql("ANALYZE notes")
+
+
+def store_profile_images_as_binary(connection: Connection) -> None:
+    """
+    Decode base64 data URIs into raw bytes with a content type and ETag.
+    """
+    columns = {row[1] for row in connection.exec_driver_sql("PRAGMA table_info(users)")}
+    for column in ('profile_image_type', 'profile_image_etag'):
+        if column not in columns:
+            connection.exec_driver_sql(f"ALTER TABLE users ADD COLUMN {column} VARCHAR")
+
+    rows = connection.exec_driver_sql(
+        "SELECT id, profile_image FROM users WHERE profile_image IS NOT NULL AND profile_image_etag IS NULL").all()
+    for user_id, data_uri in rows:
+        header, _, payload = bytes(data_uri).partition(b',')
+        data = b64decode(payload)
+        connection.exec_driver_sql(
+            "UPDATE users SET profile_image = ?, profile_image_type = ?, profile_image_etag = ? WHERE id = ?",
+            (data, header[len(b'data:'):].split(b';')[0].decode(), sha256(data).hexdigest()[:32], user_id))
+
+
+def store_avatar_variants(connection: Connection) -> None:
+    """
+    Replace stored full-size images with the resized avatar variants.
+    """
+    # Local import: the image pipeline lives with the download code
+    from utils.profile_image import AVATAR_CONTENT_TYPE, make_avatar_variants  # pylint: disable=import-outside-toplevel
+
+    columns = {row[1] for row in connection.exec_driver_sql("PRAGMA table_info(users)")}
+    if 'profile_image_thumb' not in columns:
+        connection.exec_driver_sql("ALTER TABLE users ADD COLUMN profile_image_thumb BLOB")
+
+    rows = connection.exec_driver_sql(
+        "SELECT id, profile_image FROM users WHERE profile_image IS NOT NULL AND profile_image_thumb IS NULL").all()
+    for user_id, data in rows:
+        try:
+            variants = make_avatar_variants(bytes(data))
+        except ValueError:
+            # Not a decodable image: drop it, the fallback avatar is shown instead
+            connection.exec_driver_sql(
+                "UPDATE users SET profile_image = NULL, profile_image_type = NULL, profile_image_etag = NULL "
+                "WHERE id = ?", (user_id,))
+            continue
+
+        connection.exec_driver_sql(
+            "UPDATE users SET profile_image = ?, profile_image_thumb = ?, profile_image_type = ? WHERE id = ?",
+            (variants[128], variants[40], AVATAR_CONTENT_TYPE, user_id))
+
+
+def create_notes_version(connection: Connection) -> None:
+    """
+    The notes counter of data_versions, on its own in a notes shard.
+    """
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS data_versions (name VARCHAR PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+    connection.exec_driver_sql("INSERT OR IGNORE INTO data_versions (name) VALUES ('notes')")
+    for event in ('INSERT', 'DELETE', 'UPDATE'):
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS notes_version_{event.lower()} AFTER {event} ON notes BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'notes';
+            END""")
+
+
+def create_data_versions(connection: Connection) -> None:
+    """
+    Counters bumped by triggers whenever notes or the user fields shown next
+    to them change; conditional GETs derive their ETags from them.
+    """
+    create_notes_version(connection)
+    connection.exec_driver_sql("INSERT OR IGNORE INTO data_versions (name) VALUES ('users')")
+    for event in ('INSERT', 'DELETE', 'UPDATE OF email, is_admin, profile_image_etag'):
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS users_version_{event.split()[0].lower()} AFTER {event} ON users BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+            END""")
+
+
+FEED_AUDIENCE_SQL = "CASE WHEN {note}.private = 0 THEN 0 ELSE COALESCE({note}.user_id, -1) END"
+
+
+def rebuild_feed(connection: Connection) -> None:
+    """
+    Refill the feed table from notes.
+    """
+    connection.exec_driver_sql("DELETE FROM feed")
+    connection.exec_driver_sql(
+        f"INSERT INTO feed (note_id, audience, created_at) "
+        f"SELECT id, {FEED_AUDIENCE_SQL.format(note='notes')}, created_at FROM notes")
+
+
+def create_feed(connection: Connection) -> None:
+    """
+    Materialized /home feed (models.FeedEntry), kept in step with notes by triggers.
+    """
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS feed (note_id INTEGER NOT NULL PRIMARY KEY, audience INTEGER NOT NULL, "
+        "created_at DATETIME, FOREIGN KEY(note_id) REFERENCES notes (id))")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_feed_audience_created_at ON feed (audience, created_at)")
+    connection.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS notes_feed_insert AFTER INSERT ON notes BEGIN
+            INSERT INTO feed (note_id, audience, created_at)
+            VALUES (new.id, {FEED_AUDIENCE_SQL.format(note='new')}, new.created_at);
+        END""")
+    connection.exec_driver_sql("""
+        CREATE TRIGGER IF NOT EXISTS notes_feed_delete AFTER DELETE ON notes BEGIN
+            DELETE FROM feed WHERE note_id = old.id;
+        END""")
+    connection.exec_driver_sql(f"""
+        CREATE TRIGGER IF NOT EXISTS notes_feed_update AFTER UPDATE OF id, private, user_id, created_at ON notes BEGIN
+            DELETE FROM feed WHERE note_id = old.id;
+            INSERT INTO feed (note_id, audience, created_at)
+            VALUES (new.id, {FEED_AUDIENCE_SQL.format(note='new')}, new.created_at);
+        END""")
+    rebuild_feed(connection)
+    connection.exec_driver_sql("ANALYZE feed")
+
+
+def unescape_sql(column: str) -> str:
+    """
+    SQL inverse of html.escape (as applied by utils.input_sanitizer) over a
+    column, also dropping the control characters utils.notes marks highlights with.
+    """
+    for escaped, char in (('&#x27;', "''"), ('&quot;', '"'), ('&gt;', '>'), ('&lt;', '<'), ('&amp;', '&')):
+        column = f"replace({column}, '{escaped}', '{char}')"
+    return f"replace(replace({column}, char(2), ''), char(3), '')"
+
+
+def index_unescaped_note_text(connection: Connection) -> None:
+    """
+    Rebuild notes_fts over the unescaped note text, so that searching for
+    "amp" or "quot" no longer matches entities and highlights never split one.
+
+    The index reads its content from the notes_search view, the triggers feed
+    it the same unescaped values.
+    """
+    for trigger in ('notes_fts_ai', 'notes_fts_ad', 'notes_fts_au'):
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    connection.exec_driver_sql("DROP TABLE IF EXISTS notes_fts")
+    connection.exec_driver_sql(
+        f"CREATE VIEW IF NOT EXISTS notes_search AS "
+        f"SELECT id, {unescape_sql('title')} AS title, {unescape_sql('text')} AS text FROM notes")
+    connection.exec_driver_sql(
+        "CREATE VIRTUAL TABLE notes_fts USING fts5("
+        "title, text, content='notes_search', content_rowid='id', prefix='2 3')")
+
+    old = f"old.id, {unescape_sql('old.title')}, {unescape_sql('old.text')}"
+    new = f"new.id, {unescape_sql('new.title')}, {unescape_sql('new.text')}"
+    connection.exec_driver_sql(f"""
+        CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts(rowid, title, text) VALUES ({new});
+        END""")
+    connection.exec_driver_sql(f"""
+        CREATE TRIGGER notes_fts_ad AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, text) VALUES ('delete', {old});
+        END""")
+    connection.exec_driver_sql(f"""
+        CREATE TRIGGER notes_fts_au AFTER UPDATE OF title, text ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, text) VALUES ('delete', {old});
+            INSERT INTO notes_fts(rowid, title, text) VALUES ({new});
+        END""")
+    connection.exec_driver_sql("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    create_notes_fts,
+    create_note_indexes,
+    store_profile_images_as_binary,
+    store_avatar_variants,
+    create_data_versions,
+    create_feed,
+    index_unescaped_note_text,
+]
+
+
+def use_incremental_vacuum(engine: Engine) -> None:
+    """
+    Create new databases with auto_vacuum = INCREMENTAL, so that
+    utils.maintenance can hand free pages back to the filesystem.
+
+    Existing databases are converted by a full VACUUM, see
+    `python -m utils.maintenance enable-incremental-vacuum`.
+    """
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if connection.exec_driver_sql('SELECT count(*) FROM sqlite_master').scalar():
+            return
+        # Only takes effect through a VACUUM once the file exists, which is instant while it is empty
+        connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.exec_driver_sql('VACUUM')
+
+
+def migrate(engine: Engine) -> int:
+    """
+    Create missing tables, then apply pending migrations.
+
+    Args:
+        engine: Engine of the database to upgrade
+
+    Returns:
+        Schema version after migrating
+    """
+    use_incremental_vacuum(engine)
+    BaseModel.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {number:d}')
+
+    return len(MIGRATIONS)
+
+
+# Schema of a notes shard file (models.shards): notes and what is derived from them
+SHARD_MIGRATIONS: List[Callable[[Connection], None]] = [
+    create_notes_fts,
+    create_note_indexes,
+    create_notes_version,
+    create_feed,
+    index_unescaped_note_text,
+]
+
+
+def migrate_shard(engine: Engine) -> int:
+    """
+    Create the notes table of a shard, then apply pending shard migrations.
+
+    Args:
+        engine: Engine of the shard file
+
+    Returns:
+        Shard schema version after migrating
+    """
+    use_incremental_vacuum(engine)
+    BaseModel.metadata.create_all(bind=engine, tables=[BaseModel.metadata.tables['notes']])
+
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+        for number, migration in enumerate(SHARD_MIGRATIONS[version:], start=version + 1):
+            migration(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {number:d}')
+
+    return len(SHARD_MIGRATIONS)
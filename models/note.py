@@ -1,11 +1,15 @@
 from dataclasses import dataclass
-from sqlalchemy import Column, Text, String, Integer, ForeignKey, Boolean
+from sqlalchemy import Column, Text, String, Integer, ForeignKey, Boolean, Index, text
 from .base_model import BaseModel
 
 
 @dataclass
 class Note(BaseModel):
     __tablename__ = "notes"
+    __table_args__ = (
+        Index('ix_notes_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_notes_public_created_at', 'created_at', sqlite_where=text('private = 0')),
+    )
     id: int
     created_at: str
     title: str
@@ -0,0 +1,150 @@
+"""
+Optional sharding of notes across several SQLite files.
+
+With NOTE_SHARDS=N (N > 1), notes and everything derived from them (the
+search index, the feed table and the notes version counter) live in N
+files next to the main database: database.notes-0.db ... .notes-<N-1>.db.
+Users, registration codes and image jobs stay in the main file.
+
+All notes of a user live in shard user_id % N, and note ids are allocated
+so that note_id % N is the note's shard as well. Writes, personal notes,
+search and imports therefore touch a single shard, and writers to
+different shards no longer queue on one file's write lock. Only the home
+feed reads every shard (see utils.notes).
+
+With NOTE_SHARDS=1, the default, the single "shard" is the main database
+and the router hands out the main engines and sessions.
+"""
+import os
+from typing import List, Optional
+
+from sqlalchemy import func, make_url, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session as OrmSession, scoped_session, sessionmaker
+
+from .engine import create_db_engine, dispose_after_fork
+from .migrations import migrate_shard
+from .note import Note
+
+SHARD_COUNT = int(os.environ.get('NOTE_SHARDS', 1))
+
+
+def shard_url(url: str, index: int, suffix: str = '') -> str:
+    """
+    URL of a shard file: database.db -> database.notes-<index>.db
+
+    Args:
+        url: Main database URL
+        index: Shard number
+        suffix: Appended to the file name, for files being built
+
+    Raises:
+        ValueError: If the main database is not a file
+    """
+    parsed = make_url(url)
+    if parsed.database in (None, '', ':memory:'):
+        raise ValueError('Sharding needs a file database')
+
+    root, extension = os.path.splitext(parsed.database)
+    return parsed.set(database=f'{root}.notes-{index}{extension}{suffix}').render_as_string(hide_password=False)
+
+
+class ShardRouter:
+    """
+    Engines and sessions of the notes shards.
+
+    Args:
+        count: Number of shards
+        url: Main database URL, shard files are named after it
+        engine: Main engine, the only shard when count is 1
+        read_engine: Main read-only engine
+        session: Main scoped session
+        read_session: Main read-only scoped session
+    """
+
+    def __init__(self, count: int, url: str, engine: Engine, read_engine: Engine,
+                 session: scoped_session, read_session: scoped_session):
+        if count < 1:
+            raise ValueError('NOTE_SHARDS must be at least 1')
+
+        self.count = count
+        if count == 1:
+            self.engines, self.read_engines = [engine], [read_engine]
+            self.sessions, self.read_sessions = [session], [read_session]
+            return
+
+        self.engines = [create_db_engine(shard_url(url, index)) for index in range(count)]
+        self.read_engines = [create_db_engine(shard_url(url, index), read_only=True) for index in range(count)]
+        self.sessions = [scoped_session(sessionmaker(bind=shard)) for shard in self.engines]
+        self.read_sessions = [scoped_session(sessionmaker(bind=shard)) for shard in self.read_engines]
+        dispose_after_fork(*self.engines, *self.read_engines)
+
+    @property
+    def sharded(self) -> bool:
+        return self.count > 1
+
+    @property
+    def shard_engines(self) -> List[Engine]:
+        """
+        Engines besides the main ones, empty when not sharded.
+        """
+        return self.engines + self.read_engines if self.sharded else []
+
+    def for_user(self, user_id: Optional[int]) -> int:
+        return (user_id or 0) % self.count
+
+    def for_note(self, note_id: int) -> int:
+        return note_id % self.count
+
+    def session_for_user(self, user_id: Optional[int]) -> OrmSession:
+        """
+        Write session of the shard holding the user's notes.
+        """
+        return self.sessions[self.for_user(user_id)]()
+
+    def read_session_for_user(self, user_id: Optional[int]) -> OrmSession:
+        return self.read_sessions[self.for_user(user_id)]()
+
+    def session_for_note(self, note_id: int) -> OrmSession:
+        return self.sessions[self.for_note(note_id)]()
+
+    def allocate_note_ids(self, session: OrmSession, user_id: Optional[int], count: int) -> List[Optional[int]]:
+        """
+        Ids for new notes of a user, in the session's transaction.
+
+        When sharded, ids continue the shard's sequence in steps of the shard
+        count; otherwise they are None and SQLite assigns them.
+
+        Args:
+            session: Write session of the user's shard
+            user_id: Owner of the notes
+            count: Number of ids
+
+        Returns:
+            count ids, to use before the session commits
+        """
+        if not self.sharded:
+            return [None] * count
+
+        # A no-op write takes the shard's write lock, so no other writer can
+        # read the same maximum before this transaction commits
+        session.execute(text("UPDATE data_versions SET version = version WHERE name = 'notes'"))
+        last = session.execute(select(func.max(Note.id))).scalar()
+        first = last + self.count if last else self.for_user(user_id) or self.count
+        return list(range(first, first + count * self.count, self.count))
+
+    def migrate(self) -> None:
+        """
+        Create or upgrade the schema of every shard file.
+        """
+        if self.sharded:
+            for shard in self.engines:
+                migrate_shard(shard)
+
+    def remove(self) -> None:
+        """
+        Remove the current thread's shard sessions, like Session.remove().
+        """
+        if self.sharded:
+            for registry in self.sessions + self.read_sessions:
+                registry.remove()
@@ -1,6 +1,6 @@
 from flask_login import UserMixin
 from sqlalchemy import Column, String, BLOB, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from .base_model import BaseModel
 
 
@@ -16,5 +16,9 @@ class User(BaseModel, UserMixin):
     email = Column(String, unique=True, nullable=False)
     password = Column(String)
     notes = relationship("Note", backref="user")
-    profile_image = Column(BLOB)
+    # Avatar variants (128px and 40px), only loaded by the avatar endpoint
+    profile_image = deferred(Column(BLOB))
+    profile_image_thumb = deferred(Column(BLOB))
+    profile_image_type = Column(String)
+    profile_image_etag = Column(String)
     is_admin = Column(Boolean, default=False)
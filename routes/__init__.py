@@ -1,10 +1,13 @@
-# pylint: disable=unused-import,import-outside-toplevel
+from flask import Flask
 
+# pylint: disable=import-outside-toplevel
 
-def init():
-    import routes.signup
-    import routes.login
-    import routes.notes
-    import routes.account
-    import routes.home
-    import routes.registration_codes
+
+def init(app: Flask) -> None:
+    """
+    Import the route modules and register their blueprints.
+    """
+    from routes import account, avatars, home, login, notes, profiles, registration_codes, signup
+
+    for module in (signup, login, notes, account, home, registration_codes, avatars, profiles):
+        app.register_blueprint(module.bp)
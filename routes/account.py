@@ -2,75 +2,85 @@ import json
 from base64 import b64encode, b64decode
 from uuid import uuid4
 
-from bcrypt import gensalt, hashpw
 from flask_login import login_required, current_user
-from flask import redirect, flash, render_template, request, Response, g, make_response
+from flask import Blueprint, redirect, flash, render_template, request, Response, g, make_response, abort, url_for
 
-from app import app
-from models import Session, Note
+from models import Session, User, ImageJob, shards
 from forms.image_form import ImageForm
 from forms.account_form import AccountForm
-from utils.profile_image import get_base64_image_blob
+from utils.http_cache import conditional
+from utils.notes import personal_notes_statement, search_notes_for_user
+from utils.image_jobs import enqueue, get_job
+from utils.profile_image import is_safe_url
 from utils.input_sanitizer import sanitize_text_field
+from utils.passwords import hasher
+from utils.user_cache import user_cache
 
+bp = Blueprint('account', __name__)
 
-@app.route('/account')
+
+@bp.route('/account')
 @login_required
 def account():
-    return render_template('account.html', uuid=str(uuid4()))
+    return render_template('account.html', uuid=str(uuid4()),
+                           image_job=request.args.get('image_job', type=int))
 
 
-@app.route('/search')
+@bp.route('/search')
 @login_required
 def search():
     search_param = request.args.get('search', '')
     search_param = sanitize_text_field(search_param, 100)  # Limit to 100 chars
 
-    with Session() as session:
-        session.query(Note)
-
-        personal_notes = session.query(Note).filter(
-            Note.user_id == current_user.id,
-            Note.text.like(f"%{search_param}%")).all()
-        return render_template(
-            'search.html',
-            search=search_param,
-            personal_notes=personal_notes,
-        )
+    return render_template(
+        'search.html',
+        search=search_param,
+        personal_notes=search_notes_for_user(current_user.id, search_param),
+    )
 
 
-@app.route('/accounts/<int:user_id>/notes')
+@bp.route('/accounts/<int:user_id>/notes')
 @login_required
+@conditional('notes', 'users')
 def get_personal_notes(user_id: int):
-    with Session() as session:
-        personal_notes = session.query(Note).filter(
-            Note.user_id == user_id).all()
+    with shards.read_session_for_user(user_id) as session:
+        personal_notes = session.scalars(personal_notes_statement(user_id)).all()
         return render_template('personal_notes.html',
                                personal_notes=personal_notes)
 
 
-@app.route('/account/image', methods=['POST'])
+@bp.route('/account/image', methods=['POST'])
 @login_required
 def add_image():
     form = ImageForm(request.form)
 
     if not form.validate():
         flash(json.dumps(form.errors), 'error')
+    elif not is_safe_url(form.url.data):
+        flash('Error updating profile image: Unsafe URL', 'error')
     else:
-        try:
-            with Session() as session:
-                current_user.profile_image = get_base64_image_blob(
-                    form.url.data).encode()
-                session.merge(current_user)
-                session.commit()
-                flash('Profile image updated', 'success')
-        except Exception as e:
-            flash(f'Error updating profile image: {str(e)}', 'error')
+        job_id = enqueue(current_user.id, form.url.data)
+        if request.accept_mimetypes.best == 'application/json':
+            return {'id': job_id, 'status': ImageJob.QUEUED,
+                    'url': url_for('account.get_image_job', job_id=job_id)}, 202
+
+        flash('Profile image update queued', 'info')
+        return redirect(url_for('account.account', image_job=job_id))
 
     return redirect('/account')
 
 
-@app.route('/account', methods=['POST'])
+@bp.route('/account/image/jobs/<int:job_id>')
+@login_required
+def get_image_job(job_id: int):
+    job = get_job(job_id, current_user.id)
+    if job is None:
+        abort(404)
+
+    return {'id': job.id, 'status': job.status, 'error': job.error}
+
+
+@bp.route('/account', methods=['POST'])
 def update_account():
     form = AccountForm(request.form)
 
@@ -78,6 +88,7 @@ def update_account():
         flash(json.dumps(form.errors), 'error')
     else:
         with Session() as session:
+            user = session.get(User, current_user.id)
             if form.email.data:
                 try:
                     form.email.data = sanitize_text_field(form.email.data, 255)
@@ -90,7 +101,9 @@ def update_account():
                 for key, value in form.data.items()
                 if value is not None and key != 'password'
             }
-            current_user.__dict__.update(filtered_values)
+            for key, value in filtered_values.items():
+                if hasattr(User, key):
+                    setattr(user, key, value)
 
             new_password = form.password.data
             was_password_changed = new_password is not None and new_password != filtered_values.get(
@@ -101,17 +114,16 @@ def update_account():
                 if len(new_password) < 8:
                     flash('Password must be at least 8 characters long', 'error')
                     return redirect('/account')
-                current_user.password = hashpw(new_password.encode(),
-                                               gensalt()).decode()
+                user.password = hasher.hash(new_password)
 
-            session.merge(current_user)
             session.commit()
+            user_cache.invalidate(user.id)
             flash('Account updated', 'success')
 
     return redirect('/account')
 
 
-@app.route('/darkmode', methods=['POST'])
+@bp.route('/darkmode', methods=['POST'])
 def toggle_darkmode():
     response = make_response(redirect('/account'))
 
@@ -130,7 +142,7 @@ def toggle_darkmode():
 default_preferences = {'mode': 'light'}
 
 
-@app.before_request
+@bp.before_app_request
 def before_request():
     preferences_cookie = request.cookies.get('preferences')
     
@@ -147,7 +159,7 @@ def before_request():
     g.preferences = preferences
 
 
-@app.after_request
+@bp.after_app_request
 def after_request(response: Response) -> Response:
     if request.cookies.get('preferences') is None:
         response.set_cookie('preferences', 'light', secure=True, samesite='Strict', httponly=True)
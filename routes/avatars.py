@@ -0,0 +1,46 @@
+from flask import Blueprint, Response, redirect, request, url_for
+from flask_login import login_required
+
+from models import ReadSession, User
+
+bp = Blueprint('avatars', __name__)
+
+# Avatar URLs carry the ETag as ?v=, so a versioned URL never changes content
+VERSIONED_MAX_AGE = 365 * 24 * 60 * 60
+
+# ?size= value to the column holding that variant
+AVATAR_COLUMNS = {
+    40: User.profile_image_thumb,
+    128: User.profile_image,
+}
+
+
+@bp.route('/users/<int:user_id>/avatar')
+@login_required
+def get_avatar(user_id: int):
+    size = request.args.get('size', 128, type=int)
+    if size not in AVATAR_COLUMNS:
+        size = 128
+
+    with ReadSession() as session:
+        avatar = session.query(User.profile_image_etag, User.profile_image_type).filter(
+            User.id == user_id).first()
+        if avatar is None or avatar.profile_image_etag is None:
+            return redirect(url_for('static', filename='fallback.png'))
+
+        etag = f'{avatar.profile_image_etag}-{size}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            data = session.query(AVATAR_COLUMNS[size]).filter(User.id == user_id).scalar()
+            response = Response(data, mimetype=avatar.profile_image_type)
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if request.args.get('v') == avatar.profile_image_etag:
+        response.cache_control.max_age = VERSIONED_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+    return response
@@ -1,18 +1,30 @@
-from flask import render_template, redirect
+from flask import Blueprint, render_template, redirect, request, abort
 from flask_login import login_required, current_user
 
-from app import app
-from utils.notes import get_notes_for_user
+from utils.http_cache import conditional
+from utils.notes import get_notes_for_user, get_page_args
 
+bp = Blueprint('home', __name__)
 
-@app.route("/")
+
+@bp.route("/")
 @login_required
 def index():
     return redirect('/home')
 
 
-@app.route('/home')
+@bp.route('/home')
 @login_required
+@conditional('notes', 'users')
 def home():
+    try:
+        limit, cursor = get_page_args(request.args)
+    except ValueError:
+        abort(400)
+
+    notes, next_cursor = get_notes_for_user(current_user.id, limit, cursor)
     return render_template('home.html',
-                           notes=get_notes_for_user(current_user.id))
+                           notes=notes,
+                           limit=limit,
+                           next_cursor=next_cursor,
+                           is_first_page=cursor is None)
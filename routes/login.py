@@ -1,26 +1,39 @@
 from typing import Union
 from json import dumps
-from flask import render_template, request, redirect, flash
+from flask import Blueprint, render_template, request, redirect, flash
 from flask_login import login_user, logout_user, current_user, login_required
-from bcrypt import checkpw
-from app import app, login_manager
-from models import Session, User
+from extensions import login_manager
+from models import Session, ReadSession, User
 from forms.login_form import LoginForm
 from utils.input_sanitizer import sanitize_email
+from utils.passwords import hasher
+from utils.user_cache import CachedUser, user_cache
+
+bp = Blueprint('login', __name__)
 
 
 @login_manager.user_loader
-def load_user(user_id: str) -> Union[User, None]:
-    with Session() as session:
-        return session.get(User, user_id)
+def load_user(user_id: str) -> Union[CachedUser, None]:
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    with ReadSession() as session:
+        user = session.get(User, user_id)
+        return user_cache.put(CachedUser.from_user(user)) if user is not None else None
 
 
-@app.route('/login', methods=['GET'])
+@bp.route('/login', methods=['GET'])
 def login():
     return render_template('login.html')
 
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def do_login():
     form = LoginForm(request.form)
 
@@ -30,10 +43,13 @@ def do_login():
         with Session() as session:
             user = session.query(User).filter(
                 User.email == form.email.data).first()
-            if user is not None and checkpw(
-                    form.password.data.encode('utf-8'),
-                    user.password.encode('utf-8')) and login_user(user):
-                return redirect("/")
+            if user is not None and hasher.verify(form.password.data, user.password):
+                # Move the hash to the configured cost while the password is at hand
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(form.password.data)
+                    session.commit()
+                if login_user(user):
+                    return redirect("/")
 
     flash('Invalid Credentials!', 'warning')
     logout_user()
@@ -41,14 +57,14 @@ def do_login():
     return redirect("/")
 
 
-@app.route('/logout', methods=['GET'])
+@bp.route('/logout', methods=['GET'])
 @login_required
 def logout():
     logout_user()
     return redirect("/")
 
 
-@app.route('/is_logged_in', methods=['GET'])
+@bp.route('/is_logged_in', methods=['GET'])
 def logged_in():
     return {
         'is_logged_in': current_user.is_authenticated,
@@ -1,20 +1,76 @@
 from json import dumps
+from typing import Iterator
 from flask_login import login_required, current_user
-from flask import request, redirect, flash
-from app import app
+from flask import Blueprint, current_app, request, redirect, flash, abort, url_for, Response, stream_with_context
 from forms.note_form import NoteForm
-from models import Session, Note
-from utils.notes import get_notes_for_user
+from models import Note, shards
+from utils.fragment_cache import fragment_cache
+from utils.http_cache import conditional
+from utils.notes import Cursor, encode_cursor, get_page_args, iter_notes_for_user
+from utils.note_transfer import import_ndjson, iter_notes_ndjson
 from utils.input_sanitizer import sanitize_text_field
 
+bp = Blueprint('notes', __name__)
 
-@app.route('/notes', methods=['GET'])
+
+def stream_notes_page(user_id: int, limit: int, cursor: Cursor) -> Iterator[str]:
+    yield '{"notes": ['
+
+    last_note = None
+    for count, note in enumerate(iter_notes_for_user(user_id, limit, cursor)):
+        if count == limit:
+            next_url = url_for('notes.get_notes', limit=limit, cursor=encode_cursor(last_note))
+            yield f'], "next": {current_app.json.dumps(next_url)}}}'
+            return
+
+        yield (',' if count else '') + current_app.json.dumps(note)
+        last_note = note
+
+    yield '], "next": null}'
+
+
+@bp.route('/notes', methods=['GET'])
 @login_required
+@conditional('notes')
 def get_notes():
-    return get_notes_for_user(current_user.id)
+    try:
+        limit, cursor = get_page_args(request.args)
+    except ValueError:
+        abort(400)
+
+    return Response(stream_with_context(stream_notes_page(current_user.id, limit, cursor)),
+                    mimetype='application/json')
+
+
+@bp.route('/notes/export', methods=['GET'])
+@login_required
+def export_notes():
+    return Response(stream_with_context(iter_notes_ndjson(current_user.id)),
+                    mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=notes.ndjson'})
 
 
-@app.route('/notes', methods=['POST'])
+@bp.route('/notes/import', methods=['POST'])
+@login_required
+def import_notes():
+    # A file upload from the account page, or the NDJSON as the request body
+    upload = request.files.get('file')
+    stream = upload.stream if upload is not None else request.stream
+
+    with shards.session_for_user(current_user.id) as session:
+        report = import_ndjson(session, stream, current_user.id)
+
+    if request.accept_mimetypes.best == 'application/json' or upload is None:
+        return {'imported': report.imported, 'failed': report.failed, 'errors': report.errors}
+
+    flash(f'{report.imported} notes imported, {report.failed} lines skipped',
+          'success' if not report.failed else 'warning')
+    for error in report.errors[:5]:
+        flash(f"Line {error['line']}: {error['error']}", 'warning')
+    return redirect('/home')
+
+
+@bp.route('/notes', methods=['POST'])
 @login_required
 def add_note():
     form = NoteForm(request.form)
@@ -26,32 +82,39 @@ def add_note():
         title = sanitize_text_field(form.title.data, 200)  # Limit title to 200 chars
         text = sanitize_text_field(form.text.data, 5000)   # Limit text to 5000 chars
         
-        with Session(expire_on_commit=False) as session:
-            note = Note(id=None,
+        with shards.session_for_user(current_user.id) as session:
+            note = Note(id=shards.allocate_note_ids(session, current_user.id, 1)[0],
                         created_at=None,
                         title=title,
                         text=text,
                         private=form.private.data,
                         user_id=current_user.id)
             session.add(note)
+            session.flush()
+            # Read before the commit expires it, saves reloading the row
+            note_id = note.id
             session.commit()
 
+        # Ids can be reused after a delete, never serve a stale card for them
+        fragment_cache.invalidate_note(note_id)
+
         flash('Note created', 'success')
 
     return redirect('/home')
 
 
-@app.route('/notes/<int:note_id>/delete', methods=['POST'])
+@bp.route('/notes/<int:note_id>/delete', methods=['POST'])
 @login_required
 def delete_note(note_id: int):
 
-    with Session() as session:
+    with shards.session_for_note(note_id) as session:
         note = session.get(Note, note_id)
         if note is None:
             flash('Note not found', 'warning')
         else:
             session.delete(note)
             session.commit()
+            fragment_cache.invalidate_note(note_id)
 
     flash('Note deleted', 'info')
     return redirect('/home')
@@ -0,0 +1,65 @@
+from flask_login import login_required, current_user
+from flask import Blueprint, render_template, redirect, flash, request, Response, abort, send_from_directory
+
+from utils.profiler import FILENAME, PROFILE_DIR, HEADER, list_profiles, make_token, merged, sample_rate, \
+    set_sample_rate
+
+bp = Blueprint('profiles', __name__)
+
+
+@bp.route('/admin/profiles', methods=['GET'])
+@login_required
+def profiles():
+    if not current_user.is_admin:
+        flash("Not authorized to access this page", 'error')
+        return redirect('/home')
+
+    stored = list_profiles()
+    return render_template('profiles.html',
+                           profiles=stored,
+                           endpoints=sorted({profile.endpoint for profile in stored}),
+                           rate=sample_rate() * 100,
+                           header=HEADER,
+                           token=make_token())
+
+
+@bp.route('/admin/profiles', methods=['POST'])
+@login_required
+def set_sampling():
+    if not current_user.is_admin:
+        flash("Not authorized to change profiling", 'error')
+        return redirect('/home')
+
+    rate = request.form.get('rate', 0, type=float)
+    if not 0 <= rate <= 100:
+        flash("Sampling rate must be between 0 and 100%", 'error')
+    else:
+        set_sample_rate(rate / 100)
+        flash(f"Profiling {rate:g}% of requests" if rate else "Profiling disabled", 'success')
+    return redirect('/admin/profiles')
+
+
+@bp.route('/admin/profiles/<name>', methods=['GET'])
+@login_required
+def get_profile(name: str):
+    if not current_user.is_admin:
+        abort(403)
+    if not FILENAME.match(name):
+        abort(404)
+
+    return send_from_directory(PROFILE_DIR, name, mimetype='text/plain', as_attachment=True)
+
+
+@bp.route('/admin/profiles/endpoints/<name>', methods=['GET'])
+@login_required
+def get_endpoint_profile(name: str):
+    if not current_user.is_admin:
+        abort(403)
+
+    stacks = merged(name)
+    if not stacks:
+        abort(404)
+
+    return Response(''.join(f'{stack} {count}\n' for stack, count in stacks.most_common()),
+                    mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={name}.collapsed'})
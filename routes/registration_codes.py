@@ -1,39 +1,65 @@
 #!/usr/bin/env python3
 
-from uuid import uuid4
+from json import dumps
 
 from flask_login import login_required, current_user
-from flask import (render_template, redirect, flash)
+from flask import (Blueprint, render_template, redirect, flash, request, Response, stream_with_context)
 
-from app import app
-from models import RegistrationCode, Session
+from forms.registration_code_form import RegistrationCodeForm
+from models import Session
+from utils.registration_codes import generate_codes, get_codes_page, get_page_args, iter_codes_csv, MAX_BULK_CODES
 
+bp = Blueprint('registration_codes', __name__)
 
-@app.route('/registration-codes', methods=['GET'])
+
+@bp.route('/registration-codes', methods=['GET'])
 @login_required
 def registration_codes():
     if not current_user.is_admin:
         flash("Not authorized to access this page", 'error')
         return redirect('/home')
 
-    with Session() as session:
-        codes = session.query(RegistrationCode).all()
+    limit, after = get_page_args(request.args)
+    codes, next_after = get_codes_page(limit, after)
 
-        return render_template('registration_codes.html',
-                               registration_codes=codes)
+    return render_template('registration_codes.html',
+                           registration_codes=codes,
+                           limit=limit,
+                           next_after=next_after,
+                           is_first_page=after is None,
+                           max_codes=MAX_BULK_CODES)
 
 
-@app.route('/registration-codes', methods=['POST'])
+@bp.route('/registration-codes/export.csv', methods=['GET'])
+@login_required
+def export_registration_codes():
+    if not current_user.is_admin:
+        flash("Not authorized to access this page", 'error')
+        return redirect('/home')
+
+    return Response(stream_with_context(iter_codes_csv()),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=registration_codes.csv'})
+
+
+@bp.route('/registration-codes', methods=['POST'])
 @login_required
 def add_registration_codes():
     if not current_user.is_admin:
         flash("Not authorized to create new registration codes", 'error')
         return redirect('/home')
 
-    with Session(expire_on_commit=False) as session:
-        code = RegistrationCode(str(uuid4()))
-        session.add(code)
+    form = RegistrationCodeForm(request.form)
+    if not form.validate():
+        flash(dumps(form.errors), 'error')
+        return redirect('/registration-codes')
+
+    with Session() as session:
+        codes = generate_codes(session, form.count.data or 1)
         session.commit()
 
-    flash(f"Code added: {code.code}", 'success')
+    if len(codes) == 1:
+        flash(f"Code added: {codes[0]}", 'success')
+    else:
+        flash(f"{len(codes)} codes added", 'success')
     return redirect('/registration-codes')
@@ -1,69 +1,55 @@
 from json import dumps
-from sqlite3 import OperationalError
-from typing import Union
 
-from flask import render_template, request, redirect, flash
-from bcrypt import gensalt, hashpw
-from app import app
-from models import Session, User, RegistrationCode
+from flask import Blueprint, render_template, request, redirect, flash
+from sqlalchemy.exc import IntegrityError
+
+from models import Session, User
 from forms.registration_form import RegistrationForm
 from utils.input_sanitizer import sanitize_email, sanitize_text_field
+from utils.passwords import hasher
+from utils.registration_codes import code_exists, redeem
+from utils.user_cache import user_cache
 
-
-def validate_token(code: str, session: Session) -> Union[str, None]:
-    try:
-        # Use proper ORM query instead of raw SQL to prevent injection
-        result = session.query(RegistrationCode.id, RegistrationCode.code).filter(
-            RegistrationCode.code == code
-        ).first()
-
-        if result is None:
-            return None
-
-        return result.id
-    except OperationalError:
-        return None
+bp = Blueprint('signup', __name__)
 
 
-@app.route('/signup', methods=['GET'])
+@bp.route('/signup', methods=['GET'])
 def signup():
     return render_template('signup.html')
 
 
-@app.route('/signup', methods=['POST'])
+@bp.route('/signup', methods=['POST'])
 def do_signup():
     form = RegistrationForm(request.form)
 
     if not form.validate():
         flash(dumps(form.errors), 'error')
+    elif not code_exists(form.registration_code.data):
+        # Rejected before hashing: unknown codes must not cost a bcrypt round
+        flash("Invalid registration code", 'warning')
+        return redirect("/signup")
     else:
-        with Session() as session:
-            user_already_exists = session.query(
-                session.query(User).where(
-                    User.email == form.email.data).exists()).scalar()
+        # Hash before the transaction so the write lock is not held meanwhile
+        password = hasher.hash(form.password.data)
 
-            code = form.registration_code.data
-            token_id = validate_token(code, session)
-            if token_id is None:
+        with Session() as session:
+            # The code is consumed and the user created in one transaction:
+            # any failure below rolls back and the code stays usable
+            if not redeem(session, form.registration_code.data):
+                session.rollback()
                 flash("Invalid registration code", 'warning')
                 return redirect("/signup")
 
-            token = session.get(RegistrationCode, token_id)
-            if token.code != code:
-                flash("Unexpected registration code mismatch", 'error')
-                return redirect("/signup")
-
-            session.delete(token)
-
-            if user_already_exists:
+            user = User(form.email.data, password)
+            session.add(user)
+            try:
+                session.flush()
+                user_id = user.id
+                session.commit()
+            except IntegrityError:
+                session.rollback()
                 flash("User already exists", 'warning')
                 return redirect("/signup")
-
-            user = User(
-                form.email.data,
-                hashpw(form.password.data.encode('utf-8'), gensalt()).decode())
-
-            session.add(user)
-            session.commit()
+            user_cache.invalidate(user_id)
 
     return redirect('/home')
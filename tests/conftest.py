@@ -0,0 +1,59 @@
+"""
+Every test runs against a throwaway database seeded by init-db, sharded
+when NOTE_SHARDS is set. The environment is set here, before the app and
+its engines are imported.
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+EMAIL = 'user@evfa.com'
+PASSWORD = 'StrongPassword123!'
+ADMIN_EMAIL = 'admin@evfa.com'
+ADMIN_PASSWORD = 'StrongAdminPassword123!'
+
+DIRECTORY = tempfile.mkdtemp(prefix='tests_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DIRECTORY, 'database.db')
+os.environ['BCRYPT_ROUNDS'] = '4'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ['IMAGE_WORKERS'] = '0'
+os.environ['PROFILE_DIR'] = os.path.join(DIRECTORY, 'profiles')
+os.environ['DEFAULT_USER_EMAIL'] = EMAIL
+os.environ['DEFAULT_USER_PASSWORD'] = PASSWORD
+os.environ['DEFAULT_ADMIN_EMAIL'] = ADMIN_EMAIL
+os.environ['DEFAULT_ADMIN_PASSWORD'] = ADMIN_PASSWORD
+os.environ.pop('USER_CACHE_SHARED_FILE', None)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    from db_seed import init_db
+
+    init_db()
+    yield create_app()
+    shutil.rmtree(DIRECTORY, ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(app, email: str = EMAIL, password: str = PASSWORD):
+    client = app.test_client()
+    response = client.post('/login', data={'email': email, 'password': password})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def user_client(app):
+    return login(app)
+
+
+@pytest.fixture
+def admin_client(app):
+    return login(app, ADMIN_EMAIL, ADMIN_PASSWORD)
@@ -0,0 +1,90 @@
+"""
+Avatars served from /users/<id>/avatar.
+"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from sqlalchemy import update
+
+from models import Session, User
+from utils.profile_image import AVATAR_CONTENT_TYPE, image_etag, make_avatar_variants
+from tests.conftest import ADMIN_EMAIL
+
+
+def _png(size: int = 300) -> bytes:
+    output = BytesIO()
+    Image.new('RGB', (size, size // 2), 'teal').save(output, 'PNG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def avatar(app):
+    """
+    Give the admin an avatar, as an image job would; yields (user id, etag).
+    """
+    data = _png()
+    variants = make_avatar_variants(data)
+    with Session() as session:
+        user_id = session.query(User.id).filter(User.email == ADMIN_EMAIL).scalar()
+        session.execute(update(User).where(User.id == user_id).values(
+            profile_image=variants[128], profile_image_thumb=variants[40],
+            profile_image_type=AVATAR_CONTENT_TYPE, profile_image_etag=image_etag(data)))
+        session.commit()
+
+    yield user_id, image_etag(data)
+
+    with Session() as session:
+        session.execute(update(User).where(User.id == user_id).values(
+            profile_image=None, profile_image_thumb=None, profile_image_type=None, profile_image_etag=None))
+        session.commit()
+
+
+@pytest.mark.parametrize('size, edge', [(128, 128), (40, 40), (999, 128)])
+def test_variants_by_size(user_client, avatar, size, edge):
+    user_id, etag = avatar
+    response = user_client.get(f'/users/{user_id}/avatar?size={size}')
+
+    assert response.status_code == 200
+    assert response.mimetype == AVATAR_CONTENT_TYPE
+    assert response.headers['ETag'] == f'"{etag}-{edge}"'
+    with Image.open(BytesIO(response.data)) as image:
+        assert image.size == (edge, edge)
+
+
+def test_conditional_get(user_client, avatar):
+    user_id, etag = avatar
+    response = user_client.get(f'/users/{user_id}/avatar', headers={'If-None-Match': f'"{etag}-128"'})
+
+    assert response.status_code == 304
+    assert not response.data
+    assert user_client.get(f'/users/{user_id}/avatar',
+                           headers={'If-None-Match': '"stale-128"'}).status_code == 200
+
+
+def test_versioned_url_is_immutable(user_client, avatar):
+    user_id, etag = avatar
+
+    versioned = user_client.get(f'/users/{user_id}/avatar?v={etag}').cache_control
+    assert versioned.immutable and versioned.max_age == 365 * 24 * 60 * 60 and versioned.private
+    unversioned = user_client.get(f'/users/{user_id}/avatar?v=old').cache_control
+    assert unversioned.no_cache and not unversioned.immutable
+
+
+def test_pages_link_the_avatar(user_client, admin_client, avatar):
+    user_id, etag = avatar
+    admin_client.post('/notes', data={'title': 'with avatar', 'text': 'text'})
+    page = user_client.get('/home').get_data(as_text=True)
+
+    assert 'data:image' not in page
+    assert f'/users/{user_id}/avatar?size=40&amp;v={etag}' in page
+
+
+def test_missing_avatar_falls_back(user_client):
+    response = user_client.get('/users/999999/avatar')
+    assert response.status_code == 302
+    assert 'fallback' in response.location
+
+
+def test_login_required(client):
+    assert client.get('/users/1/avatar').status_code == 302
@@ -0,0 +1,133 @@
+"""
+Hammer the app from forked processes running several threads each, the way
+uwsgi.concurrent.ini serves it, and fail if a worker ever checks out a
+database connection that was opened in another process, a request fails,
+a connection is left checked out or a write is lost.
+
+Run with NOTE_SHARDS=3 as well to cover the sharded layout.
+"""
+import json
+import os
+import threading
+from collections import Counter
+from typing import Dict, List
+
+from tests.conftest import EMAIL, PASSWORD
+
+PROCESSES = 4
+THREADS = 4
+REQUESTS = 10
+
+
+def _track_connection_owners(engines, foreign: Counter) -> None:
+    from sqlalchemy import event
+
+    def on_connect(_dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    def on_checkout(_dbapi_connection, connection_record, _connection_proxy):
+        # Connections opened before tracking started belong to the parent
+        if connection_record.info.get('pid') != os.getpid():
+            foreign['checkouts'] += 1
+
+    for engine in engines:
+        event.listen(engine, 'connect', on_connect)
+        event.listen(engine, 'checkout', on_checkout)
+
+
+def _count_notes(shards) -> int:
+    from models import Note
+
+    count = 0
+    for read_session in shards.read_sessions:
+        with read_session() as session:
+            count += session.query(Note).count()
+        read_session.remove()
+    return count
+
+
+def _hammer(app, requests: int, statuses: Counter, errors: List[str]) -> None:
+    client = app.test_client()
+    client.post('/login', data={'email': EMAIL, 'password': PASSWORD})
+
+    checks = [
+        ('GET /home', lambda number: client.get('/home'), 200),
+        ('GET /notes', lambda number: client.get('/notes?limit=20'), 200),
+        ('POST /notes', lambda number: client.post('/notes', data={
+            'title': f'{os.getpid()}-{threading.get_ident()}-{number}', 'text': 'load'}), 302),
+        ('GET /search', lambda number: client.get('/search?search=load'), 200),
+    ]
+    for number in range(requests):
+        for name, send, expected in checks:
+            try:
+                status = send(number).status_code
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(f'{name}: {e!r}')
+                continue
+            statuses[name] += 1
+            if status != expected:
+                errors.append(f'{name}: {status}')
+
+
+def _run_worker(app, engines, foreign: Counter) -> Dict:
+    # Checkouts the parent made of connections opened before tracking started are not ours
+    foreign.clear()
+    # One counter per thread: += on a shared Counter can lose increments
+    statuses: List[Counter] = [Counter() for _ in range(THREADS)]
+    errors: List[str] = []
+    workers = [threading.Thread(target=_hammer, args=(app, REQUESTS, counter, errors)) for counter in statuses]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return {
+        'requests': sum(sum(counter.values()) for counter in statuses),
+        'errors': errors[:10],
+        'foreign_checkouts': foreign['checkouts'],
+        'checked_out': sum(engine.pool.checkedout() for engine in engines),
+    }
+
+
+def test_forked_threaded_workers(app):
+    from models import engine, read_engine, shards
+
+    engines = (engine, read_engine, *shards.shard_engines)
+    foreign: Counter = Counter()
+    _track_connection_owners(engines, foreign)
+
+    notes_before = _count_notes(shards)
+
+    # The pools now hold an idle connection a child could wrongly reuse
+    children = {}
+    for _ in range(PROCESSES):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 1
+            try:
+                result = _run_worker(app, engines, foreign)
+                with os.fdopen(write_fd, 'w') as output:
+                    json.dump(result, output)
+                status = 0
+            finally:
+                os._exit(status)  # pylint: disable=protected-access
+
+        os.close(write_fd)
+        children[pid] = read_fd
+
+    results = []
+    for pid, read_fd in children.items():
+        with os.fdopen(read_fd) as output:
+            results.append(output.read())
+        _, status = os.waitpid(pid, 0)
+        assert status == 0 and results[-1], f'worker {pid} crashed (status {status})'
+
+    for result in map(json.loads, results):
+        assert not result['errors']
+        assert result['requests'] == THREADS * REQUESTS * 4
+        assert result['foreign_checkouts'] == 0, 'connection opened in another process'
+        assert result['checked_out'] == 0, 'connection left checked out'
+
+    assert _count_notes(shards) - notes_before == PROCESSES * THREADS * REQUESTS
@@ -0,0 +1,56 @@
+"""
+Bulk seeding into a separate database file.
+"""
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from db_seed import SeedProfile, bulk_loading, bulk_seed
+from models import migrate
+
+
+@pytest.fixture
+def seed_engine(tmp_path):
+    engine = create_engine('sqlite:///' + os.path.join(tmp_path, 'seed.db'))
+    migrate(engine)
+    yield engine
+    engine.dispose()
+
+
+def _schema(connection):
+    return connection.execute(text("SELECT type, name FROM sqlite_master WHERE tbl_name = 'notes' "
+                                    "AND type IN ('index', 'trigger') ORDER BY name")).all()
+
+
+def test_bulk_seed(seed_engine):
+    users, notes = bulk_seed(seed_engine, SeedProfile(users=5, notes_per_user=20, rounds=4))
+
+    with seed_engine.connect() as connection:
+        assert connection.execute(text('SELECT count(*) FROM users')).scalar() == users == 5
+        assert connection.execute(text('SELECT count(*) FROM notes')).scalar() == notes == 100
+        # Every note is searchable and public ones are in the feed
+        assert connection.execute(text('SELECT count(*) FROM notes_fts')).scalar() == notes
+        public = connection.execute(text('SELECT count(*) FROM notes WHERE private = 0')).scalar()
+        assert connection.execute(text('SELECT count(*) FROM feed WHERE audience = 0')).scalar() == public
+
+
+def test_failed_load_rolls_back(seed_engine):
+    bulk_seed(seed_engine, SeedProfile(users=2, notes_per_user=10, rounds=4))
+    with seed_engine.connect() as connection:
+        schema = _schema(connection)
+
+    with pytest.raises(RuntimeError):
+        with seed_engine.connect() as connection, bulk_loading(connection):
+            # A small cache spills the open transaction's pages into the file
+            connection.execute(text('PRAGMA cache_size = 10'))
+            connection.execute(text("INSERT INTO notes (title, text, user_id, private) "
+                                    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 5000) "
+                                    "SELECT 'spilled', hex(randomblob(500)), 1, 0 FROM n"))
+            raise RuntimeError('load failed')
+
+    with seed_engine.connect() as connection:
+        assert connection.execute(text('PRAGMA integrity_check')).scalar() == 'ok'
+        assert connection.execute(text('SELECT count(*) FROM notes')).scalar() == 20
+        assert connection.execute(text('SELECT count(*) FROM notes_fts')).scalar() == 20
+        assert _schema(connection) == schema
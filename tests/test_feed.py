@@ -0,0 +1,81 @@
+"""
+The materialized /home feed, kept in step with notes by triggers.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session as OrmSession
+
+from models import FeedEntry, Note, migrate, rebuild_feed
+from utils.feed import check, page_differences, table_differences
+from utils.notes import feed_statement, notes_for_user_statement
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def connection():
+    engine = create_engine('sqlite://')
+    migrate(engine)
+    with engine.connect() as connection:
+        yield connection
+
+
+def _insert(connection, note_id: int, user_id, private: bool) -> None:
+    connection.execute(text(
+        "INSERT INTO notes (id, created_at, title, text, user_id, private) "
+        "VALUES (:id, :created_at, 't', 't', :user_id, :private)"),
+        {'id': note_id, 'created_at': START + timedelta(minutes=note_id), 'user_id': user_id, 'private': private})
+
+
+def _feed(connection) -> dict:
+    return dict(connection.execute(text('SELECT note_id, audience FROM feed')).all())
+
+
+def test_triggers_follow_inserts_updates_and_deletes(connection):
+    _insert(connection, 1, 1, False)
+    _insert(connection, 2, 1, True)
+    _insert(connection, 3, None, True)
+    assert _feed(connection) == {1: FeedEntry.PUBLIC, 2: 1, 3: FeedEntry.NOBODY}
+
+    connection.execute(text('UPDATE notes SET private = 1 WHERE id = 1'))
+    connection.execute(text('UPDATE notes SET user_id = 2 WHERE id = 2'))
+    connection.execute(text('UPDATE notes SET private = 0 WHERE id = 3'))
+    assert _feed(connection) == {1: 1, 2: 2, 3: FeedEntry.PUBLIC}
+
+    connection.execute(text('DELETE FROM notes WHERE id = 2'))
+    assert _feed(connection) == {1: 1, 3: FeedEntry.PUBLIC}
+    assert table_differences(connection) == {'missing or stale': 0, 'extra': 0}
+
+
+def test_rebuild_repairs_the_feed(connection):
+    for note_id in range(1, 6):
+        _insert(connection, note_id, note_id % 2 + 1, note_id % 3 == 0)
+    connection.execute(text('DELETE FROM feed WHERE note_id = 2'))
+    connection.execute(text('UPDATE feed SET audience = 7 WHERE note_id = 3'))
+    connection.execute(text('INSERT INTO feed (note_id, audience) VALUES (99, 0)'))
+    assert table_differences(connection) == {'missing or stale': 2, 'extra': 2}
+
+    rebuild_feed(connection)
+    assert table_differences(connection) == {'missing or stale': 0, 'extra': 0}
+
+
+def test_feed_pages_match_the_notes_query(connection):
+    for note_id in range(1, 41):
+        _insert(connection, note_id, note_id % 3 + 1, note_id % 4 == 0)
+
+    session = OrmSession(bind=connection)
+    for user_id in (1, 2, 3, 4):
+        assert page_differences(session, user_id, pages=5, limit=7) == []
+
+    cursor = (START + timedelta(minutes=20), 20)
+    expected = session.scalars(notes_for_user_statement(2, 7, cursor)).all()
+    assert [note.id for note in session.scalars(feed_statement(2, 7, cursor))] == [note.id for note in expected]
+    assert all(not note.private or note.user_id == 2 for note in expected)
+    assert isinstance(expected[0], Note)
+
+
+def test_check_passes_on_the_app_database(app, capsys):
+    assert check(users=5, pages=2, limit=10)
+    assert '0 differences' in capsys.readouterr().out
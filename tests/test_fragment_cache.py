@@ -0,0 +1,60 @@
+"""
+Cached note cards and rows.
+"""
+import re
+
+from sqlalchemy import update
+
+from models import Note, ReadSession, User, shards
+from utils.fragment_cache import FragmentCache, fragment_cache
+from tests.conftest import EMAIL
+
+
+def test_lru_evicts_oldest_within_the_size_cap():
+    cache = FragmentCache(max_bytes=10)
+    cache.get_or_render(1, 'a', lambda: 'aaaa')
+    cache.get_or_render(2, 'b', lambda: 'bbbb')
+    cache.get_or_render(1, 'a', lambda: 'stale')
+    cache.get_or_render(3, 'c', lambda: 'cccc')
+
+    assert cache.size == 8
+    assert cache.get_or_render(1, 'a', lambda: 'fresh') == 'aaaa'
+    assert cache.get_or_render(2, 'b', lambda: 'fresh') == 'fresh'
+
+
+def test_oversized_fragments_are_not_cached():
+    cache = FragmentCache(max_bytes=3)
+    assert cache.get_or_render(1, 'a', lambda: 'long') == 'long'
+    assert cache.size == 0
+
+
+def test_invalidate_note_drops_all_its_renderings():
+    cache = FragmentCache(max_bytes=100)
+    cache.get_or_render(1, 'card', lambda: 'card')
+    cache.get_or_render(1, 'row', lambda: 'row')
+    cache.get_or_render(2, 'card', lambda: 'other')
+
+    cache.invalidate_note(1)
+
+    assert cache.size == len('other')
+    assert cache.get_or_render(1, 'card', lambda: 'new card') == 'new card'
+
+
+def test_privacy_change_by_another_process_is_rendered(user_client):
+    with ReadSession() as session:
+        user_id = session.query(User.id).filter(User.email == EMAIL).scalar()
+    user_client.post('/notes', data={'title': 'privacy toggled', 'text': 'text'})
+
+    def private_column() -> str:
+        page = user_client.get(f'/accounts/{user_id}/notes').get_data(as_text=True)
+        return re.search(r'<td>privacy toggled</td>\s*<td>text</td>\s*<td>(\w+)</td>', page).group(1)
+
+    assert private_column() == 'No'
+    assert fragment_cache.size
+
+    # Written straight to the database: this process's cache never hears of it
+    with shards.session_for_user(user_id) as session:
+        session.execute(update(Note).where(Note.title == 'privacy toggled').values(private=True))
+        session.commit()
+
+    assert private_column() == 'Yes'
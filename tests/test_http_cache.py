@@ -0,0 +1,95 @@
+"""
+Conditional GETs (ETag/304) and compression of dynamic responses.
+"""
+import gzip
+import json
+
+import brotli
+import pytest
+from flask import Response
+from sqlalchemy import text
+
+from models import Session
+from utils.compression import MIN_SIZE, compress_response
+
+
+def _etag(client, url: str) -> str:
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+@pytest.mark.parametrize('url', ['/home', '/notes', '/accounts/1/notes'])
+def test_matching_etag_is_answered_with_304(user_client, url):
+    response = user_client.get(url)
+    assert response.headers['ETag'].startswith('W/')
+    assert response.cache_control.private and response.cache_control.no_cache
+
+    cached = user_client.get(url, headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+    assert not cached.data
+    assert cached.headers['ETag'] == response.headers['ETag']
+
+
+def test_new_note_changes_the_etag(user_client, admin_client):
+    etag = _etag(user_client, '/home')
+    admin_client.post('/notes', data={'title': 'etag changer', 'text': 'text'})
+
+    response = user_client.get('/home', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'etag changer' in response.get_data(as_text=True)
+
+
+def test_user_changes_invalidate_home_but_not_notes(user_client):
+    home, notes = _etag(user_client, '/home'), _etag(user_client, '/notes')
+
+    with Session() as session:
+        session.execute(text('UPDATE users SET is_admin = is_admin'))
+        session.commit()
+
+    assert _etag(user_client, '/home') != home
+    assert _etag(user_client, '/notes') == notes
+
+
+def test_etag_depends_on_viewer_and_url(user_client, admin_client):
+    assert _etag(user_client, '/home') != _etag(admin_client, '/home')
+    assert _etag(user_client, '/home') != _etag(user_client, '/home?limit=5')
+
+
+def test_pending_flash_is_never_a_304(user_client):
+    etag = _etag(user_client, '/home')
+    # Flashes a form error without changing any data
+    user_client.post('/notes', data={'title': '', 'text': ''})
+
+    assert user_client.get('/home', headers={'If-None-Match': etag}).status_code == 200
+
+
+@pytest.mark.parametrize('encoding, decompress', [('gzip', gzip.decompress), ('br', brotli.decompress)])
+def test_pages_are_compressed(user_client, encoding, decompress):
+    plain = user_client.get('/home')
+    compressed = user_client.get('/home', headers={'Accept-Encoding': encoding})
+
+    assert compressed.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in compressed.vary
+    assert len(compressed.data) < len(plain.data)
+    assert decompress(compressed.data) == plain.data
+
+
+def test_streamed_json_is_compressed(user_client):
+    response = user_client.get('/notes?limit=200', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert json.loads(gzip.decompress(response.data))['notes']
+
+
+def test_small_and_unmodified_responses_are_not_compressed(app, user_client):
+    etag = _etag(user_client, '/home')
+
+    not_modified = user_client.get('/home', headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in not_modified.headers
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        small = compress_response(Response('{"ok": true}', mimetype='application/json'))
+        assert 'Content-Encoding' not in small.headers
+        image = compress_response(Response(b'\0' * MIN_SIZE, mimetype='image/png'))
+        assert 'Content-Encoding' not in image.headers
@@ -0,0 +1,203 @@
+"""
+The image job workers against a local stand-in for an image host: jobs
+queued before a restart are picked up, a job abandoned by a dead worker is
+requeued, downloads reuse keep-alive connections, a refresh is revalidated
+with ETag and Last-Modified, an unexpected 304 fails the job and idle
+workers never take the write lock.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import List
+
+import pytest
+
+ETAG = '"avatar-v1"'
+LAST_MODIFIED = formatdate(0, usegmt=True)
+WORKERS = 2
+POLL_INTERVAL = 0.1
+TIMEOUT = 10
+
+
+def _avatar() -> bytes:
+    from PIL import Image
+
+    output = BytesIO()
+    Image.new('RGB', (256, 256), (40, 120, 200)).save(output, 'PNG')
+    return output.getvalue()
+
+
+def _image_host(image: bytes, stats: Counter) -> ThreadingHTTPServer:
+    """
+    Serve /avatar.png with validators and /stale.png, which always answers
+    304 Not Modified, counting connections, requests and 304s.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            stats['connections'] += 1
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            stats['requests'] += 1
+            conditional = (self.headers.get('If-None-Match') == ETAG
+                           and self.headers.get('If-Modified-Since') == LAST_MODIFIED)
+            if self.path == '/stale.png' or (self.path == '/avatar.png' and conditional):
+                stats['not_modified'] += 1
+                self.send_response(304)
+                self.send_header('ETag', ETAG)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if self.path != '/avatar.png':
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(image)))
+            self.send_header('ETag', ETAG)
+            self.send_header('Last-Modified', LAST_MODIFIED)
+            self.end_headers()
+            self.wfile.write(image)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _status(job_id: int) -> str:
+    from models import ImageJob, ReadSession
+
+    with ReadSession() as session:
+        status = session.get(ImageJob, job_id).status
+    ReadSession.remove()
+    return status
+
+
+def _wait(*job_ids: int) -> List[str]:
+    from models import ImageJob
+
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        statuses = [_status(job_id) for job_id in job_ids]
+        if all(status in (ImageJob.DONE, ImageJob.FAILED) for status in statuses):
+            return statuses
+        time.sleep(POLL_INTERVAL)
+    return [_status(job_id) for job_id in job_ids]
+
+
+@pytest.fixture(scope='module')
+def image_host():
+    stats: Counter = Counter()
+    server = _image_host(_avatar(), stats)
+    yield f'http://127.0.0.1:{server.server_port}', stats
+    server.shutdown()
+
+
+@pytest.fixture(scope='module')
+def users(app):
+    from models import Session, User
+
+    with Session() as session:
+        user_ids = [user_id for user_id, in session.query(User.id).order_by(User.id).limit(2)]
+    Session.remove()
+    return user_ids
+
+
+@pytest.fixture
+def workers(app):
+    """
+    The app's pool, sized for the test; the suite runs with IMAGE_WORKERS=0.
+    """
+    from utils import image_jobs
+
+    patch = pytest.MonkeyPatch()
+    patch.setattr(image_jobs.workers, 'size', WORKERS)
+    patch.setattr(image_jobs, 'POLL_INTERVAL', POLL_INTERVAL)
+    yield image_jobs.workers
+    # Stopped threads let later tests fork a single-threaded process
+    image_jobs.workers.stop(TIMEOUT)
+    patch.undo()
+
+
+def test_jobs_left_by_previous_run(app, image_host, users, workers):
+    from models import ImageJob, Session
+    from utils.image_jobs import STALE_AFTER
+
+    url, _ = image_host
+    # A job nobody was told about and one its dead worker was still running
+    with Session() as session:
+        queued = ImageJob(users[0], f'{url}/avatar.png')
+        running = ImageJob(users[1], f'{url}/avatar.png')
+        running.status = ImageJob.RUNNING
+        running.attempts = 1
+        running.updated_at = datetime.now(timezone.utc) - STALE_AFTER - timedelta(seconds=1)
+        session.add_all([queued, running])
+        session.commit()
+        job_ids = queued.id, running.id
+    Session.remove()
+
+    # Any request starts the pool, nothing has to be enqueued
+    app.test_client().get('/login')
+    assert _wait(*job_ids) == [ImageJob.DONE, ImageJob.DONE]
+
+
+def test_refresh_is_revalidated(image_host, users, workers):
+    from models import ImageJob
+    from utils.image_jobs import enqueue
+
+    url, stats = image_host
+    assert _wait(enqueue(users[0], f'{url}/avatar.png')) == [ImageJob.DONE]
+    not_modified = stats['not_modified']
+    assert _wait(enqueue(users[0], f'{url}/avatar.png')) == [ImageJob.DONE]
+    assert stats['not_modified'] == not_modified + 1
+
+
+def test_unexpected_not_modified_fails_job(image_host, users, workers):
+    from models import ImageJob
+    from utils.image_jobs import enqueue
+
+    url, _ = image_host
+    assert _wait(enqueue(users[0], f'{url}/stale.png')) == [ImageJob.FAILED]
+
+
+def test_keep_alive_connections_reused(image_host, users, workers):
+    from models import ImageJob
+    from utils.image_jobs import enqueue
+
+    url, stats = image_host
+    connections, requests = stats['connections'], stats['requests']
+    for user_id in users * 2:
+        assert _wait(enqueue(user_id, f'{url}/avatar.png')) == [ImageJob.DONE]
+    assert stats['connections'] - connections <= WORKERS < stats['requests'] - requests
+
+
+def test_idle_workers_do_not_write(app, workers):
+    from sqlalchemy import event
+    from models import engine
+
+    writes: List[str] = []
+
+    def before_cursor_execute(_conn, _cursor, statement, _parameters, _context, _executemany):
+        if threading.current_thread().name.startswith('image-worker') \
+                and not statement.lstrip().upper().startswith(('SELECT', 'PRAGMA')):
+            writes.append(statement)
+
+    workers.start()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        time.sleep(POLL_INTERVAL * 10)
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    assert not writes
@@ -0,0 +1,64 @@
+"""
+The sanitizers against the straightforward implementations they replaced,
+on generated and hand-picked inputs.
+"""
+import random
+from typing import Callable, Iterator, List
+
+import pytest
+
+from benchmarks.sanitizers import (legacy_sanitize_email, legacy_sanitize_input, legacy_sanitize_text_field,
+                                   note_body)
+from utils.input_sanitizer import sanitize_email, sanitize_input, sanitize_many, sanitize_text_field
+
+CASES = 20000
+EDGE_CASES = ['', ' ', '\x00', '\x00\x00a', 'a' * 1001, '\x00' * 5 + 'a' * 1000, '<script>alert(1)</script>',
+              'vbjavascript:script:', 'javajavascript:script:', 'java\x00script:', '&amp;', 'ſcript:',
+              'javascr\u0130pt:', 'javascr\u0131pt:', 'vb\u017fcript:', 'JAVAſCRIPT:x']
+EMAILS = ['user@example.com', ' user@example.com ', 'us\x00er@example.com', 'user@example', 'a@b.co',
+          'user+tag@sub.example.org', '@example.com', 'user@@example.com', '']
+
+
+def cases(rng: random.Random, count: int) -> Iterator[str]:
+    yield from EDGE_CASES
+    alphabet = 'aAsScCrRiIpPtTjJvVbB:<>&"\'\x00 /\u0130\u0131\u017f'
+    for _ in range(count):
+        if rng.random() < 0.5:
+            yield ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        else:
+            yield note_body(rng, rng.randint(0, 1500), special_ratio=0.3)
+
+
+def _outcome(function: Callable, *args):
+    try:
+        return function(*args)
+    except ValueError as e:
+        return f'ValueError: {e}'
+
+
+@pytest.fixture(scope='module')
+def texts() -> List[str]:
+    return list(cases(random.Random(0), CASES))
+
+
+def test_sanitize_input(texts):
+    mismatches = [text for text in texts if sanitize_input(text) != legacy_sanitize_input(text)]
+    assert not mismatches[:20]
+    assert sanitize_input(None) is None
+
+
+@pytest.mark.parametrize('max_length', [10, 100, 1000])
+def test_sanitize_text_field(texts, max_length):
+    mismatches = [text for text in texts
+                  if sanitize_text_field(text, max_length) != legacy_sanitize_text_field(text, max_length)]
+    assert not mismatches[:20]
+    assert sanitize_text_field(None) == ""
+
+
+def test_sanitize_many(texts):
+    assert sanitize_many(texts + [None], 100) == [legacy_sanitize_text_field(text, 100) for text in texts + [None]]
+
+
+@pytest.mark.parametrize('email', EMAILS)
+def test_sanitize_email(email):
+    assert _outcome(sanitize_email, email) == _outcome(legacy_sanitize_email, email)
@@ -0,0 +1,78 @@
+"""
+NDJSON import and export of notes.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.note_transfer import parse_record
+
+
+def _line(**fields) -> bytes:
+    return json.dumps({'title': 'title', 'text': 'text', **fields}).encode()
+
+
+def test_created_at_converted_to_utc():
+    row = parse_record(_line(created_at='2024-01-01T12:00:00+02:00'), 1)
+    assert row['created_at'] == datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+    assert row['created_at'].utcoffset() == timedelta(0)
+
+
+def test_naive_created_at_is_utc():
+    row = parse_record(_line(created_at='2024-01-01T12:00:00'), 1)
+    assert row['created_at'] == datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def test_future_created_at_clamped_to_now():
+    before = datetime.now(timezone.utc)
+    row = parse_record(_line(created_at='2999-01-01T00:00:00+00:00'), 1)
+    assert before <= row['created_at'] <= datetime.now(timezone.utc)
+
+
+@pytest.mark.parametrize('created_at', ['0001-01-01T00:00:00+01:00', '9999-12-31T23:59:59-01:00'])
+def test_created_at_offset_past_the_calendar(created_at):
+    with pytest.raises(ValueError, match='created_at is out of range'):
+        parse_record(_line(created_at=created_at), 1)
+
+
+@pytest.mark.parametrize('line, error', [
+    (b'{not json', 'Invalid JSON'),
+    (b'[1, 2]', 'Expected a JSON object'),
+    (_line(title=''), 'title must be a non-empty string'),
+    (_line(text=3), 'text must be a non-empty string'),
+    (_line(private='yes'), 'private must be a boolean'),
+    (_line(created_at='yesterday'), 'created_at must be an ISO 8601 date'),
+])
+def test_invalid_records(line, error):
+    with pytest.raises(ValueError, match=error):
+        parse_record(line, 1)
+
+
+def test_import_reports_failed_lines(user_client):
+    body = b'\n'.join([
+        _line(title='import ok 1'),
+        b'{not json',
+        b'',
+        _line(title='import bad date', created_at='0001-01-01T00:00:00+01:00'),
+        _line(title='import ok 2', created_at='2024-01-01T00:00:00-05:00'),
+    ])
+    response = user_client.post('/notes/import', data=body, content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report['imported'] == 2
+    assert report['failed'] == 2
+    assert [error['line'] for error in report['errors']] == [2, 4]
+    assert report['errors'][1]['error'] == 'created_at is out of range'
+
+
+def test_export_round_trips_import(user_client):
+    user_client.post('/notes/import', data=_line(title='round <trip> & back', created_at='2020-02-02T00:00:00Z'),
+                     content_type='application/x-ndjson')
+
+    exported = [json.loads(line) for line in user_client.get('/notes/export').data.splitlines()]
+    note = next(note for note in exported if note['title'] == 'round <trip> & back')
+    assert note['text'] == 'text'
+    # Stored without an offset, in UTC, and read back as UTC on import
+    assert note['created_at'].startswith('2020-02-02T00:00:00')
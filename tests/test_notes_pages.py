@@ -0,0 +1,85 @@
+"""
+Keyset pagination of /home and the streamed GET /notes.
+"""
+import json
+from datetime import datetime
+
+from models import ReadSession, User
+from utils.notes import decode_cursor, encode_cursor, get_notes_for_user
+from tests.conftest import EMAIL
+
+
+def _user_id() -> int:
+    with ReadSession() as session:
+        return session.query(User.id).filter(User.email == EMAIL).scalar()
+
+
+def _add_notes(client, prefix: str, count: int, private: bool = False) -> None:
+    for number in range(count):
+        data = {'title': f'{prefix} {number}', 'text': 'text'}
+        if private:
+            data['private'] = 'y'
+        assert client.post('/notes', data=data).status_code == 302
+
+
+def _walk(client, limit: int):
+    notes, url, pages = [], f'/notes?limit={limit}', 0
+    while url:
+        page = client.get(url).get_json()
+        assert len(page['notes']) <= limit
+        notes += page['notes']
+        url, pages = page['next'], pages + 1
+    return notes, pages
+
+
+def test_cursor_round_trip():
+    class Row:
+        created_at = datetime(2024, 1, 2, 3, 4, 5, 6)
+        id = 42
+
+    assert decode_cursor(encode_cursor(Row())) == (Row.created_at, 42)
+
+
+def test_notes_pages_cover_every_note_once(user_client):
+    _add_notes(user_client, 'paged', 5)
+
+    notes, pages = _walk(user_client, 2)
+    everything = user_client.get('/notes?limit=200').get_json()
+
+    assert everything['next'] is None
+    assert [note['id'] for note in notes] == [note['id'] for note in everything['notes']]
+    assert pages == (len(notes) + 1) // 2
+    assert [note['title'] for note in notes[:5]] == [f'paged {number}' for number in reversed(range(5))]
+
+
+def test_private_notes_of_others_are_not_listed(user_client, admin_client):
+    _add_notes(admin_client, 'admin only', 2, private=True)
+    _add_notes(admin_client, 'admin public', 1)
+
+    titles = {note['title'] for note in _walk(user_client, 3)[0]}
+    assert 'admin public 0' in titles
+    assert not {'admin only 0', 'admin only 1'} & titles
+
+
+def test_home_matches_the_notes_query(user_client):
+    user_id = _user_id()
+    notes, next_cursor = get_notes_for_user(user_id, 3)
+
+    assert len(notes) == 3 and next_cursor == encode_cursor(notes[-1])
+    second, _ = get_notes_for_user(user_id, 3, decode_cursor(next_cursor))
+    expected = user_client.get('/notes?limit=6').get_json()['notes']
+    assert [note.id for note in notes + second] == [note['id'] for note in expected]
+
+    page = user_client.get(f'/home?limit=3&cursor={next_cursor}').get_data(as_text=True)
+    assert all(note.title in page for note in second)
+
+
+def test_bad_cursor_is_rejected(user_client):
+    assert user_client.get('/notes?cursor=not-a-cursor').status_code == 400
+    assert user_client.get('/home?cursor=not-a-cursor').status_code == 400
+
+
+def test_limit_is_clamped(user_client):
+    page = user_client.get('/notes?limit=0').get_json()
+    assert len(page['notes']) == 1
+    assert json.loads(user_client.get(page['next']).data)['notes']
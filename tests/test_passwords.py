@@ -0,0 +1,83 @@
+"""
+Password hashing, inline and in the process pool.
+"""
+import os
+import sys
+import threading
+from typing import List
+
+import pytest
+
+from utils import passwords
+from utils.passwords import PasswordHasher, hash_rounds
+
+
+@pytest.fixture
+def pooled():
+    hasher = PasswordHasher(rounds=4, workers=2)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_inline_hash_and_verify():
+    hasher = PasswordHasher(rounds=4, workers=0)
+    hashed = hasher.hash('secret')
+
+    assert hash_rounds(hashed) == 4
+    assert hasher.verify('secret', hashed)
+    assert not hasher.verify('wrong', hashed)
+
+
+def test_pool_does_not_fork_the_calling_process(pooled):
+    hashed = pooled.hash('secret')
+
+    assert pooled.verify('secret', hashed)
+    # Hashing processes start from a fresh interpreter, nothing is forked
+    assert pooled._pool()._mp_context.get_start_method() == 'spawn'  # pylint: disable=protected-access
+
+
+def test_pool_from_many_threads(pooled):
+    hashes: List[bool] = []
+
+    def hash_and_verify(number: int):
+        hashes.append(pooled.verify(f'secret-{number}', pooled.hash(f'secret-{number}')))
+
+    threads = [threading.Thread(target=hash_and_verify, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert hashes == [True] * 8
+
+
+def test_forked_process_gets_its_own_pool(pooled):
+    pooled.hash('secret')
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            status = 0 if pooled.verify('secret', pooled.hash('secret')) else 1
+        finally:
+            os._exit(status)  # pylint: disable=protected-access
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+
+
+@pytest.mark.parametrize('rounds, expected', [(4, False), (5, True)])
+def test_needs_rehash(rounds, expected):
+    hashed = PasswordHasher(rounds=4, workers=0).hash('secret')
+    assert PasswordHasher(rounds=rounds, workers=0).needs_rehash(hashed) is expected
+
+
+def test_pool_under_uwsgi(monkeypatch):
+    # uWSGI embeds the interpreter: sys.executable is the uwsgi binary
+    monkeypatch.setattr(sys, 'executable', '/usr/local/bin/uwsgi')
+    assert os.access(passwords._python_executable(), os.X_OK)  # pylint: disable=protected-access
+
+    hasher = PasswordHasher(rounds=4, workers=1)
+    try:
+        assert hasher.verify('secret', hasher.hash('secret'))
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,79 @@
+"""
+EXPLAIN QUERY PLAN regression tests for the hot queries.
+
+Builds an empty database through the migration path and fails if any hot
+query falls back to a full table scan.
+"""
+import re
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import Executable
+
+from models import BaseModel, Note, User, migrate
+from utils.notes import SEARCH_SQL, feed_statement, personal_notes_statement
+from utils.registration_codes import codes_page_statement, redeem_statement
+
+CURSOR = (datetime(2024, 1, 1, tzinfo=timezone.utc), 10)
+
+
+def hot_queries() -> Dict[str, Executable]:
+    return {
+        'home feed': feed_statement(1, 51, with_user=True),
+        'home feed, next page': feed_statement(1, 51, CURSOR, with_user=True),
+        'notes json': feed_statement(1, 51, CURSOR),
+        'personal notes': personal_notes_statement(1),
+        'search': SEARCH_SQL.bindparams(query='"note"*', user_id=1, limit=100),
+        'login': select(User).where(User.email == 'user@example.com'),
+        'load user': select(User).where(User.id == 1),
+        'redeem registration code': redeem_statement('code'),
+        'registration codes page': codes_page_statement(51, 10),
+        'delete note': select(Note).where(Note.id == 1),
+    }
+
+
+def explain(connection: Connection, statement: Executable) -> List[str]:
+    """
+    Query plan lines of a statement, without running it.
+    """
+    def prefix(_conn, _cursor, sql, parameters, _context, _executemany):
+        return 'EXPLAIN QUERY PLAN ' + sql, parameters
+
+    event.listen(connection, 'before_cursor_execute', prefix, retval=True)
+    try:
+        return [row[3] for row in connection.execute(statement).cursor.fetchall()]
+    finally:
+        event.remove(connection, 'before_cursor_execute', prefix)
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    """
+    Plan lines that read a table without any index.
+
+    'SCAN notes USING INDEX ...' is allowed: it is an ordered index walk that
+    stops at the LIMIT, which is exactly how the first feed page is served.
+    """
+    tables = set(BaseModel.metadata.tables)
+    scans = []
+    for line in plan:
+        match = re.fullmatch(r'SCAN (\w+)', line)
+        if match and re.sub(r'_\d+$', '', match.group(1)) in tables:
+            scans.append(line)
+    return scans
+
+
+@pytest.fixture(scope='module')
+def connection():
+    engine = create_engine('sqlite://')
+    migrate(engine)
+    with engine.connect() as connection:
+        yield connection
+
+
+@pytest.mark.parametrize('name', hot_queries())
+def test_no_full_table_scan(connection, name):
+    plan = explain(connection, hot_queries()[name])
+    assert not full_scans(plan), '\n'.join(plan)
@@ -0,0 +1,152 @@
+"""
+Registration codes: one signup per code, even when signups race.
+"""
+import threading
+from itertools import count
+from typing import List
+
+import pytest
+
+_emails = count()
+
+
+def _new_codes(number: int = 1) -> List[str]:
+    from models import Session
+    from utils.registration_codes import generate_codes
+
+    with Session() as session:
+        codes = generate_codes(session, number)
+        session.commit()
+    Session.remove()
+    return codes
+
+
+def _signup(client, code: str):
+    return client.post('/signup', data={'email': f'signup{next(_emails)}@example.com',
+                                        'password': 'Signup-password-1', 'registration_code': code})
+
+
+def _user_count() -> int:
+    from models import ReadSession, User
+
+    with ReadSession() as session:
+        users = session.query(User).count()
+    ReadSession.remove()
+    return users
+
+
+@pytest.fixture
+def hashes(monkeypatch) -> List[str]:
+    from utils.passwords import hasher
+
+    hashed: List[str] = []
+    original = hasher.hash
+
+    def hash_password(password: str) -> str:
+        hashed.append(password)
+        return original(password)
+
+    monkeypatch.setattr(hasher, 'hash', hash_password)
+    return hashed
+
+
+def test_code_is_consumed_by_signup(app, client):
+    from utils.registration_codes import code_exists
+
+    code, = _new_codes()
+    users = _user_count()
+
+    assert _signup(client, code).headers['Location'] == '/home'
+    assert not code_exists(code)
+    assert _user_count() == users + 1
+
+
+def test_code_cannot_be_reused(app, client):
+    code, = _new_codes()
+    _signup(client, code)
+    users = _user_count()
+
+    assert _signup(app.test_client(), code).headers['Location'] == '/signup'
+    assert _user_count() == users
+
+
+def test_unknown_code_is_rejected_before_hashing(client, hashes):
+    response = _signup(client, 'not-a-registration-code')
+
+    assert response.headers['Location'] == '/signup'
+    assert not hashes
+
+
+def test_failed_signup_keeps_the_code(app, client):
+    from tests.conftest import EMAIL
+    from utils.registration_codes import code_exists
+
+    code, = _new_codes()
+    response = client.post('/signup', data={'email': EMAIL, 'password': 'Signup-password-1',
+                                            'registration_code': code})
+
+    assert response.headers['Location'] == '/signup'
+    assert code_exists(code)
+
+
+def test_concurrent_redeems_consume_a_code_once(app):
+    from models import Session
+    from utils.registration_codes import redeem
+
+    code, = _new_codes()
+    threads = 8
+    barrier = threading.Barrier(threads)
+    redeemed: List[bool] = []
+
+    def redeem_code():
+        with Session() as session:
+            barrier.wait()
+            redeemed.append(redeem(session, code))
+            session.commit()
+        Session.remove()
+
+    workers = [threading.Thread(target=redeem_code) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(redeemed) == [False] * (threads - 1) + [True]
+
+
+def test_concurrent_signups_with_one_code(app):
+    code, = _new_codes()
+    users = _user_count()
+    threads = 8
+    barrier = threading.Barrier(threads)
+    locations: List[str] = []
+
+    def signup():
+        client = app.test_client()
+        barrier.wait()
+        locations.append(_signup(client, code).headers['Location'])
+
+    workers = [threading.Thread(target=signup) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(locations) == ['/home'] + ['/signup'] * (threads - 1)
+    assert _user_count() == users + 1
+
+
+def test_bulk_codes_listed_and_exported(admin_client):
+    response = admin_client.post('/registration-codes', data={'count': 60})
+    assert response.status_code == 302
+
+    first = admin_client.get('/registration-codes?limit=50')
+    assert first.status_code == 200
+    exported = admin_client.get('/registration-codes/export.csv').data.decode().splitlines()
+    assert exported[0] == 'code,created_at'
+    assert len(exported) > 60
+
+
+def test_codes_page_needs_admin(user_client):
+    assert user_client.get('/registration-codes').headers['Location'] == '/home'
+    assert user_client.post('/registration-codes', data={'count': 5}).headers['Location'] == '/home'
@@ -0,0 +1,85 @@
+"""
+Full-text search over the unescaped note text.
+"""
+import html
+import sqlite3
+
+import pytest
+
+from models import ReadSession, User
+from models.migrations import unescape_sql
+from utils.input_sanitizer import sanitize_text_field
+from utils.notes import search_notes_for_user
+from tests.conftest import EMAIL
+
+
+@pytest.fixture
+def user_id(app):
+    with ReadSession() as session:
+        return session.query(User.id).filter(User.email == EMAIL).scalar()
+
+
+def _add_note(client, title: str, text: str) -> None:
+    response = client.post('/notes', data={'title': title, 'text': text})
+    assert response.status_code == 302
+
+
+@pytest.mark.parametrize('value', [
+    'plain', 'Tom & Jerry', '<b>"quoted"</b>', "it's", '&amp; already escaped', '&lt;&gt;&#x27;',
+])
+def test_unescape_sql_inverts_escaping(value):
+    connection = sqlite3.connect(':memory:')
+    escaped = sanitize_text_field(value)
+    assert connection.execute(f"SELECT {unescape_sql('?')}", (escaped,)).fetchone()[0] == value
+
+
+def test_entity_names_do_not_match(user_client, user_id):
+    _add_note(user_client, 'entities quokka', 'Tom & Jerry <3 "hi"')
+
+    assert [row.title for row in search_notes_for_user(user_id, 'quokka')] == ['entities <mark>quokka</mark>']
+    for word in ('amp', 'lt', 'quot'):
+        assert not [row for row in search_notes_for_user(user_id, word) if 'quokka' in row.title]
+
+
+def test_escaped_query_matches_unescaped_text(user_client, user_id):
+    _add_note(user_client, 'ampersand wombat', 'salt & pepper')
+
+    rows = search_notes_for_user(user_id, sanitize_text_field('salt & pepper'))
+    assert [row.title for row in rows] == ['ampersand wombat']
+
+
+def test_highlights_are_escaped(user_client, user_id):
+    _add_note(user_client, '<b>bold</b> numbat', 'a < numbat > b & c')
+
+    row, = search_notes_for_user(user_id, 'numbat')
+    assert row.title == '&lt;b&gt;bold&lt;/b&gt; <mark>numbat</mark>'
+    assert row.text == 'a &lt; <mark>numbat</mark> &gt; b &amp; c'
+
+
+def test_highlight_markers_in_notes_are_dropped(user_client, user_id):
+    _add_note(user_client, 'marker \x02dingo\x03', 'text')
+
+    row, = search_notes_for_user(user_id, 'dingo')
+    assert row.title == 'marker <mark>dingo</mark>'
+
+
+def test_search_page_renders_highlights(user_client):
+    _add_note(user_client, 'page <i>bilby</i>', 'text')
+
+    page = user_client.get('/search?search=bilby').get_data(as_text=True)
+    assert 'page &lt;i&gt;<mark>bilby</mark>&lt;/i&gt;' in page
+
+
+def test_deleted_notes_leave_the_index(user_client, user_id):
+    _add_note(user_client, 'deleted & gone potoroo', 'text')
+    row, = search_notes_for_user(user_id, 'potoroo')
+
+    user_client.post(f'/notes/{row.id}/delete')
+    assert search_notes_for_user(user_id, 'potoroo') == []
+
+
+def test_empty_query_lists_stored_notes(user_client, user_id):
+    _add_note(user_client, 'listed & stored', 'text')
+
+    titles = [row.title for row in search_notes_for_user(user_id, '')]
+    assert html.escape('listed & stored') in titles
@@ -0,0 +1,110 @@
+"""
+Routing of notes to shard files and note id allocation.
+"""
+import pytest
+from sqlalchemy import create_engine, text
+
+from models import Note, ReadSession, User, shards
+from models.migrations import migrate_shard
+from models.shards import ShardRouter, shard_url
+from utils.shards import _copy
+from tests.conftest import EMAIL
+
+
+@pytest.fixture
+def router(tmp_path):
+    router = ShardRouter(3, f'sqlite:///{tmp_path}/database.db', None, None, None, None)
+    router.migrate()
+    yield router
+    router.remove()
+    for engine in router.shard_engines:
+        engine.dispose()
+
+
+def test_shard_url():
+    assert shard_url('sqlite:////data/database.db', 2) == 'sqlite:////data/database.notes-2.db'
+    assert shard_url('sqlite:///database.db', 0, '.split') == 'sqlite:///database.notes-0.db.split'
+    with pytest.raises(ValueError):
+        shard_url('sqlite://', 0)
+
+
+def test_at_least_one_shard():
+    with pytest.raises(ValueError):
+        ShardRouter(0, 'sqlite:///database.db', None, None, None, None)
+
+
+def test_routing(router):
+    assert router.sharded
+    assert [router.for_user(user_id) for user_id in (None, 1, 2, 3, 4)] == [0, 1, 2, 0, 1]
+    assert router.for_note(7) == 1
+    assert [engine.url.database.rsplit('.', 2)[-2] for engine in router.engines] == [
+        'notes-0', 'notes-1', 'notes-2']
+
+
+@pytest.mark.parametrize('user_id', [None, 1, 2, 3])
+def test_note_ids_belong_to_the_owners_shard(router, user_id):
+    shard = router.for_user(user_id)
+    with router.session_for_user(user_id) as session:
+        ids = router.allocate_note_ids(session, user_id, 3)
+        session.add_all(Note(id=note_id, title='t', text='t', user_id=user_id) for note_id in ids)
+        session.commit()
+
+        more = router.allocate_note_ids(session, user_id, 2)
+        session.rollback()
+
+    assert all(router.for_note(note_id) == shard for note_id in ids + more)
+    assert ids[0] > 0
+    assert more == [ids[-1] + 3, ids[-1] + 6]
+
+
+def test_single_shard_is_the_main_database():
+    router = ShardRouter(1, 'sqlite:///database.db', 'engine', 'read engine',
+                         lambda: 'session', lambda: 'read session')
+
+    assert not router.sharded and router.shard_engines == []
+    assert router.engines == ['engine'] and router.read_engines == ['read engine']
+    assert router.session_for_user(5) == 'session' and router.read_session_for_user(5) == 'read session'
+    assert router.allocate_note_ids(None, 1, 2) == [None, None]
+
+
+def test_app_notes_land_in_the_owners_shard(user_client):
+    with ReadSession() as session:
+        user_id = session.query(User.id).filter(User.email == EMAIL).scalar()
+    user_client.post('/notes', data={'title': 'routed note', 'text': 'text'})
+
+    found = []
+    for index, read_session in enumerate(shards.read_sessions):
+        with read_session() as session:
+            found += [(index, note.id) for note in session.query(Note).filter(Note.title == 'routed note')]
+    (index, note_id), = found
+    assert index == shards.for_user(user_id)
+    assert shards.for_note(note_id) == index
+
+
+def test_split_renumbers_into_the_owners_shard(tmp_path):
+    source = create_engine(f'sqlite:///{tmp_path}/source.db')
+    migrate_shard(source)
+    with source.begin() as connection:
+        for number, user_id in enumerate([1, 2, 3, 4, None, 2], start=1):
+            connection.execute(text(
+                "INSERT INTO notes (id, title, text, user_id, private) VALUES (:id, 't', 't', :user_id, 0)"),
+                {'id': number, 'user_id': user_id})
+
+    targets = [create_engine(f'sqlite:///{tmp_path}/target-{index}.db') for index in range(2)]
+    for target in targets:
+        migrate_shard(target)
+    connections = [target.connect() for target in targets]
+    copied, _ = _copy([source], connections, batch_size=2)
+    for connection in connections:
+        connection.commit()
+
+    assert copied == 6
+    ids = []
+    for index, connection in enumerate(connections):
+        rows = connection.execute(text('SELECT id, user_id FROM notes')).all()
+        assert all(note_id % 2 == index and (user_id or 0) % 2 == index for note_id, user_id in rows)
+        ids.append([note_id for note_id, _ in rows])
+        connection.close()
+    # Users 2, 4, None and 2 again in shard 0; users 1 and 3 in shard 1
+    assert [len(shard_ids) for shard_ids in ids] == [4, 2]
+    assert len(set(ids[0] + ids[1])) == 6
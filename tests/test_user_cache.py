@@ -0,0 +1,76 @@
+"""
+Per-process cache behind the Flask-Login user loader.
+"""
+import pytest
+
+from models import Session, User
+from routes.login import load_user
+from utils.passwords import hasher
+from utils.user_cache import CachedUser, SharedGenerations, UserCache, user_cache
+from tests.conftest import login
+
+
+def _user(user_id: int, email: str = 'cached@evfa.com') -> CachedUser:
+    return CachedUser(user_id, email, False, None)
+
+
+def test_entries_expire():
+    cache = UserCache(ttl=0)
+    cache.put(_user(1))
+    assert cache.get(1) is None
+
+
+def test_least_recently_used_is_evicted():
+    cache = UserCache(max_size=2)
+    cache.put(_user(1))
+    cache.put(_user(2))
+    cache.get(1)
+    cache.put(_user(3))
+
+    assert cache.get(1) is not None
+    assert cache.get(2) is None
+    assert cache.get(3) is not None
+
+
+def test_invalidation_reaches_other_workers(tmp_path):
+    path = str(tmp_path / 'generations')
+    worker, other_worker = UserCache(shared=SharedGenerations(path)), UserCache(shared=SharedGenerations(path))
+    worker.put(_user(1))
+    other_worker.put(_user(1))
+    other_worker.put(_user(2))
+
+    worker.invalidate(1)
+
+    assert worker.get(1) is None
+    assert other_worker.get(1) is None
+    assert other_worker.get(2) is not None
+
+
+def test_loader_serves_cached_users(app):
+    cached = user_cache.put(_user(123456))
+    try:
+        assert load_user('123456') is cached
+        assert load_user('not a number') is None
+    finally:
+        user_cache.clear()
+
+
+@pytest.fixture
+def cached_client(app):
+    with Session() as session:
+        session.add(User('cache@evfa.com', hasher.hash('CachePassword123!')))
+        session.commit()
+
+    yield login(app, 'cache@evfa.com', 'CachePassword123!')
+
+    with Session() as session:
+        session.query(User).filter(User.email.in_(['cache@evfa.com', 'cache-new@evfa.com'])).delete()
+        session.commit()
+
+
+def test_account_update_invalidates_the_cached_user(cached_client):
+    assert 'value="cache@evfa.com"' in cached_client.get('/account').get_data(as_text=True)
+
+    cached_client.post('/account', data={'email': 'cache-new@evfa.com'})
+
+    assert 'value="cache-new@evfa.com"' in cached_client.get('/account').get_data(as_text=True)
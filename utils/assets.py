@@ -0,0 +1,174 @@
+"""
+Fingerprinted, precompressed static assets.
+
+The build copies every static file the app serves (static/ and the
+Bootstrap/CKEditor blueprint folders) into static/dist under
+content-hashed names, writes .gz and .br variants next to them and a
+manifest. When the manifest exists, url_for('static'/'bootstrap.static'/
+'ckeditor.static', filename=...) points at the hashed copy, which nginx
+serves with a year-long immutable Cache-Control.
+
+Files from static/ are hashed one by one. Blueprint folders are copied as a
+whole into a directory named after the hash of the tree, because their
+files reference each other by relative path (CKEditor loads its plugins,
+skins and languages next to ckeditor.js).
+
+Usage: python -m utils.assets build
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+from hashlib import sha256
+from typing import Dict, Iterator, Optional, Tuple
+
+from flask import Flask
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, only the build needs it
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.map', '.txt', '.html', '.xml', '.ico', '.ttf', '.eot'}
+# Smaller files gain less than the Content-Encoding overhead
+MIN_COMPRESS_SIZE = 1024
+
+
+def _digest(path: str) -> str:
+    hasher = sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(65536), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _walk(folder: str, skip: Optional[str] = None) -> Iterator[str]:
+    """
+    Relative paths of the files under a folder, sorted, without `skip`.
+    """
+    for root, directories, files in os.walk(folder):
+        directories[:] = sorted(d for d in directories if os.path.join(root, d) != skip)
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/')
+
+
+def _fingerprint(filename: str, digest: str) -> str:
+    stem, extension = os.path.splitext(filename)
+    return f'{stem}.{digest[:HASH_LENGTH]}{extension}'
+
+
+def _compress(path: str) -> None:
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE or os.path.getsize(path) < MIN_COMPRESS_SIZE:
+        return
+
+    with open(path, 'rb') as source:
+        data = source.read()
+
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as output:
+                output.write(compressed)
+
+
+def static_folders(app: Flask) -> Iterator[Tuple[str, str]]:
+    """
+    (endpoint, folder) of the app's and every blueprint's static files.
+    """
+    yield 'static', app.static_folder
+    for blueprint in app.blueprints.values():
+        if blueprint.has_static_folder:
+            yield f'{blueprint.name}.static', blueprint.static_folder
+
+
+def build(app: Flask) -> Dict:
+    """
+    Rebuild static/dist and its manifest.
+
+    Returns:
+        The manifest: per endpoint, either 'files' (filename to hashed
+        filename) or 'prefix' (directory holding the whole folder)
+    """
+    dist = os.path.join(app.static_folder, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+
+    manifest = {}
+    for endpoint, folder in static_folders(app):
+        if endpoint == 'static':
+            files = {}
+            for filename in _walk(folder, skip=dist):
+                hashed = _fingerprint(filename, _digest(os.path.join(folder, filename)))
+                target = os.path.join(dist, hashed)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(os.path.join(folder, filename), target)
+                _compress(target)
+                files[filename] = f'{DIST_DIR}/{hashed}'
+            manifest[endpoint] = {'files': files}
+            continue
+
+        tree = sha256()
+        for filename in _walk(folder):
+            tree.update(f'{filename}\0{_digest(os.path.join(folder, filename))}\0'.encode())
+        directory = f'{endpoint.split(".")[0]}.{tree.hexdigest()[:HASH_LENGTH]}'
+        shutil.copytree(folder, os.path.join(dist, directory))
+        for filename in _walk(os.path.join(dist, directory)):
+            _compress(os.path.join(dist, directory, filename))
+        manifest[endpoint] = {'prefix': f'{DIST_DIR}/{directory}/'}
+
+    with open(os.path.join(dist, MANIFEST), 'w', encoding='utf-8') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+def init_assets(app: Flask) -> None:
+    """
+    Route url_for of static files to their fingerprinted copies, if built.
+    """
+    path = os.path.join(app.static_folder, DIST_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return
+
+    with open(path, encoding='utf-8') as source:
+        manifest = json.load(source)
+
+    build_url = app.url_for
+
+    def url_for(endpoint: str, **values) -> str:
+        entry = manifest.get(endpoint)
+        filename = values.get('filename')
+        if entry is not None and filename is not None:
+            hashed = entry['files'].get(filename) if 'files' in entry else entry['prefix'] + filename
+            if hashed is not None:
+                endpoint, values['filename'] = 'static', hashed
+        return build_url(endpoint, **values)
+
+    # flask.url_for and the Jinja global both go through app.url_for
+    app.url_for = url_for
+    app.jinja_env.globals['url_for'] = url_for
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets')
+    parser.add_argument('command', choices=['build'])
+    parser.parse_args()
+
+    # Local import: the app is only needed to find the static folders
+    from app import create_app  # pylint: disable=import-outside-toplevel
+
+    manifest = build(create_app())
+    for endpoint, entry in manifest.items():
+        print(f"{endpoint}: {len(entry['files'])} files" if 'files' in entry else f"{endpoint}: {entry['prefix']}")
+    if brotli is None:
+        print('brotli is not installed, only .gz variants were written')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+gzip/brotli compression of dynamic responses.
+
+Bodies are compressed when the client accepts it and they are large enough
+to benefit. Streamed responses (GET /notes) are compressed chunk by chunk,
+flushing after each one so the client still receives them progressively.
+Static files are precompressed at build time (utils/assets.py) and never
+reach this code in production.
+"""
+import os
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import Flask, Response, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+# Per-request CPU matters more than the last percent of size
+BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                      'application/javascript', 'application/x-ndjson', 'image/svg+xml'}
+
+
+class _Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+ENCODERS = {'gzip': _Gzip}
+if brotli is not None:
+    ENCODERS['br'] = _Brotli
+
+
+def choose_encoding() -> Optional[str]:
+    """
+    Best encoding the client accepts, brotli first.
+    """
+    for encoding in ('br', 'gzip'):
+        if encoding in ENCODERS and request.accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def _stream(chunks: Iterable, encoder) -> Iterator[bytes]:
+    try:
+        for chunk in chunks:
+            compressed = encoder.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if compressed:
+                yield compressed
+        yield encoder.finish()
+    finally:
+        # Ends stream_with_context's request context
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response: Response) -> Response:
+    if (request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _stream(response.response, ENCODERS[encoding]())
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        encoder = ENCODERS[encoding]()
+        response.set_data(encoder.compress(data) + encoder.finish())
+
+    response.content_encoding = encoding
+    return response
+
+
+def init_compression(app: Flask) -> None:
+    app.after_request(compress_response)
@@ -0,0 +1,107 @@
+"""
+Maintenance of the materialized /home feed (models.FeedEntry).
+
+rebuild  refill the feed table from notes
+check    compare the feed table with notes, then compare the pages that
+         feed_statement serves with notes_for_user_statement for a sample
+         of users; exits 1 on any difference
+
+When notes are sharded (models.shards) both run on every shard file.
+
+Usage: python -m utils.feed rebuild | check [--users 20] [--pages 3] [--limit 50]
+"""
+import argparse
+import random
+import sys
+from typing import List
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session as OrmSession
+
+from models import User, read_engine, rebuild_feed, shards
+from models.migrations import FEED_AUDIENCE_SQL
+from utils.notes import feed_statement, notes_for_user_statement
+
+EXPECTED_SQL = f"SELECT id, {FEED_AUDIENCE_SQL.format(note='notes')}, created_at FROM notes"
+ACTUAL_SQL = "SELECT note_id, audience, created_at FROM feed"
+
+
+def table_differences(connection: Connection) -> dict:
+    """
+    Feed rows missing or wrong compared to notes, and feed rows with no matching note.
+    """
+    return {
+        'missing or stale': connection.execute(
+            text(f"SELECT count(*) FROM ({EXPECTED_SQL} EXCEPT {ACTUAL_SQL})")).scalar(),
+        'extra': connection.execute(text(f"SELECT count(*) FROM ({ACTUAL_SQL} EXCEPT {EXPECTED_SQL})")).scalar(),
+    }
+
+
+def page_differences(session: OrmSession, user_id: int, pages: int, limit: int) -> List[str]:
+    """
+    Pages on which the feed and the reference query disagree for a user.
+    """
+    cursor = None
+    for number in range(1, pages + 1):
+        expected = session.scalars(notes_for_user_statement(user_id, limit, cursor)).all()
+        actual = session.scalars(feed_statement(user_id, limit, cursor)).all()
+        if [note.id for note in expected] != [note.id for note in actual]:
+            return [f'user {user_id}, page {number}: expected ids {[note.id for note in expected][:5]}..., '
+                    f'got {[note.id for note in actual][:5]}...']
+        if len(expected) < limit:
+            break
+        cursor = (expected[-1].created_at, expected[-1].id)
+    return []
+
+
+def check(users: int, pages: int, limit: int, seed: int = 0) -> bool:
+    tables = {}
+    for shard in shards.read_engines:
+        with shard.connect() as connection:
+            for kind, count in table_differences(connection).items():
+                tables[kind] = tables.get(kind, 0) + count
+    for kind, count in tables.items():
+        print(f'{kind} feed rows: {count}')
+
+    with read_engine.connect() as connection:
+        user_ids = connection.scalars(select(User.id)).all()
+
+    sample = random.Random(seed).sample(user_ids, min(users, len(user_ids)))
+    differences = []
+    # Each shard's feed holds the pages of its own notes
+    for read_session in shards.read_sessions:
+        with read_session() as session:
+            differences += [difference for user_id in sample
+                            for difference in page_differences(session, user_id, pages, limit)]
+    for difference in differences[:20]:
+        print(difference)
+    print(f'{len(sample)} users x up to {pages} pages compared, {len(differences)} differences')
+
+    return not any(tables.values()) and not differences
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Rebuild or check the materialized home feed')
+    parser.add_argument('command', choices=['rebuild', 'check'])
+    parser.add_argument('--users', type=int, default=20, help='Users whose pages are compared (default: 20)')
+    parser.add_argument('--pages', type=int, default=3, help='Pages compared per user (default: 3)')
+    parser.add_argument('--limit', type=int, default=50, help='Page size (default: 50)')
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        count = 0
+        for shard in shards.engines:
+            with shard.begin() as connection:
+                rebuild_feed(connection)
+                count += connection.execute(text('SELECT count(*) FROM feed')).scalar()
+        print(f'feed rebuilt: {count} entries')
+        return
+
+    ok = check(args.users, args.pages, args.limit)
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+from typing import Callable, Dict, Hashable, Set, Tuple
+
+from flask import Flask, current_app, g, render_template
+from flask_login import current_user
+from markupsafe import Markup
+
+from models import Note
+
+NOTE_CARD_TEMPLATE = 'partials/note_card.html'
+NOTE_ROW_TEMPLATE = 'partials/note_row.html'
+
+
+class FragmentCache:
+    """
+    LRU of rendered HTML fragments bounded by total size.
+
+    Every entry belongs to a note so that all renderings of a note can be
+    dropped together when it is deleted.
+
+    Args:
+        max_bytes: Approximate memory cap for the cached markup
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._keys_by_note: Dict[int, Set[Hashable]] = {}
+        self._lock = Lock()
+
+    def get_or_render(self, note_id: int, key: Hashable, render: Callable[[], str]) -> Markup:
+        full_key = (note_id, key)
+        with self._lock:
+            fragment = self._entries.get(full_key)
+            if fragment is not None:
+                self._entries.move_to_end(full_key)
+                return fragment
+
+        fragment = Markup(render())
+        with self._lock:
+            if full_key not in self._entries and len(fragment) <= self.max_bytes:
+                self._entries[full_key] = fragment
+                self._keys_by_note.setdefault(note_id, set()).add(full_key)
+                self.size += len(fragment)
+                self._evict()
+        return fragment
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes:
+            (note_id, key), fragment = self._entries.popitem(last=False)
+            self._forget(note_id, (note_id, key), fragment)
+
+    def _forget(self, note_id: int, full_key: Tuple, fragment: str) -> None:
+        self.size -= len(fragment)
+        keys = self._keys_by_note.get(note_id)
+        if keys is not None:
+            keys.discard(full_key)
+            if not keys:
+                del self._keys_by_note[note_id]
+
+    def invalidate_note(self, note_id: int) -> None:
+        with self._lock:
+            for full_key in list(self._keys_by_note.get(note_id, ())):
+                self._forget(note_id, full_key, self._entries.pop(full_key))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_note.clear()
+            self.size = 0
+
+
+fragment_cache = FragmentCache(int(os.environ.get('FRAGMENT_CACHE_BYTES', 8 * 1024 * 1024)))
+
+_template_versions: Dict[str, str] = {}
+
+
+def template_version(name: str) -> str:
+    """
+    Hash of a template's source, so a deploy that edits it misses the old entries.
+    """
+    if name not in _template_versions:
+        source = current_app.jinja_env.loader.get_source(current_app.jinja_env, name)[0]
+        _template_versions[name] = sha1(source.encode()).hexdigest()[:12]
+    return _template_versions[name]
+
+
+def note_revision(note: Note) -> Tuple:
+    """
+    Identifies the row behind a note id and every column the templates show:
+    ids of deleted notes are reused, and a deletion or update made by another
+    process does not reach this process's cache.
+    """
+    content = sha1(f'{note.title}\0{note.text}'.encode()).hexdigest()[:12]
+    return note.user_id, note.created_at, bool(note.private), content
+
+
+def render_note_card(note: Note) -> Markup:
+    """
+    Note card for home.html. The markup only depends on the note's
+    revision, the viewer's theme and delete permission and on the author's
+    email and avatar.
+    """
+    can_delete = note.user_id == current_user.id or current_user.is_admin
+    key = (template_version(NOTE_CARD_TEMPLATE), note_revision(note), g.preferences['mode'], can_delete,
+           note.user.email, note.user.profile_image_etag)
+
+    return fragment_cache.get_or_render(
+        note.id, key, lambda: render_template(NOTE_CARD_TEMPLATE, note=note, can_delete=can_delete))
+
+
+def render_note_row(note: Note) -> Markup:
+    """
+    Table row for personal_notes.html.
+    """
+    key = (template_version(NOTE_ROW_TEMPLATE), note_revision(note), g.preferences['mode'])
+
+    return fragment_cache.get_or_render(note.id, key, lambda: render_template(NOTE_ROW_TEMPLATE, note=note))
+
+
+def init_fragment_cache(app: Flask) -> None:
+    app.jinja_env.globals.update(render_note_card=render_note_card, render_note_row=render_note_row)
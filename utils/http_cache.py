@@ -0,0 +1,97 @@
+"""
+Conditional GET for pages and JSON built from notes.
+
+The ETag is derived before the view runs, from counters the database bumps
+on every change to the data (data_versions) plus everything else the
+response depends on: viewer, theme, URL and the deployed templates. A
+matching If-None-Match is answered with 304 without fetching notes or
+rendering.
+"""
+import os
+from functools import wraps
+from hashlib import sha1
+from typing import Callable, Dict, Optional
+
+from flask import Response, current_app, g, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import text
+
+from models import ReadSession, shards
+
+VERSIONS_SQL = text('SELECT name, version FROM data_versions')
+
+_build_version: Optional[str] = None
+
+
+def read_versions() -> Dict[str, int]:
+    with ReadSession() as db_session:
+        versions = dict(db_session.execute(VERSIONS_SQL).all())
+
+    if shards.sharded:
+        # Each shard counts changes to its own notes
+        versions['notes'] = 0
+        for read_session in shards.read_sessions:
+            with read_session() as db_session:
+                versions['notes'] += dict(db_session.execute(VERSIONS_SQL).all()).get('notes', 0)
+    return versions
+
+
+def build_version() -> str:
+    """
+    Hash of the app's templates and asset manifest, so a deploy changes every ETag.
+    """
+    global _build_version  # pylint: disable=global-statement
+    if _build_version is None:
+        digest = sha1()
+        loader = current_app.jinja_loader
+        for name in sorted(loader.list_templates()):
+            digest.update(name.encode())
+            digest.update(loader.get_source(current_app.jinja_env, name)[0].encode())
+
+        manifest = os.path.join(current_app.static_folder, 'dist', 'manifest.json')
+        if os.path.exists(manifest):
+            with open(manifest, 'rb') as source:
+                digest.update(source.read())
+        _build_version = digest.hexdigest()[:12]
+    return _build_version
+
+
+def conditional(*tables: str) -> Callable:
+    """
+    Answer GETs of the decorated view with a weak ETag and 304s.
+
+    Args:
+        tables: data_versions entries the response is built from
+    """
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages are rendered once, never answer them with a 304
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            versions = read_versions()
+            etag = sha1(repr((
+                build_version(),
+                [versions.get(table) for table in tables],
+                current_user.get_id(),
+                getattr(current_user, 'is_admin', False),
+                g.preferences['mode'],
+                request.full_path,
+            )).encode()).hexdigest()[:20]
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapper
+
+    return decorator
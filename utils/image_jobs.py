@@ -0,0 +1,259 @@
+"""
+SQLite-backed queue of profile image downloads.
+
+Every serving process starts an in-process pool (IMAGE_WORKERS threads,
+0 disables it) on its first request, so jobs queued before a restart are
+picked up without waiting for a new one, and jobs a dead worker left
+running are requeued. A dedicated runner can process the same queue
+instead:
+
+Usage: python -m utils.image_jobs
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+from typing import List, Optional
+
+from flask import Flask
+from sqlalchemy import select, update
+
+from models import ImageJob, ReadSession, Session, User
+from utils.profile_image import AVATAR_CONTENT_TYPE, fetcher, image_etag, make_avatar_variants
+from utils.user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+WORKER_COUNT = int(os.environ.get('IMAGE_WORKERS', 2))
+POLL_INTERVAL = float(os.environ.get('IMAGE_WORKER_POLL_INTERVAL', 2))
+# Running jobs not updated for this long belong to a worker that died
+STALE_AFTER = timedelta(seconds=int(os.environ.get('IMAGE_JOB_STALE_AFTER', 300)))
+MAX_ATTEMPTS = 3
+REQUEUE_INTERVAL = 60
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def enqueue(user_id: int, url: str) -> int:
+    """
+    Queue a profile image download for a user.
+
+    Args:
+        user_id: User whose image is replaced
+        url: Image URL
+
+    Returns:
+        Job id, to poll with get_job
+    """
+    with Session() as session:
+        job = ImageJob(user_id, url)
+        session.add(job)
+        session.commit()
+        job_id = job.id
+
+    workers.notify()
+    return job_id
+
+
+def get_job(job_id: int, user_id: int) -> Optional[ImageJob]:
+    """
+    A job, if it belongs to the user.
+    """
+    with ReadSession() as session:
+        return session.query(ImageJob).filter(ImageJob.id == job_id,
+                                              ImageJob.user_id == user_id).first()
+
+
+def has_queued() -> bool:
+    """
+    Whether a job is waiting, read without taking the write lock.
+    """
+    with ReadSession() as session:
+        return session.execute(select(select(ImageJob.id).where(
+            ImageJob.status == ImageJob.QUEUED).exists())).scalar()
+
+
+def claim_next() -> Optional[int]:
+    """
+    Atomically mark the oldest queued job as running.
+
+    Returns:
+        The claimed job id, None if the queue is empty
+    """
+    oldest = select(ImageJob.id).where(ImageJob.status == ImageJob.QUEUED).order_by(
+        ImageJob.id).limit(1).scalar_subquery()
+
+    with Session() as session:
+        job_id = session.execute(
+            update(ImageJob).where(ImageJob.id == oldest, ImageJob.status == ImageJob.QUEUED).values(
+                status=ImageJob.RUNNING, attempts=ImageJob.attempts + 1,
+                updated_at=_now()).returning(ImageJob.id)).scalar()
+        session.commit()
+        return job_id
+
+
+def requeue_stale() -> None:
+    """
+    Give jobs abandoned by a dead worker another try, or fail them.
+    """
+    stale = (ImageJob.status == ImageJob.RUNNING) & (ImageJob.updated_at < _now() - STALE_AFTER)
+
+    with Session() as session:
+        session.execute(update(ImageJob).where(stale, ImageJob.attempts < MAX_ATTEMPTS).values(
+            status=ImageJob.QUEUED, updated_at=_now()))
+        session.execute(update(ImageJob).where(stale).values(
+            status=ImageJob.FAILED, error='Worker stopped', updated_at=_now()))
+        session.commit()
+
+
+def process(job_id: int) -> None:
+    """
+    Download the image of a claimed job and store it on the user.
+
+    Re-fetching the URL of the current image is conditional on the ETag and
+    Last-Modified the host returned last time; a 304 keeps the stored image.
+    """
+    with Session() as session:
+        job = session.get(ImageJob, job_id)
+        user = session.get(User, job.user_id)
+        previous = session.query(ImageJob).filter(
+            ImageJob.user_id == job.user_id, ImageJob.status == ImageJob.DONE).order_by(
+                ImageJob.id.desc()).first()
+        is_refresh = (previous is not None and previous.url == job.url
+                      and user.profile_image_etag is not None
+                      and previous.image_etag == user.profile_image_etag)
+
+        try:
+            if is_refresh:
+                result = fetcher.fetch(job.url, previous.etag, previous.last_modified)
+            else:
+                result = fetcher.fetch(job.url)
+
+            if result.status == 304 and not is_refresh:
+                # Nothing was asked to be revalidated, there is no image to keep
+                raise ValueError('Unexpected 304 Not Modified')
+            if result.status == 304:
+                job.image_etag = previous.image_etag
+                job.etag = result.etag or previous.etag
+                job.last_modified = result.last_modified or previous.last_modified
+            else:
+                variants = make_avatar_variants(result.data)
+                user.profile_image = variants[128]
+                user.profile_image_thumb = variants[40]
+                user.profile_image_type = AVATAR_CONTENT_TYPE
+                user.profile_image_etag = image_etag(result.data)
+                job.image_etag = user.profile_image_etag
+                job.etag = result.etag
+                job.last_modified = result.last_modified
+
+            job.status = ImageJob.DONE
+            job.error = None
+        except ValueError as e:
+            job.status = ImageJob.FAILED
+            job.error = str(e)
+
+        job.updated_at = _now()
+        session.commit()
+        user_id = job.user_id
+
+    user_cache.invalidate(user_id)
+
+
+class ImageWorkerPool:
+    """
+    Threads draining the image job queue.
+
+    Args:
+        size: Number of worker threads
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._last_requeue = float('-inf')
+
+    def start(self) -> None:
+        """
+        Start the threads in this process; after a fork they are started again.
+        """
+        # Runs before every request: the common case stays lock-free
+        if self._pid == os.getpid() or self.size <= 0:
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'image-worker-{number}', daemon=True)
+                for number in range(self.size)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def notify(self) -> None:
+        self.start()
+        self._wakeup.set()
+
+    def join(self) -> None:
+        for thread in self._threads:
+            thread.join()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                # Also runs as soon as the pool starts, after a restart
+                if monotonic() - self._last_requeue > REQUEUE_INTERVAL:
+                    self._last_requeue = monotonic()
+                    requeue_stale()
+                # An UPDATE takes the write lock, only claim when a job is waiting
+                job_id = claim_next() if has_queued() else None
+                if job_id is not None:
+                    process(job_id)
+                    continue
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Image job worker failed')
+
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+
+workers = ImageWorkerPool(WORKER_COUNT)
+
+
+def init_image_workers(app: Flask) -> None:
+    """
+    Start the pool in each serving process when it handles its first request.
+    """
+    app.before_request(workers.start)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    pool = ImageWorkerPool(max(WORKER_COUNT, 1))
+    pool.start()
+    logger.info('Processing image jobs with %d workers', pool.size)
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Worker startup report: import time per module and the time create_app() takes.
+
+Runs a fresh interpreter with -X importtime, which is what a respawned
+uWSGI worker (lazy-apps) or a reload pays.
+
+Usage: python -m utils.importtime [--top 25] [--entry wsgi]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List
+
+# import time:      self [us] |    cumulative | imported package
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+TIMER = 'startup seconds: '
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse(output: str) -> List[ImportTiming]:
+    """
+    Parse the stderr of `python -X importtime`.
+    """
+    timings = []
+    for line in output.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            timings.append(ImportTiming(module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return timings
+
+
+def by_package(timings: List[ImportTiming]) -> Dict[str, int]:
+    """
+    Self time summed per top-level package, in microseconds.
+    """
+    totals: Dict[str, int] = defaultdict(int)
+    for timing in timings:
+        totals[timing.module.split('.')[0]] += timing.self_us
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def measure(entry: str) -> str:
+    code = (f'import time; start = time.perf_counter(); import {entry}; '
+            f'print("{TIMER}%f" % (time.perf_counter() - start))')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            check=True, capture_output=True, text=True, cwd=os.getcwd())
+    return result.stdout + result.stderr
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Report import time by module for a worker start')
+    parser.add_argument('--entry', default='wsgi', help='Module a worker imports (default: wsgi)')
+    parser.add_argument('--top', type=int, default=25, help='Modules to list (default: 25)')
+    args = parser.parse_args()
+
+    output = measure(args.entry)
+    timings = parse(output)
+    startup = next(float(line[len(TIMER):]) for line in output.splitlines() if line.startswith(TIMER))
+
+    print(f'import {args.entry}: {startup * 1000:.1f} ms, {len(timings)} modules imported\n')
+
+    print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+    for timing in sorted(timings, key=lambda item: -item.cumulative_us)[:args.top]:
+        print(f'{timing.cumulative_us / 1000:13.1f} {timing.self_us / 1000:8.1f}  {"  " * timing.depth}{timing.module}')
+
+    print(f"\n{'self ms':>13}  package")
+    for package, self_us in list(by_package(timings).items())[:args.top]:
+        print(f'{self_us / 1000:13.1f}  {package}')
+
+
+if __name__ == '__main__':
+    main()
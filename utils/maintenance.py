@@ -0,0 +1,357 @@
+"""
+Background maintenance of the SQLite files: the main database and, when
+notes are sharded, every shard.
+
+Every MAINTENANCE_INTERVAL_S seconds, for each file:
+- ANALYZE, every MAINTENANCE_ANALYZE_INTERVAL_S, sampled through
+  analysis_limit so it takes milliseconds whatever the table sizes, and
+  interrupted if it still runs past the budget.
+- incremental_vacuum, once the free pages left by deleted notes, redeemed
+  registration codes and replaced images reach MAINTENANCE_VACUUM_FREE_RATIO
+  of the file or MAINTENANCE_VACUUM_FREE_MB. Pages are freed in write
+  transactions of at most MAINTENANCE_VACUUM_STEP_MS with an equal pause in
+  between, so a request waits for one short step at most.
+- a PASSIVE WAL checkpoint. It never blocks readers or writers, so it
+  copies the whole WAL whatever the budget. Once the WAL has grown past
+  MAINTENANCE_WAL_TRUNCATE_MB and that copy caught up, a TRUNCATE
+  checkpoint resets the file; with nothing left to copy it only waits for
+  readers, and no longer than the lock timeout.
+
+Each task stops after MAINTENANCE_BUDGET_MS and waits at most
+MAINTENANCE_LOCK_TIMEOUT_MS for a lock, skipping the round when the
+database is busy. Results (durations, bytes reclaimed) are logged as JSON
+on the 'maintenance' logger and exported as Prometheus metrics.
+
+Runs in a uWSGI mule (maintenance_mule.py) or standalone; a lock file
+keeps two runners from working at the same time.
+
+Usage: python -m utils.maintenance status | run [--once] [--force] | enable-incremental-vacuum
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+from models import DATABASE_URL, shards
+from models.engine import create_db_engine
+from models.shards import shard_url
+from utils.metrics import DB_MAINTENANCE_DURATION, DB_MAINTENANCE_RECLAIMED
+
+INTERVAL = float(os.environ.get('MAINTENANCE_INTERVAL_S', 60))
+BUDGET = float(os.environ.get('MAINTENANCE_BUDGET_MS', 250)) / 1000
+LOCK_TIMEOUT_MS = int(os.environ.get('MAINTENANCE_LOCK_TIMEOUT_MS', 50))
+ANALYZE_INTERVAL = float(os.environ.get('MAINTENANCE_ANALYZE_INTERVAL_S', 3600))
+# Rows sampled per index by ANALYZE
+ANALYSIS_LIMIT = int(os.environ.get('MAINTENANCE_ANALYSIS_LIMIT', 1000))
+VACUUM_FREE_RATIO = float(os.environ.get('MAINTENANCE_VACUUM_FREE_RATIO', 0.1))
+VACUUM_FREE_BYTES = int(os.environ.get('MAINTENANCE_VACUUM_FREE_MB', 64)) * 1024 * 1024
+VACUUM_STEP = float(os.environ.get('MAINTENANCE_VACUUM_STEP_MS', 5)) / 1000
+# Pages freed between two clock checks within a step
+VACUUM_BATCH_PAGES = 8
+# Virtual machine instructions between two clock checks of a bounded statement
+PROGRESS_OPCODES = 1000
+WAL_TRUNCATE_BYTES = int(os.environ.get('MAINTENANCE_WAL_TRUNCATE_MB', 64)) * 1024 * 1024
+LOCK_FILE = os.environ.get('MAINTENANCE_LOCK_FILE', '/tmp/db_maintenance.lock')
+INCREMENTAL = 2
+
+logger = logging.getLogger('maintenance')
+
+
+@dataclass
+class FileStats:
+    path: str
+    page_size: int
+    page_count: int
+    freelist_count: int
+    auto_vacuum: int
+    wal_bytes: int
+
+    @property
+    def free_bytes(self) -> int:
+        return self.freelist_count * self.page_size
+
+    @property
+    def free_ratio(self) -> float:
+        return self.freelist_count / self.page_count if self.page_count else 0.0
+
+
+@dataclass
+class TaskResult:
+    task: str
+    database: str
+    duration_ms: float
+    bytes_reclaimed: int = 0
+    details: Dict = field(default_factory=dict)
+
+
+def _wal_bytes(path: str) -> int:
+    try:
+        return os.path.getsize(path + '-wal')
+    except FileNotFoundError:
+        return 0
+
+
+def file_stats(connection: Connection) -> FileStats:
+    path = connection.engine.url.database
+
+    def pragma(name: str) -> int:
+        return connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+
+    return FileStats(path, pragma('page_size'), pragma('page_count'), pragma('freelist_count'),
+                     pragma('auto_vacuum'), _wal_bytes(path))
+
+
+@contextmanager
+def _deadline(connection: Connection, budget: float) -> Iterator[None]:
+    """
+    Interrupt the statements run inside once budget seconds have passed.
+    """
+    deadline = perf_counter() + budget
+    driver_connection = connection.connection.driver_connection
+    driver_connection.set_progress_handler(lambda: perf_counter() > deadline, PROGRESS_OPCODES)
+    try:
+        yield
+    finally:
+        driver_connection.set_progress_handler(None, 0)
+
+
+def analyze(connection: Connection, budget: float = BUDGET) -> TaskResult:
+    """
+    Refresh the planner statistics from a bounded sample of every index.
+    """
+    start = perf_counter()
+    interrupted = False
+    connection.exec_driver_sql(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT:d}')
+    try:
+        with _deadline(connection, budget):
+            if sqlite3.sqlite_version_info >= (3, 46):
+                # Analyzes only the tables whose statistics are missing or stale
+                connection.exec_driver_sql('PRAGMA optimize = 0x10002')
+            else:
+                connection.exec_driver_sql('ANALYZE')
+    except OperationalError as e:
+        if 'interrupted' not in str(e.orig):
+            raise
+        # Rolled back, the previous statistics stay until the next analysis
+        interrupted = True
+    return TaskResult('analyze', connection.engine.url.database, (perf_counter() - start) * 1000,
+                      details={'interrupted': interrupted})
+
+
+def needs_vacuum(stats: FileStats) -> bool:
+    return stats.auto_vacuum == INCREMENTAL and stats.freelist_count > 0 and (
+        stats.free_ratio >= VACUUM_FREE_RATIO or stats.free_bytes >= VACUUM_FREE_BYTES)
+
+
+def incremental_vacuum(connection: Connection, stats: FileStats, budget: float = BUDGET) -> TaskResult:
+    """
+    Move free pages to the end of the file and truncate them, a step at a
+    time until none are left or the budget is spent.
+    """
+    start = perf_counter()
+    steps = 0
+    longest = 0.0
+    freelist_count = stats.freelist_count
+    while freelist_count and perf_counter() - start < budget:
+        step_start = perf_counter()
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+        try:
+            while freelist_count and perf_counter() - step_start < VACUUM_STEP:
+                # Each execution frees one page: the pragma's result rows have
+                # no columns, so the driver stops after the first
+                for _ in range(min(VACUUM_BATCH_PAGES, freelist_count)):
+                    connection.exec_driver_sql('PRAGMA incremental_vacuum(1)')
+                freelist_count = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+            connection.exec_driver_sql('COMMIT')
+        except OperationalError:
+            connection.exec_driver_sql('ROLLBACK')
+            raise
+        step = perf_counter() - step_start
+        steps += 1
+        longest = max(longest, step)
+        # Let queued writers in before taking the lock again
+        time.sleep(step)
+
+    return TaskResult('incremental_vacuum', stats.path, (perf_counter() - start) * 1000,
+                      (stats.freelist_count - freelist_count) * stats.page_size,
+                      {'steps': steps, 'longest_step_ms': round(longest * 1000, 2),
+                       'free_bytes_left': freelist_count * stats.page_size})
+
+
+def checkpoint(connection: Connection, stats: FileStats, budget: float = BUDGET) -> TaskResult:
+    """
+    Copy the WAL into the database; truncate the WAL file once it is large
+    and fully copied.
+    """
+    start = perf_counter()
+    mode = 'PASSIVE'
+    busy, wal_pages, checkpointed = connection.exec_driver_sql('PRAGMA wal_checkpoint(PASSIVE)').one()
+    if (stats.wal_bytes >= WAL_TRUNCATE_BYTES and not busy and checkpointed == wal_pages
+            and perf_counter() - start < budget):
+        # Only frames appended since are left to copy before the reset
+        mode = 'TRUNCATE'
+        busy, wal_pages, checkpointed = connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)').one()
+    wal_bytes = _wal_bytes(stats.path)
+    return TaskResult('checkpoint', stats.path, (perf_counter() - start) * 1000,
+                      max(stats.wal_bytes - wal_bytes, 0),
+                      {'mode': mode, 'busy': bool(busy), 'wal_pages': wal_pages,
+                       'checkpointed_pages': checkpointed, 'wal_bytes': wal_bytes})
+
+
+def database_urls() -> List[str]:
+    if not shards.sharded:
+        return [DATABASE_URL]
+    return [DATABASE_URL] + [shard_url(DATABASE_URL, index) for index in range(shards.count)]
+
+
+class Scheduler:
+    """
+    Runs the tasks above on every database file when they are due.
+    """
+
+    def __init__(self, urls: Optional[List[str]] = None):
+        self.engines: List[Engine] = [create_db_engine(url) for url in urls or database_urls()]
+        self._analyzed_at: Dict[str, float] = {}
+
+    def _connect(self, engine: Engine) -> Connection:
+        connection = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        # Give up quickly on a busy database rather than queue ahead of requests
+        connection.exec_driver_sql(f'PRAGMA busy_timeout = {LOCK_TIMEOUT_MS:d}')
+        return connection
+
+    def run_once(self, force: bool = False) -> List[TaskResult]:
+        """
+        One round over every database.
+
+        Args:
+            force: Run every task now, whatever its schedule or threshold
+        """
+        results = []
+        for engine in self.engines:
+            path = engine.url.database
+            try:
+                with self._connect(engine) as connection:
+                    if force or time.monotonic() - self._analyzed_at.get(path, float('-inf')) >= ANALYZE_INTERVAL:
+                        results.append(analyze(connection))
+                        self._analyzed_at[path] = time.monotonic()
+
+                    stats = file_stats(connection)
+                    if needs_vacuum(stats) or (force and stats.auto_vacuum == INCREMENTAL and stats.freelist_count):
+                        results.append(incremental_vacuum(connection, stats))
+                        # Checkpoint the vacuumed pages so the file shrinks now
+                        stats = file_stats(connection)
+
+                    results.append(checkpoint(connection, stats))
+            except OperationalError as e:
+                # Locked or busy past the timeout, try again next round
+                logger.warning(json.dumps({'event': 'skipped', 'database': path, 'error': str(e.orig)}))
+
+        for result in results:
+            report(result)
+        return results
+
+    def run_forever(self) -> None:
+        while True:
+            started = time.monotonic()
+            with open(LOCK_FILE, 'a', encoding='utf-8') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logger.info(json.dumps({'event': 'skipped', 'reason': 'another runner holds ' + LOCK_FILE}))
+                else:
+                    try:
+                        self.run_once()
+                    except Exception:  # pylint: disable=broad-except
+                        # Keep the runner alive, the next round starts from fresh connections
+                        logger.exception('maintenance round failed')
+            time.sleep(max(INTERVAL - (time.monotonic() - started), 0))
+
+
+def report(result: TaskResult) -> None:
+    DB_MAINTENANCE_DURATION.labels(result.task).observe(result.duration_ms / 1000)
+    if result.bytes_reclaimed:
+        DB_MAINTENANCE_RECLAIMED.labels(result.task).inc(result.bytes_reclaimed)
+    logger.info(json.dumps({'event': result.task, 'database': result.database,
+                            'duration_ms': round(result.duration_ms, 2),
+                            'bytes_reclaimed': result.bytes_reclaimed, **result.details}))
+
+
+def run() -> None:
+    """
+    Maintain the databases until the process is stopped, logging to stderr.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    Scheduler().run_forever()
+
+
+def enable_incremental_vacuum(engine: Engine) -> Optional[TaskResult]:
+    """
+    Switch an existing database to auto_vacuum = INCREMENTAL. Rewrites the
+    whole file under an exclusive lock: stop the app first.
+    """
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if connection.exec_driver_sql('PRAGMA auto_vacuum').scalar() == INCREMENTAL:
+            return None
+        path = engine.url.database
+        size = os.path.getsize(path)
+        start = perf_counter()
+        connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.exec_driver_sql('VACUUM')
+        connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        return TaskResult('vacuum', path, (perf_counter() - start) * 1000, max(size - os.path.getsize(path), 0))
+
+
+def _print(result: TaskResult) -> None:
+    details = ', '.join(f'{key}={value}' for key, value in result.details.items())
+    print(f'{result.task:20} {os.path.basename(result.database):24} {result.duration_ms:9.1f} ms '
+          f'{result.bytes_reclaimed / 1024:10.1f} KiB reclaimed  {details}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Maintain the SQLite databases')
+    parser.add_argument('command', choices=['status', 'run', 'enable-incremental-vacuum'])
+    parser.add_argument('--once', action='store_true', help='One round, then exit (run)')
+    parser.add_argument('--force', action='store_true', help='Ignore schedules and thresholds (run --once)')
+    args = parser.parse_args()
+
+    if args.command == 'run' and not args.once:
+        run()
+        return
+
+    scheduler = Scheduler()
+    if args.command == 'status':
+        for engine in scheduler.engines:
+            with engine.connect() as connection:
+                stats = file_stats(connection)
+            print(f'{stats.path}: {stats.page_count * stats.page_size / 1024 / 1024:.1f} MiB, '
+                  f'{stats.free_bytes / 1024 / 1024:.1f} MiB free ({stats.free_ratio:.1%}), '
+                  f'WAL {stats.wal_bytes / 1024 / 1024:.1f} MiB, '
+                  f"auto_vacuum {'incremental' if stats.auto_vacuum == INCREMENTAL else 'off'}, "
+                  f"vacuum {'due' if needs_vacuum(stats) else 'not due'}")
+        return
+
+    if args.command == 'enable-incremental-vacuum':
+        for engine in scheduler.engines:
+            result = enable_incremental_vacuum(engine)
+            if result is None:
+                print(f'{engine.url.database}: already incremental')
+            else:
+                _print(result)
+        return
+
+    for result in scheduler.run_once(args.force):
+        _print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import atexit
+import os
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Iterator, List
+
+from flask import Flask, Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# uWSGI workers share metrics through the file-backed registry in this directory
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_COUNT = Counter(
+    'http_requests_total',
+    'Total HTTP requests',
+    ['method', 'endpoint', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency in seconds',
+    ['method', 'endpoint'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress',
+    'HTTP requests currently being processed',
+    ['method', 'endpoint'],
+    multiprocess_mode='livesum',
+)
+DB_QUERY_COUNT = Counter(
+    'db_queries_total',
+    'Total SQL statements executed',
+    ['operation'],
+)
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds',
+    'SQL statement execution time in seconds',
+    ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+DB_MAINTENANCE_DURATION = Histogram(
+    'db_maintenance_duration_seconds',
+    'Database maintenance task time in seconds (utils/maintenance.py)',
+    ['task'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+DB_MAINTENANCE_RECLAIMED = Counter(
+    'db_maintenance_reclaimed_bytes_total',
+    'Bytes returned to the filesystem by database maintenance',
+    ['task'],
+)
+BCRYPT_LATENCY = Histogram(
+    'bcrypt_duration_seconds',
+    'bcrypt hash/check time in seconds',
+    ['operation'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+@contextmanager
+def track_bcrypt(operation: str) -> Iterator[None]:
+    """
+    Time a bcrypt call.
+
+    Args:
+        operation: Either 'hash' or 'check'
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        BCRYPT_LATENCY.labels(operation).observe(perf_counter() - start)
+
+
+def _endpoint_label() -> str:
+    # Unmatched URLs share one label to keep the series count bounded
+    return request.endpoint or 'unmatched'
+
+
+def _before_request() -> None:
+    g.metrics_start = perf_counter()
+    g.metrics_labels = (request.method, _endpoint_label())
+    REQUESTS_IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+
+def _after_request(response: Response) -> Response:
+    g.metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(_error) -> None:
+    labels = g.pop('metrics_labels', None)
+    if labels is None:
+        return
+
+    REQUESTS_IN_PROGRESS.labels(*labels).dec()
+    REQUEST_LATENCY.labels(*labels).observe(perf_counter() - g.pop('metrics_start'))
+    REQUEST_COUNT.labels(*labels, str(g.pop('metrics_status', 500))).inc()
+
+
+# Also given every statement and its duration in seconds, see add_query_listener
+_query_listeners: List[Callable[[str, float], None]] = []
+
+
+def add_query_listener(listener: Callable[[str, float], None]) -> None:
+    """
+    Pass every statement timed on an instrumented engine to listener as well,
+    so other per-statement reporting reuses this timing.
+
+    Args:
+        listener: Called with the statement and its duration in seconds
+    """
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+
+
+def _statement_operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+
+
+def _before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany) -> None:
+    conn.info.setdefault('metrics_query_start', []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, _cursor, statement, _parameters, _context, _executemany) -> None:
+    elapsed = perf_counter() - conn.info['metrics_query_start'].pop()
+    operation = _statement_operation(statement)
+    DB_QUERY_COUNT.labels(operation).inc()
+    DB_QUERY_LATENCY.labels(operation).observe(elapsed)
+    for listener in _query_listeners:
+        listener(statement, elapsed)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Record query counts and durations for every statement run on the engine.
+
+    Args:
+        engine: SQLAlchemy engine to instrument
+    """
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def metrics() -> Response:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _mark_process_dead() -> None:
+    # Drop this worker's live gauge files so in-flight counts stay accurate
+    multiprocess.mark_process_dead(os.getpid())
+
+
+def init_metrics(app: Flask, *engines: Engine) -> None:
+    """
+    Hook request, SQL and bcrypt metrics into the app and expose them on /metrics.
+
+    Args:
+        app: Flask application
+        engines: SQLAlchemy engines backing the app's sessions
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    for engine in engines:
+        instrument_engine(engine)
+
+    if MULTIPROC_DIR:
+        atexit.register(_mark_process_dead)
@@ -0,0 +1,189 @@
+"""
+NDJSON export and import of a user's notes.
+
+Both directions work a line at a time: the export walks a server-side
+cursor and the import reads the upload line by line, inserting every
+IMPORT_BATCH_SIZE valid records in their own transaction. Neither keeps
+more than one batch in memory, whatever the number of notes.
+
+One record per line:
+{"title": "...", "text": "...", "private": false, "created_at": "2024-01-01T00:00:00+00:00"}
+private and created_at are optional on import; created_at is converted to UTC
+and dates in the future are replaced by the time of the import.
+
+Notes are stored HTML-escaped by sanitize_text_field; the export unescapes
+them so that importing an export recreates the same notes.
+"""
+import html
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import IO, Dict, Iterator, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session as OrmSession
+
+from models import Note, shards
+from utils.fragment_cache import fragment_cache
+from utils.input_sanitizer import sanitize_many
+from utils.notes import personal_notes_statement
+
+IMPORT_BATCH_SIZE = int(os.environ.get('NOTES_IMPORT_BATCH_SIZE', 500))
+# Longer lines are rejected without being read into memory in full
+MAX_LINE_BYTES = int(os.environ.get('NOTES_IMPORT_MAX_LINE_BYTES', 64 * 1024))
+# Only the first errors are reported, the rest are counted
+MAX_REPORTED_ERRORS = 100
+TITLE_MAX_LENGTH = 200
+TEXT_MAX_LENGTH = 5000
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    failed: int = 0
+    errors: List[Dict] = field(default_factory=list)
+
+    def error(self, line: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+
+def iter_notes_ndjson(user_id: int) -> Iterator[str]:
+    """
+    Every note of a user as NDJSON, newest first.
+    """
+    with shards.read_session_for_user(user_id) as session:
+        notes = session.scalars(personal_notes_statement(user_id).execution_options(yield_per=500))
+        for note in notes:
+            yield json.dumps({
+                'title': html.unescape(note.title),
+                'text': html.unescape(note.text),
+                'private': note.private,
+                'created_at': note.created_at.isoformat() if note.created_at else None,
+            }) + '\n'
+
+
+def _read_lines(stream: IO[bytes]) -> Iterator[Optional[bytes]]:
+    """
+    Lines of the stream, None for a line longer than MAX_LINE_BYTES.
+    """
+    while True:
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        if len(line) > MAX_LINE_BYTES:
+            # Drop the rest of the oversized line
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(MAX_LINE_BYTES)
+            yield None
+            continue
+        yield line
+
+
+def parse_record(line: bytes, user_id: int) -> Dict:
+    """
+    Validate one NDJSON record into a notes row, sanitized later by batch.
+
+    Raises:
+        ValueError: If the record is not a valid note
+    """
+    try:
+        record = json.loads(line)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f'Invalid JSON: {e}') from e
+    if not isinstance(record, dict):
+        raise ValueError('Expected a JSON object')
+
+    title, text, private = record.get('title'), record.get('text'), record.get('private', False)
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError('title must be a non-empty string')
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError('text must be a non-empty string')
+    if not isinstance(private, bool):
+        raise ValueError('private must be a boolean')
+
+    now = datetime.now(timezone.utc)
+    created_at = now
+    if record.get('created_at') is not None:
+        try:
+            created_at = datetime.fromisoformat(record['created_at'])
+        except (TypeError, ValueError) as e:
+            raise ValueError('created_at must be an ISO 8601 date') from e
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        # Stored as UTC like every other note; a future date would pin the note
+        # to the top of the feed
+        try:
+            created_at = min(created_at.astimezone(timezone.utc), now)
+        except OverflowError as e:
+            raise ValueError('created_at is out of range') from e
+
+    return {
+        'title': title,
+        'text': text,
+        'private': private,
+        'created_at': created_at,
+        'user_id': user_id,
+    }
+
+
+def _insert(session: OrmSession, rows: List[Dict], user_id: int) -> None:
+    titles = sanitize_many([row['title'] for row in rows], TITLE_MAX_LENGTH)
+    texts = sanitize_many([row['text'] for row in rows], TEXT_MAX_LENGTH)
+    note_ids = shards.allocate_note_ids(session, user_id, len(rows))
+    for row, title, text, note_id in zip(rows, titles, texts, note_ids):
+        row['title'], row['text'] = title, text
+        if note_id is not None:
+            row['id'] = note_id
+
+    note_ids = session.scalars(insert(Note).returning(Note.id), rows).all()
+    session.commit()
+    # Ids can be reused after a delete, never serve a stale card for them
+    for note_id in note_ids:
+        fragment_cache.invalidate_note(note_id)
+
+
+def import_ndjson(session: OrmSession, stream: IO[bytes], user_id: int,
+                 batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """
+    Insert the notes of an NDJSON stream for a user.
+
+    Invalid lines are reported and skipped; valid ones are committed in
+    batches of batch_size, so a failure midway keeps the earlier batches.
+
+    Args:
+        session: Write session of the user's notes shard
+        stream: Binary NDJSON stream, read a line at a time
+        user_id: Owner of the imported notes
+        batch_size: Records per transaction
+
+    Returns:
+        Counts of imported and failed records and the first errors
+    """
+    report = ImportReport()
+    batch: List[Dict] = []
+    for number, line in enumerate(_read_lines(stream), start=1):
+        if line is None:
+            report.error(number, f'Line longer than {MAX_LINE_BYTES} bytes')
+            continue
+        if not line.strip():
+            continue
+
+        try:
+            batch.append(parse_record(line, user_id))
+        except ValueError as e:
+            report.error(number, str(e))
+            continue
+
+        if len(batch) >= batch_size:
+            _insert(session, batch, user_id)
+            report.imported += len(batch)
+            batch = []
+
+    if batch:
+        _insert(session, batch, user_id)
+        report.imported += len(batch)
+
+    return report
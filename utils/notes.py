@@ -1,11 +1,273 @@
-from typing import List
-from sqlalchemy import or_
-from sqlalchemy.orm import joinedload
-from models import Session, Note
+import heapq
+import html
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select, text, tuple_, union_all, DateTime, Select
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.datastructures import MultiDict
+from models import ReadSession, Note, FeedEntry, User, shards
 
+SEARCH_RESULT_LIMIT = 100
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
 
-def get_notes_for_user(user_id: int) -> List[Note]:
-    with Session(expire_on_commit=False) as session:
-        return session.query(Note).filter(
-            or_(Note.user_id == user_id,
-                Note.private == False)).options(joinedload(Note.user)).all()  # pylint: disable=singleton-comparison
+Cursor = Tuple[datetime, int]
+
+# notes_fts indexes the unescaped text (models.migrations.index_unescaped_note_text),
+# so matches are marked with control characters and swapped for <mark> after escaping
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+SEARCH_SQL = text("""
+    SELECT notes.id AS id,
+           highlight(notes_fts, 0, char(2), char(3)) AS title,
+           snippet(notes_fts, 1, char(2), char(3), '…', 24) AS text,
+           notes.created_at AS created_at
+    FROM notes_fts JOIN notes ON notes.id = notes_fts.rowid
+    WHERE notes_fts MATCH :query AND notes.user_id = :user_id
+    ORDER BY rank
+    LIMIT :limit
+""").columns(created_at=DateTime(timezone=True))
+
+
+class SearchResult(NamedTuple):
+    """
+    A search hit; title and text are HTML, escaped apart from <mark> tags.
+    """
+    id: int
+    title: str
+    text: str
+    created_at: datetime
+
+
+def encode_cursor(note: Note) -> str:
+    """
+    Opaque cursor pointing just past the given note.
+    """
+    return urlsafe_b64encode(f'{note.created_at.isoformat()}|{note.id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """
+    Parse a cursor produced by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, note_id = urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(note_id)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def get_page_args(args: MultiDict) -> Tuple[int, Optional[Cursor]]:
+    """
+    Read the limit/cursor query parameters.
+
+    Args:
+        args: Request query arguments
+
+    Returns:
+        Page size clamped to MAX_PAGE_SIZE and the decoded cursor, if any
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    limit = min(max(args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    cursor = args.get('cursor')
+
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def _page(statement: Select, columns, cursor: Optional[Cursor], limit: int) -> Select:
+    created_at, note_id = columns
+    if cursor is not None:
+        statement = statement.where(tuple_(created_at, note_id) < cursor)
+
+    return statement.order_by(created_at.desc(), note_id.desc()).limit(limit)
+
+
+def notes_for_user_statement(user_id: int,
+                             limit: int,
+                             cursor: Optional[Cursor] = None,
+                             with_user: bool = False) -> Select:
+    """
+    Newest notes a user can see: their own plus everybody's public ones.
+
+    Computed from notes; /home reads the same page from the feed table
+    (feed_statement), `python -m utils.feed check` compares the two.
+
+    The two halves are read separately so each one walks its own index
+    (ix_notes_user_id_created_at, ix_notes_public_created_at) in order and
+    stops after limit rows, instead of sorting every public note.
+    """
+    own = _page(select(Note).where(Note.user_id == user_id),
+                (Note.created_at, Note.id), cursor, limit).subquery()
+    public = _page(
+        select(Note).where(Note.private == False,  # pylint: disable=singleton-comparison
+                           Note.user_id.is_distinct_from(user_id)),
+        (Note.created_at, Note.id), cursor, limit).subquery()
+    feed = aliased(Note, union_all(select(own), select(public)).subquery())
+
+    statement = _page(select(feed), (feed.created_at, feed.id), None, limit)
+    return statement.options(joinedload(feed.user)) if with_user else statement
+
+
+def feed_statement(user_id: int,
+                   limit: int,
+                   cursor: Optional[Cursor] = None,
+                   with_user: bool = False) -> Select:
+    """
+    Same page as notes_for_user_statement, read from the feed table.
+
+    Each audience (public notes, the user's private notes) is an index-only
+    walk of ix_feed_audience_created_at that stops after limit entries, and
+    only the notes of the resulting page are fetched.
+    """
+    columns = (FeedEntry.created_at, FeedEntry.note_id)
+    halves = [
+        _page(select(FeedEntry.note_id, FeedEntry.created_at).where(FeedEntry.audience == audience),
+              columns, cursor, limit).subquery()
+        for audience in (FeedEntry.PUBLIC, user_id)
+    ]
+    entries = union_all(select(halves[0]), select(halves[1])).subquery()
+    page = _page(select(entries), (entries.c.created_at, entries.c.note_id), None, limit).subquery()
+
+    statement = select(Note).join(page, Note.id == page.c.note_id).order_by(
+        page.c.created_at.desc(), page.c.note_id.desc())
+    return statement.options(joinedload(Note.user)) if with_user else statement
+
+
+def sharded_feed(user_id: int, limit: int, cursor: Optional[Cursor] = None) -> List[Note]:
+    """
+    The feed_statement page when notes are sharded (models.shards).
+
+    Each shard serves its own page: public notes, plus the user's private
+    ones on their shard. The pages are already sorted, a k-way merge on
+    (created_at, id) keeps the newest limit notes of all of them.
+    """
+    pages = []
+    for read_session in shards.read_sessions:
+        with read_session() as session:
+            pages.append(session.scalars(feed_statement(user_id, limit, cursor)).all())
+
+    return list(islice(heapq.merge(*pages, key=lambda note: (note.created_at, note.id), reverse=True), limit))
+
+
+def attach_users(notes: Iterable[Note]) -> None:
+    """
+    Load the authors of notes read from a shard, which has no users table.
+    """
+    notes = list(notes)
+    user_ids = {note.user_id for note in notes if note.user_id is not None}
+    with ReadSession() as session:
+        users = {user.id: user for user in session.scalars(select(User).where(User.id.in_(user_ids)))}
+
+    for note in notes:
+        set_committed_value(note, 'user', users.get(note.user_id))
+
+
+def get_notes_for_user(user_id: int,
+                       limit: int = DEFAULT_PAGE_SIZE,
+                       cursor: Optional[Cursor] = None) -> Tuple[List[Note], Optional[str]]:
+    """
+    One page of the notes a user can see, newest first.
+
+    Args:
+        user_id: Viewing user
+        limit: Page size
+        cursor: Position returned by a previous page
+
+    Returns:
+        The notes and the cursor of the next page, None on the last page
+    """
+    if shards.sharded:
+        notes = sharded_feed(user_id, limit + 1, cursor)
+        attach_users(notes)
+    else:
+        with ReadSession() as session:
+            notes = session.scalars(feed_statement(user_id, limit + 1, cursor, with_user=True)).unique().all()
+
+    if len(notes) > limit:
+        return notes[:limit], encode_cursor(notes[limit - 1])
+
+    return notes, None
+
+
+def iter_notes_for_user(user_id: int,
+                        limit: int = DEFAULT_PAGE_SIZE,
+                        cursor: Optional[Cursor] = None) -> Iterator[Note]:
+    """
+    Same page as get_notes_for_user, fetched incrementally.
+
+    Yields up to limit + 1 notes; an extra note means there is a next page.
+    """
+    if shards.sharded:
+        yield from sharded_feed(user_id, limit + 1, cursor)
+        return
+
+    with ReadSession() as session:
+        yield from session.scalars(
+            feed_statement(user_id, limit + 1, cursor).execution_options(yield_per=100))
+
+
+def personal_notes_statement(user_id: int) -> Select:
+    """
+    All notes owned by a user, newest first.
+    """
+    return select(Note).where(Note.user_id == user_id).order_by(Note.created_at.desc(), Note.id.desc())
+
+
+def build_match_query(search: str) -> str:
+    """
+    Turn free text into an FTS5 query that matches every word as a prefix.
+
+    Args:
+        search: Text typed by the user
+
+    Returns:
+        FTS5 MATCH expression, empty if the text contains no words
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', search))
+
+
+def highlight_html(value: str) -> str:
+    """
+    Escape highlight() or snippet() output, then turn its markers into <mark> tags.
+    """
+    return html.escape(value).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+
+def search_notes_for_user(user_id: int, search: str, limit: int = SEARCH_RESULT_LIMIT) -> List[SearchResult]:
+    """
+    Ranked full-text search over a user's notes.
+
+    Args:
+        user_id: Owner of the notes
+        search: Text typed by the user, HTML-escaped by sanitize_text_field
+        limit: Maximum number of results
+
+    Returns:
+        Results with id, highlighted title, highlighted text snippet and created_at
+    """
+    query = build_match_query(html.unescape(search))
+
+    with shards.read_session_for_user(user_id) as session:
+        if not query:
+            # Stored notes are already escaped
+            return [SearchResult(*row) for row in session.query(
+                Note.id, Note.title, Note.text, Note.created_at).filter(
+                Note.user_id == user_id).order_by(Note.created_at.desc()).limit(limit)]
+
+        rows = session.execute(SEARCH_SQL, {
+            'query': query,
+            'user_id': user_id,
+            'limit': limit
+        })
+        return [SearchResult(row.id, highlight_html(row.title), highlight_html(row.text), row.created_at)
+                for row in rows]
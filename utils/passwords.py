@@ -0,0 +1,169 @@
+"""
+bcrypt hashing off the request thread.
+
+Hashes and checks run in a small process pool (PASSWORD_HASH_WORKERS
+processes, 0 runs them inline) so a burst of logins can neither hold the
+GIL nor run more bcrypt calls in parallel than there are processes. The
+cost comes from BCRYPT_ROUNDS; pick it for the host with:
+
+Usage: python -m utils.passwords [--target-ms 250]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from statistics import median
+from time import perf_counter
+from typing import Callable, Optional, TypeVar
+
+from bcrypt import checkpw, gensalt, hashpw
+
+from utils.metrics import track_bcrypt
+
+ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+WORKER_COUNT = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+
+T = TypeVar('T')
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return hashpw(password, gensalt(rounds))
+
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    return checkpw(password, hashed)
+
+
+def _python_executable() -> str:
+    """
+    The interpreter binary; under uWSGI sys.executable is uwsgi itself, and
+    the Python it embeds lives under sys.exec_prefix.
+    """
+    if os.path.basename(sys.executable).startswith('python'):
+        return sys.executable
+    return os.path.join(sys.exec_prefix, 'bin', f'python{sys.version_info.major}.{sys.version_info.minor}')
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """
+    Cost factor of a bcrypt hash ('$2b$12$...'), None if it is not one.
+    """
+    parts = hashed.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    """
+    bcrypt with a configurable cost, run in a bounded process pool.
+
+    Args:
+        rounds: bcrypt cost for new hashes
+        workers: Number of hashing processes, 0 hashes on the calling thread
+    """
+
+    def __init__(self, rounds: int = ROUNDS, workers: int = WORKER_COUNT):
+        if not MIN_ROUNDS <= rounds <= MAX_ROUNDS:
+            raise ValueError(f'BCRYPT_ROUNDS must be between {MIN_ROUNDS} and {MAX_ROUNDS}')
+        self.rounds = rounds
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # A pool created before uWSGI forked belongs to the master, start our own
+        with self._lock:
+            if self._pid != os.getpid():
+                # First used by a threaded worker: forking it could copy locks
+                # other threads hold (logging, connection pools) into the
+                # children. Spawned processes start from a fresh interpreter.
+                context = multiprocessing.get_context('spawn')
+                context.set_executable(_python_executable())
+                self._executor = ProcessPoolExecutor(self.workers, context)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, function: Callable[..., T], *args) -> T:
+        if self.workers <= 0:
+            return function(*args)
+
+        try:
+            return self._pool().submit(function, *args).result()
+        except BrokenProcessPool:
+            # A hashing process was killed (OOM, signal), replace the pool
+            with self._lock:
+                self._pid = None
+            return function(*args)
+
+    def hash(self, password: str) -> str:
+        with track_bcrypt('hash'):
+            return self._run(_hash, password.encode('utf-8'), self.rounds).decode()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        with track_bcrypt('check'):
+            return self._run(_check, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """
+        Whether a stored hash was made with a different cost than the configured one.
+        """
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+            self._pid = None
+
+
+hasher = PasswordHasher()
+
+
+def calibrate(target_ms: float, samples: int = 3) -> int:
+    """
+    Highest cost whose hash time on this host stays within the target.
+
+    Args:
+        target_ms: Acceptable time for one hash in milliseconds
+        samples: Hashes timed per cost, the median is used
+
+    Returns:
+        bcrypt cost, at least MIN_ROUNDS
+    """
+    best = MIN_ROUNDS
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        timings = []
+        for _ in range(samples):
+            start = perf_counter()
+            _hash(b'calibration password', rounds)
+            timings.append((perf_counter() - start) * 1000)
+
+        elapsed = median(timings)
+        print(f'cost {rounds:2d}: {elapsed:8.1f} ms')
+        if elapsed > target_ms:
+            break
+        best = rounds
+
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Pick BCRYPT_ROUNDS for this host')
+    parser.add_argument('--target-ms', type=float, default=250,
+                        help='Acceptable time for one hash (default: 250)')
+    parser.add_argument('--samples', type=int, default=3, help='Hashes timed per cost (default: 3)')
+    args = parser.parse_args()
+
+    print(f'BCRYPT_ROUNDS={calibrate(args.target_ms, args.samples)}')
+
+
+if __name__ == '__main__':
+    main()
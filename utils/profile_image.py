@@ -1,9 +1,12 @@
-from urllib.request import urlopen, Request
+from dataclasses import dataclass
+from http.client import HTTPConnection, HTTPException, HTTPResponse, HTTPSConnection
 from urllib.parse import urlparse
-from mimetypes import guess_type
-from base64 import b64encode
+from hashlib import sha256
+from io import BytesIO
+from typing import Dict, Optional, Tuple
 import re
 import ssl
+import threading
 
 # Allowed image domains (add more as needed)
 ALLOWED_DOMAINS = {
@@ -22,6 +25,30 @@ ALLOWED_CONTENT_TYPES = {
     'image/webp'
 }
 
+# Limit file size (1MB max)
+MAX_IMAGE_SIZE = 1024 * 1024
+# Limit decoded size, a small file can still expand to a huge bitmap
+MAX_IMAGE_PIXELS = 4096 * 4096
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+# Pillow decoder for each allowed content type
+IMAGE_FORMATS = {
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG',
+    'image/gif': 'GIF',
+    'image/webp': 'WEBP',
+}
+
+# Avatars are stored and served at these edge lengths only
+AVATAR_SIZES = (40, 128)
+AVATAR_FORMAT = 'WEBP'
+AVATAR_CONTENT_TYPE = 'image/webp'
+
 
 def is_safe_url(url: str) -> bool:
     """
@@ -63,58 +90,176 @@ def is_safe_url(url: str) -> bool:
         return False
 
 
-def download(url: str) -> bytes:
+@dataclass
+class FetchResult:
+    status: int
+    data: bytes
+    content_type: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class ImageFetcher:
     """
-    Secure URL download with additional validation
+    Downloads images over keep-alive connections, one per host and thread.
+
+    Args:
+        timeout: Socket timeout in seconds
     """
-    if not is_safe_url(url):
-        raise ValueError("Unsafe URL")
-    
-    # SECURITY FIX: Create secure SSL context
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = True
-    ssl_context.verify_mode = ssl.CERT_REQUIRED
-    
-    try:
-        # SECURITY FIX: Use Request with timeout and User-Agent
-        request = Request(url, headers={
+
+    def __init__(self, timeout: float = 10):
+        self.timeout = timeout
+        self._local = threading.local()
+
+        # SECURITY FIX: Create secure SSL context
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = True
+        self.ssl_context.verify_mode = ssl.CERT_REQUIRED
+
+    def _connection(self, scheme: str, host: str, port: Optional[int]) -> HTTPConnection:
+        connections = self._local.__dict__.setdefault('connections', {})
+        key = (scheme, host, port)
+        if key not in connections:
+            if scheme == 'https':
+                connections[key] = HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+            else:
+                connections[key] = HTTPConnection(host, port, timeout=self.timeout)
+        return connections[key]
+
+    def _request(self, url: str, headers: Dict[str, str]) -> Tuple[HTTPConnection, HTTPResponse]:
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        connection = self._connection(parsed.scheme, parsed.hostname, parsed.port)
+        try:
+            connection.request('GET', path, headers=headers)
+            return connection, connection.getresponse()
+        except (HTTPException, ConnectionError):
+            # The server dropped an idle keep-alive connection, retry once on a fresh one
+            connection.close()
+
+        connection.request('GET', path, headers=headers)
+        return connection, connection.getresponse()
+
+    def fetch(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchResult:
+        """
+        Secure URL download with additional validation.
+
+        Args:
+            url: Image URL
+            etag: ETag of a previous download, sent as If-None-Match
+            last_modified: Last-Modified of a previous download, sent as If-Modified-Since
+
+        Returns:
+            Response status (200, or 304 when unchanged) with body and validators
+        """
+        if not is_safe_url(url):
+            raise ValueError("Unsafe URL")
+
+        headers = {
             'User-Agent': 'Mozilla/5.0 (DevSecOps Scanner)',
             'Accept': 'image/*'
-        })
-        
-        with urlopen(request, timeout=10, context=ssl_context) as response: # nosec B310
+        }
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        try:
+            connection, response = self._request(url, headers)
+            try:
+                # Read with size limit
+                data = response.read(MAX_IMAGE_SIZE + 1)
+            except Exception:
+                connection.close()
+                raise
+            finally:
+                response.close()
+
+            if len(data) > MAX_IMAGE_SIZE or response.will_close:
+                # Unread body or server-side close: the connection can't be reused
+                connection.close()
+
+            validators = (response.getheader('ETag'), response.getheader('Last-Modified'))
+            if response.status == 304:
+                return FetchResult(304, b'', None, *validators)
+            if response.status != 200:
+                raise ValueError(f"HTTP {response.status}")
+
             # Verify content type from headers
-            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            content_type = (response.getheader('Content-Type') or '').split(';')[0].strip()
             if content_type not in ALLOWED_CONTENT_TYPES:
                 raise ValueError("Unsupported content type")
-                
-            # Limit file size (1MB max)
-            content_length = response.headers.get('Content-Length')
-            if content_length and int(content_length) > 1024 * 1024:
-                raise ValueError("File too large")
-                
-            # Read with size limit
-            data = response.read(1024 * 1024 + 1)  # Read max 1MB + 1 byte
-            if len(data) > 1024 * 1024:
+
+            if len(data) > MAX_IMAGE_SIZE:
                 raise ValueError("File too large")
-                
-            return data
-            
-    except Exception as e:
-        raise ValueError(f"Failed to download image: {str(e)}")
+
+            return FetchResult(200, data, content_type, *validators)
+
+        except Exception as e:
+            raise ValueError(f"Failed to download image: {str(e)}")
+
+
+fetcher = ImageFetcher()
 
 
-def get_base64_image_blob(url: str) -> str:
+def sniff_image_type(data: bytes) -> str:
     """
-    Get base64 encoded image blob with enhanced security
+    Content type of an image, from its magic bytes rather than its URL.
+
+    Raises:
+        ValueError: If the data is not one of ALLOWED_CONTENT_TYPES
     """
-    response = download(url)
-    mimetype = guess_type(url)[0] or 'image/png'
-    
-    # Double-check content type
-    if mimetype not in ALLOWED_CONTENT_TYPES:
-        raise ValueError("Unsupported image type")
-        
-    data = b64encode(response).decode('ascii')
+    for magic, mimetype in IMAGE_SIGNATURES:
+        if data.startswith(magic):
+            return mimetype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+
+    raise ValueError("Unsupported image type")
+
+
+def make_avatar_variants(data: bytes) -> Dict[int, bytes]:
+    """
+    Decode a downloaded image and re-encode it at every avatar size.
 
-    return f"data:{mimetype};base64,{data}"
\ No newline at end of file
+    The image is center-cropped to a square, metadata (EXIF, ICC, comments)
+    is dropped, and animations keep their first frame.
+
+    Args:
+        data: Downloaded image bytes
+
+    Returns:
+        AVATAR_FORMAT bytes keyed by edge length in pixels
+    """
+    # Only image jobs decode images, keep Pillow out of worker startup
+    from PIL import Image, ImageOps  # pylint: disable=import-outside-toplevel
+
+    expected_format = IMAGE_FORMATS[sniff_image_type(data)]
+
+    try:
+        with Image.open(BytesIO(data), formats=[expected_format]) as image:
+            if image.width * image.height > MAX_IMAGE_PIXELS:
+                raise ValueError("Image too large")
+
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+            variants = {}
+            for size in AVATAR_SIZES:
+                output = BytesIO()
+                ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS).save(
+                    output, AVATAR_FORMAT, quality=80, method=6)
+                variants[size] = output.getvalue()
+            return variants
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Invalid image: {str(e)}")
+
+
+def image_etag(data: bytes) -> str:
+    """
+    Version of a downloaded image, used in avatar ETags and URLs.
+    """
+    return sha256(data).hexdigest()[:32]
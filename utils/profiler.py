@@ -0,0 +1,268 @@
+"""
+On-demand sampling profiler for live requests.
+
+A profiled request registers its thread with a per-process sampler
+thread. Every PROFILE_INTERVAL_MS that thread records the request's
+current Python stack. When the request ends, the stack counts are written
+as a collapsed-stack file, one "frame;frame;frame count" line per distinct
+stack. flamegraph.pl, speedscope and similar tools read this format.
+
+A request is profiled when either:
+- sampling is switched on from the admin page, for a random fraction of
+  requests. The setting lives in PROFILE_DIR, so every worker sees it.
+- it carries an X-Profile header with a token from the admin page, signed
+  with the app's secret key and valid for an hour.
+
+When neither applies the cost per request is a header lookup plus, at
+most once a second, a stat() of the settings file. Profiles are kept in a
+ring buffer of the newest PROFILE_MAX_FILES files.
+"""
+import hmac
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from hashlib import sha256
+from typing import Dict, List, Optional
+
+from flask import Flask, Response, current_app, g, request
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+# Deeper frames are cut off, keeps runaway recursion from bloating files
+MAX_DEPTH = 128
+SETTINGS_FILE = 'settings.json'
+SETTINGS_TTL = 1.0
+TOKEN_TTL = 3600
+HEADER = 'X-Profile'
+SUFFIX = '.collapsed'
+# <milliseconds>-<pid>-<sequence>-<endpoint>.collapsed
+FILENAME = re.compile(r'^(\d+)-(\d+)-(\d+)-([\w.]+)' + re.escape(SUFFIX) + '$')
+
+
+@dataclass
+class ProfileFile:
+    name: str
+    endpoint: str
+    created_at: datetime
+    size: int
+
+
+class Sampler:
+    """
+    Samples the stacks of registered threads from one background thread.
+    """
+
+    def __init__(self, interval: float = INTERVAL):
+        self.interval = interval
+        self._stacks: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def start(self, thread_id: int) -> None:
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            # Threads do not survive a fork, each worker starts its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+            self._wakeup.set()
+
+    def stop(self, thread_id: int) -> Counter:
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                idle = not self._stacks
+                if idle:
+                    self._wakeup.clear()
+            if idle:
+                # Until a request is profiled again
+                self._wakeup.wait()
+                continue
+
+            time.sleep(self.interval)
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            with self._lock:
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+sampler = Sampler()
+_sequence = itertools.count()
+_settings = {'rate': 0.0, 'checked_at': 0.0, 'mtime': None}
+
+
+def sample_rate() -> float:
+    """
+    Fraction of requests to profile, re-read from disk at most once a second.
+    """
+    now = time.monotonic()
+    if now - _settings['checked_at'] < SETTINGS_TTL:
+        return _settings['rate']
+
+    _settings['checked_at'] = now
+    path = os.path.join(PROFILE_DIR, SETTINGS_FILE)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        _settings['rate'] = 0.0
+        return 0.0
+
+    if mtime != _settings['mtime']:
+        try:
+            with open(path, encoding='utf-8') as source:
+                _settings['rate'] = float(json.load(source).get('rate', 0))
+        except (OSError, ValueError):
+            _settings['rate'] = 0.0
+        _settings['mtime'] = mtime
+    return _settings['rate']
+
+
+def set_sample_rate(rate: float) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    temporary = os.path.join(PROFILE_DIR, f'.{SETTINGS_FILE}.{os.getpid()}')
+    with open(temporary, 'w', encoding='utf-8') as output:
+        json.dump({'rate': rate}, output)
+    os.replace(temporary, os.path.join(PROFILE_DIR, SETTINGS_FILE))
+    _settings['checked_at'] = 0.0
+
+
+def _signature(expires: int) -> str:
+    return hmac.new(current_app.secret_key.encode(), f'profile:{expires}'.encode(), sha256).hexdigest()
+
+
+def make_token(ttl: int = TOKEN_TTL) -> str:
+    """
+    Value of the X-Profile header that profiles a request, valid for ttl seconds.
+    """
+    expires = int(time.time()) + ttl
+    return f'{expires}.{_signature(expires)}'
+
+
+def valid_token(token: str) -> bool:
+    expires, _, signature = token.partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(int(expires)))
+
+
+def _should_profile() -> bool:
+    token = request.headers.get(HEADER)
+    if token is not None:
+        return valid_token(token)
+    rate = sample_rate()
+    return rate > 0 and random.random() < rate
+
+
+def list_profiles() -> List[ProfileFile]:
+    """
+    Stored profiles, newest first.
+    """
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+
+    profiles = []
+    for name in names:
+        match = FILENAME.match(name)
+        if match is None:
+            continue
+        try:
+            size = os.path.getsize(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            continue  # Rotated out meanwhile
+        created_at = datetime.fromtimestamp(int(match.group(1)) / 1000, timezone.utc)
+        profiles.append(ProfileFile(name, match.group(4), created_at, size))
+    return sorted(profiles, key=lambda profile: profile.created_at, reverse=True)
+
+
+def _rotate() -> None:
+    for profile in list_profiles()[MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, profile.name))
+        except FileNotFoundError:
+            pass  # Another worker got there first
+
+
+def _write(endpoint: str, stacks: Counter) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f'{int(time.time() * 1000)}-{os.getpid()}-{next(_sequence)}-{endpoint}{SUFFIX}'
+    with open(os.path.join(PROFILE_DIR, name), 'w', encoding='utf-8') as output:
+        for stack, count in stacks.most_common():
+            output.write(f'{stack} {count}\n')
+    _rotate()
+
+
+def merged(endpoint: str) -> Counter:
+    """
+    Stack counts of every stored profile of an endpoint.
+    """
+    stacks: Counter = Counter()
+    for profile in list_profiles():
+        if profile.endpoint != endpoint:
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, profile.name), encoding='utf-8') as source:
+                for line in source:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    stacks[stack] += int(count)
+        except FileNotFoundError:
+            continue
+    return stacks
+
+
+def _before_request() -> None:
+    if _should_profile():
+        g.profiled_thread = threading.get_ident()
+        sampler.start(g.profiled_thread)
+
+
+def _teardown_request(_error) -> None:
+    thread_id = g.pop('profiled_thread', None)
+    if thread_id is None:
+        return
+
+    stacks = sampler.stop(thread_id)
+    if stacks:
+        _write(re.sub(r'[^\w.]', '_', request.endpoint or 'unmatched'), stacks)
+
+
+def _after_request(response: Response) -> Response:
+    if 'profiled_thread' in g:
+        response.headers['X-Profiled'] = '1'
+    return response
+
+
+def init_profiler(app: Flask) -> None:
+    """
+    Profile the requests selected as described above.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,116 @@
+import csv
+import io
+from typing import Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import Delete, Select, delete, insert, select
+from sqlalchemy.orm import Session as OrmSession
+from werkzeug.datastructures import MultiDict
+
+from models import ReadSession, RegistrationCode
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BULK_CODES = 1000
+CSV_HEADER = ('code', 'created_at')
+
+
+def redeem_statement(code: str) -> Delete:
+    """
+    Consume a registration code in one statement; returns its id if it existed.
+    """
+    return delete(RegistrationCode).where(RegistrationCode.code == code).returning(RegistrationCode.id)
+
+
+def code_exists(code: str) -> bool:
+    """
+    Whether the code can still be redeemed, read without taking the write lock.
+
+    Lets a signup reject an unknown code before paying for the password hash;
+    only redeem() decides whether the code is actually consumed.
+    """
+    with ReadSession() as session:
+        return session.execute(select(select(RegistrationCode.id).where(
+            RegistrationCode.code == code).exists())).scalar()
+
+
+def redeem(session: OrmSession, code: str) -> bool:
+    """
+    Delete the code within the session's transaction.
+
+    The deletion only sticks if the caller commits, so a signup that fails
+    afterwards rolls back and keeps the code usable. Two concurrent signups
+    with the same code cannot both succeed: only one DELETE returns a row.
+
+    Returns:
+        Whether the code existed
+    """
+    return session.execute(redeem_statement(code)).scalar() is not None
+
+
+def generate_codes(session: OrmSession, count: int) -> List[str]:
+    """
+    Insert count new codes in one batched statement, without committing.
+    """
+    codes = [str(uuid4()) for _ in range(count)]
+    session.execute(insert(RegistrationCode), [{'code': code} for code in codes])
+    return codes
+
+
+def get_page_args(args: MultiDict) -> Tuple[int, Optional[int]]:
+    """
+    Read the limit/after query parameters of the codes listing.
+
+    Returns:
+        Page size clamped to MAX_PAGE_SIZE and the id the page starts after, if any
+    """
+    limit = min(max(args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return limit, args.get('after', type=int)
+
+
+def codes_page_statement(limit: int, after: Optional[int] = None) -> Select:
+    """
+    Codes in creation order, starting after the given id.
+    """
+    statement = select(RegistrationCode.id, RegistrationCode.code, RegistrationCode.created_at)
+    if after is not None:
+        statement = statement.where(RegistrationCode.id > after)
+    return statement.order_by(RegistrationCode.id).limit(limit)
+
+
+def get_codes_page(limit: int = DEFAULT_PAGE_SIZE, after: Optional[int] = None) -> Tuple[list, Optional[int]]:
+    """
+    One page of registration codes.
+
+    Returns:
+        The codes and the id the next page starts after, None on the last page
+    """
+    with ReadSession() as session:
+        codes = session.execute(codes_page_statement(limit + 1, after)).all()
+
+    if len(codes) > limit:
+        return codes[:limit], codes[limit - 1].id
+
+    return codes, None
+
+
+def iter_codes_csv() -> Iterator[str]:
+    """
+    Every registration code as CSV, a line at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row) -> str:
+        writer.writerow(row)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(CSV_HEADER)
+    with ReadSession() as session:
+        rows = session.execute(select(RegistrationCode.code, RegistrationCode.created_at)
+                               .order_by(RegistrationCode.id).execution_options(yield_per=1000))
+        for code, created_at in rows:
+            yield line((code, created_at.isoformat() if created_at else ''))
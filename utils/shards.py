@@ -0,0 +1,156 @@
+"""
+Layout of the notes shards (models.shards).
+
+status  notes and file size per shard of the current layout (NOTE_SHARDS)
+split   move the notes of the current layout into --shards new shard files:
+        a single-file database is split, an existing set of shards is
+        rebalanced. Notes are renumbered so that id % shards is the shard of
+        their owner; the search index and feed are rebuilt in each file.
+
+Stop the app while splitting. The new files are built next to the old ones
+and only replace them once every note has been copied and counted; then
+start the app with NOTE_SHARDS set to the new count. Notes stay in the main
+file unless --drop-source is given.
+
+Usage: python -m utils.shards status | split --shards 4 [--drop-source] [--batch-size 5000]
+"""
+import argparse
+import os
+import sys
+from contextlib import ExitStack
+from typing import Dict, List, Tuple
+
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.engine import Connection, Engine
+
+from db_seed import bulk_loading
+from models import DATABASE_URL, engine, shards
+from models.migrations import migrate_shard
+from models.shards import shard_url
+
+SELECT_SQL = 'SELECT id, created_at, title, text, user_id, private FROM notes ORDER BY id'
+INSERT_SQL = 'INSERT INTO notes (id, created_at, title, text, user_id, private) VALUES (?, ?, ?, ?, ?, ?)'
+COUNT_SQL = text('SELECT count(*) FROM notes')
+VERSION_SQL = text("SELECT version FROM data_versions WHERE name = 'notes'")
+BUILD_SUFFIX = '.split'
+
+
+def _path(url: str) -> str:
+    return make_url(url).database
+
+
+def _remove(path: str) -> None:
+    for name in (path, path + '-wal', path + '-shm', path + '-journal'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def status() -> None:
+    print(f'{shards.count} shard(s), notes of user n in shard n % {shards.count}')
+    for index, shard in enumerate(shards.engines):
+        with shard.connect() as connection:
+            count = connection.execute(COUNT_SQL).scalar()
+        size = os.path.getsize(shard.url.database) / 1024 / 1024
+        print(f'shard {index}: {count} notes, {size:.1f} MiB  {shard.url.database}')
+
+
+def _copy(sources: List[Engine], targets: List[Connection], batch_size: int) -> Tuple[int, int]:
+    """
+    Copy every note of the sources into the target of its owner, renumbered.
+
+    Returns:
+        Notes copied and the sum of the sources' notes versions
+    """
+    count = len(targets)
+    copied = version = 0
+    for source in sources:
+        with source.connect() as connection:
+            version += connection.execute(VERSION_SQL).scalar() or 0
+            result = connection.execution_options(yield_per=batch_size).exec_driver_sql(SELECT_SQL)
+            for rows in result.partitions():
+                batches: Dict[int, list] = {}
+                for _, created_at, title, body, user_id, private in rows:
+                    shard = (user_id or 0) % count
+                    copied += 1
+                    # Unique across shards, and id % count == shard
+                    batches.setdefault(shard, []).append(
+                        (copied * count + shard, created_at, title, body, user_id, private))
+                for shard, batch in batches.items():
+                    targets[shard].exec_driver_sql(INSERT_SQL, batch)
+    return copied, version
+
+
+def split(count: int, drop_source: bool, batch_size: int) -> None:
+    builds = [shard_url(DATABASE_URL, index, BUILD_SUFFIX) for index in range(count)]
+    for build in builds:
+        _remove(_path(build))
+
+    targets = [create_engine(build) for build in builds]
+    for target in targets:
+        migrate_shard(target)
+
+    with ExitStack() as stack:
+        connections = [stack.enter_context(target.connect()) for target in targets]
+        for connection in connections:
+            stack.enter_context(bulk_loading(connection))
+
+        copied, version = _copy(shards.engines, connections, batch_size)
+        for connection in connections:
+            # Above every version served before, so no client keeps a stale ETag
+            connection.execute(text("UPDATE data_versions SET version = :version WHERE name = 'notes'"),
+                               {'version': version + 1})
+            connection.commit()
+
+    counts = []
+    for target in targets:
+        with target.connect() as connection:
+            counts.append(connection.execute(COUNT_SQL).scalar())
+        target.dispose()
+    if sum(counts) != copied:
+        for build in builds:
+            _remove(_path(build))
+        sys.exit(f'Copied {copied} notes but the new shards hold {sum(counts)}, nothing replaced')
+
+    old_paths = {shard.url.database for shard in shards.engines}
+    for shard in shards.engines + shards.read_engines:
+        shard.dispose()
+    for index, build in enumerate(builds):
+        final = _path(shard_url(DATABASE_URL, index))
+        _remove(final)
+        os.replace(_path(build), final)
+        old_paths.discard(final)
+
+    # Old shards beyond the new count; the main file is only emptied on request
+    main_path = _path(DATABASE_URL)
+    for path in old_paths - {main_path}:
+        _remove(path)
+    if drop_source and main_path in old_paths:
+        with engine.connect() as connection, bulk_loading(connection):
+            connection.exec_driver_sql('DELETE FROM notes')
+            connection.commit()
+
+    for index, notes in enumerate(counts):
+        print(f'shard {index}: {notes} notes')
+    print(f'{copied} notes split into {count} shards, start the app with NOTE_SHARDS={count}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Show or change how notes are sharded')
+    parser.add_argument('command', choices=['status', 'split'])
+    parser.add_argument('--shards', type=int, help='Number of shards to split into (split)')
+    parser.add_argument('--drop-source', action='store_true',
+                        help='Delete the notes from the main file after splitting it')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        status()
+        return
+
+    if args.shards is None or args.shards < 2:
+        parser.error('split needs --shards 2 or more')
+    split(args.shards, args.drop_source, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
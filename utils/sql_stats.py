@@ -0,0 +1,133 @@
+"""
+Per-request SQL statistics.
+
+Every statement a request runs is counted and timed, reusing the timing
+utils.metrics records for every statement. Responses to admins, or to
+everyone with SERVER_TIMING on, carry them in a Server-Timing header
+(visible in the browser's network panel):
+
+    Server-Timing: db;dur=3.2;desc="4 queries", app;dur=11.8
+
+Statements slower than SQL_SLOW_QUERY_MS are logged as they finish. When
+the request ends, statements run SQL_N_PLUS_ONE_THRESHOLD times or more
+are logged as suspected N+1 patterns, such as a lazy load per row in a
+template. The request's slowest statements are logged with it when its
+total database time exceeds SQL_SLOW_REQUEST_MS. Log records are single
+JSON objects on the 'sql' logger; bound parameters are never logged.
+"""
+import heapq
+import json
+import logging
+import os
+from collections import Counter
+from time import perf_counter
+from typing import List, Tuple
+
+from flask import Flask, Response, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy.engine import Engine
+
+from utils.metrics import add_query_listener, instrument_engine
+
+SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', 100))
+SLOW_REQUEST_MS = float(os.environ.get('SQL_SLOW_REQUEST_MS', 250))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+SLOWEST_KEPT = 3
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+logger = logging.getLogger('sql')
+
+
+class RequestStats:
+    """
+    SQL statements run by one request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+        self.slowest: List[Tuple[float, str]] = []
+
+    def add(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if len(self.slowest) < SLOWEST_KEPT:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        """
+        Statements run at least N_PLUS_ONE_THRESHOLD times, most repeated first.
+        """
+        return [(statement, count) for statement, count in self.statements.most_common()
+                if count >= N_PLUS_ONE_THRESHOLD]
+
+
+def _log(event_name: str, **fields) -> None:
+    fields = {'event': event_name, 'method': request.method, 'endpoint': request.endpoint,
+              'path': request.path, **fields}
+    logger.warning(json.dumps(fields))
+
+
+def _compact(statement: str) -> str:
+    return ' '.join(statement.split())
+
+
+def _record(statement: str, seconds: float) -> None:
+    # Statements outside a request (startup, CLI, image workers) are not attributed
+    if not has_request_context() or 'sql_stats' not in g:
+        return
+
+    g.sql_stats.add(statement, seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        _log('slow_query', duration_ms=round(seconds * 1000, 2), statement=_compact(statement))
+
+
+def _before_request() -> None:
+    g.sql_stats = RequestStats()
+    g.sql_stats_start = perf_counter()
+
+
+def _after_request(response: Response) -> Response:
+    stats = g.get('sql_stats')
+    # Query counts and timings are only disclosed to admins unless enabled for all
+    if stats is not None and (SERVER_TIMING or getattr(current_user, 'is_admin', False)):
+        # Streamed bodies query after the headers are sent, they only show up in the log
+        elapsed = perf_counter() - g.sql_stats_start
+        queries = f"{stats.count} {'query' if stats.count == 1 else 'queries'}"
+        response.headers.add('Server-Timing', f'db;dur={stats.seconds * 1000:.1f};desc="{queries}", '
+                                              f'app;dur={elapsed * 1000:.1f}')
+    return response
+
+
+def _teardown_request(_error) -> None:
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return
+
+    for statement, count in stats.repeated():
+        _log('n_plus_one', count=count, statement=_compact(statement))
+
+    if stats.seconds * 1000 >= SLOW_REQUEST_MS:
+        _log('slow_request', queries=stats.count, db_ms=round(stats.seconds * 1000, 2),
+             slowest=[{'duration_ms': round(seconds * 1000, 2), 'statement': _compact(statement)}
+                      for seconds, statement in sorted(stats.slowest, reverse=True)])
+
+
+def init_sql_stats(app: Flask, *engines: Engine) -> None:
+    """
+    Collect per-request SQL statistics and report them as described above.
+
+    Args:
+        app: Flask application
+        engines: SQLAlchemy engines backing the app's sessions
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    add_query_listener(_record)
+    for engine in engines:
+        instrument_engine(engine)
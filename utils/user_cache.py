@@ -0,0 +1,126 @@
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+from flask_login import UserMixin
+
+from models import User
+
+
+@dataclass(frozen=True)
+class CachedUser(UserMixin):
+    """
+    Detached, read-only view of a User for current_user.
+    """
+    id: int
+    email: str
+    is_admin: bool
+    profile_image_etag: Optional[str]
+
+    @classmethod
+    def from_user(cls, user: User) -> 'CachedUser':
+        return cls(user.id, user.email, bool(user.is_admin), user.profile_image_etag)
+
+
+class SharedGenerations:
+    """
+    Per-user invalidation counters in a memory-mapped file shared by all workers.
+
+    Users hash into a fixed number of slots; a collision only causes an extra
+    cache miss. Increments are not atomic across processes, but a lost update
+    still moves the counter away from what readers cached, which is all
+    invalidation needs.
+    """
+    SLOTS = 4096
+    SLOT = struct.Struct('I')
+
+    def __init__(self, path: str):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < self.SLOTS * self.SLOT.size:
+                os.ftruncate(fd, self.SLOTS * self.SLOT.size)
+            self._map = mmap.mmap(fd, self.SLOTS * self.SLOT.size)
+        finally:
+            os.close(fd)
+
+    def _offset(self, user_id: int) -> int:
+        return (user_id % self.SLOTS) * self.SLOT.size
+
+    def get(self, user_id: int) -> int:
+        return self.SLOT.unpack_from(self._map, self._offset(user_id))[0]
+
+    def bump(self, user_id: int) -> None:
+        self.SLOT.pack_into(self._map, self._offset(user_id), (self.get(user_id) + 1) & 0xFFFFFFFF)
+
+
+class UserCache:
+    """
+    Bounded LRU of CachedUser snapshots with a time-to-live.
+
+    Args:
+        max_size: Maximum number of cached users
+        ttl: Seconds before an entry is reloaded from the database
+        shared: Optional cross-process invalidation counters
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300, shared: Optional[SharedGenerations] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def _generation(self, user_id: int) -> int:
+        return self.shared.get(user_id) if self.shared else 0
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            user, expires_at, generation = entry
+            if expires_at < monotonic() or generation != self._generation(user_id):
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user: CachedUser) -> CachedUser:
+        with self._lock:
+            self._entries[user.id] = (user, monotonic() + self.ttl, self._generation(user.id))
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        Drop a user after it changed, in this worker and, if shared, in all others.
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+            if self.shared:
+                self.shared.bump(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _from_env() -> UserCache:
+    shared_file = os.environ.get('USER_CACHE_SHARED_FILE')
+    return UserCache(
+        max_size=int(os.environ.get('USER_CACHE_SIZE', 1024)),
+        ttl=float(os.environ.get('USER_CACHE_TTL', 300)),
+        shared=SharedGenerations(shared_file) if shared_file else None,
+    )
+
+
+user_cache = _from_env()
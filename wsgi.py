@@ -0,0 +1,4 @@
+from app import create_app
+
+# uWSGI entry point (module = wsgi:app); run `flask --app app init-db` first
+app = create_app()